@@ -11,12 +11,14 @@ import warnings
 from sqlalchemy.types import ARRAY as Array
 from sqlalchemy import Column, DateTime, String, Integer, Float, ForeignKey
 from sqlalchemy.types import JSON
-from sqlalchemy.orm import relationship, backref
+from sqlalchemy.orm import relationship, backref, object_session
 from sqlalchemy import event
 from sqlalchemy import DDL
 
 from manager.setup import db, Base
 from manager.question import Question
+from manager.answer_summary import generate_summary, generate_summaries
+from manager.answer_standard import standard_batch_size, standardize_answer, standardize_edge, standardize_node, iter_standard
 
 logger = logging.getLogger(__name__)
 
@@ -88,23 +90,53 @@ class Answerset(db.Model):
         response_code
         result_list
         '''
+        output = self.standard_header()
+        output['result_list'] = list(self.iter_standard()) if data else None
+        return output
+
+    def standard_header(self):
+        '''toStandard() output without result_list. No answers are loaded.'''
         keys = self.__mapper__._props.keys()+[k for k in self.__dict__.keys() if not k.startswith('_')]
-        struct = {key:getattr(self, key) for key in keys}
+        struct = {key:getattr(self, key) for key in keys if key != 'answers'}
         if 'timestamp' in struct:
             struct['timestamp'] = struct['timestamp'].isoformat()
 
+        num_answers = self.answer_count()
         natural_question = struct['misc_info']['natural_question'] if 'mics_info' in struct else None
         output = {
             'context': 'context',
             'datetime': struct['timestamp'],
             'id': struct['id'],
-            'message': f"{len(self.answers)} potential answers found.",
+            'message': f"{num_answers} potential answers found.",
             'original_question_text': natural_question,\
-            'response_code': 'OK' if self.answers else 'EMPTY',
-            'result_list': [a.toStandard() for a in self.answers] if data else None
+            'response_code': 'OK' if num_answers else 'EMPTY',
         }
         return output
 
+    def _answer_query(self):
+        '''Query for the answers of a stored answerset, or None if they are already in memory.'''
+        session = object_session(self)
+        if 'answers' in self.__dict__ or session is None:
+            return None
+        return session.query(Answer).filter(Answer.answerset_id == self.id)
+
+    def answer_count(self):
+        '''Number of answers, counted in the database for stored answersets.'''
+        query = self._answer_query()
+        return len(self.answers) if query is None else query.count()
+
+    def iter_answers(self, batch_size=None):
+        '''Answers by descending score, fetched from the database batch_size rows at a time.'''
+        query = self._answer_query()
+        if query is None:
+            return iter(self.answers)
+        return query.order_by(Answer.score.desc()).yield_per(batch_size or standard_batch_size)
+
+    def iter_standard(self, batch_size=None):
+        '''Yield standardized answers one at a time, reading them batch_size at a time.'''
+        batch_size = batch_size or standard_batch_size
+        return iter_standard((a.to_json() for a in self.iter_answers(batch_size)), batch_size)
+
     def __getitem__(self, key):
         return self.answers[key]
         
@@ -211,85 +243,13 @@ class Answer(db.Model):
         text
         '''
         json = self.to_json()
-        for n in json['nodes']:
-            if 'name' not in n:
-                n['name'] = "<unknown>"
-        summary = generate_summary(json['nodes'], json['edges'])
-        output = {
-            'confidence': json['score'],
-            'id': json['id'],
-            'result_graph': {
-                'node_list': [standardize_node(n) for n in json['nodes']],
-                'edge_list': [standardize_edge(e) for e in json['edges']]
-            },
-            'result_type': 'individual query answer',
-            'text': summary
-        }
-        return output
+        summary, = generate_summaries([json])
+        return Answer.standardize(json, summary)
 
-def generate_summary(nodes, edges):
-    # assume that the first node is at one end
-    logger.debug(nodes)
-    logger.debug(edges)
-    summary = nodes[0]['name']
-    latest_node_id = nodes[0]['id']
-    node_ids = [n['id'] for n in nodes]
-    edges = [e for e in edges if not e['type'] == 'literature_co-occurrence']
-    edge_starts = [e['source_id'] for e in edges]
-    edge_ends = [e['target_id'] for e in edges]
-    edge_predicates = [e['type'] for e in edges]
-    while True:
-        if latest_node_id in edge_starts:
-            idx = edge_starts.index(latest_node_id)
-            edge_starts.pop(idx)
-            latest_node_id = edge_ends.pop(idx)
-            latest_node = nodes[node_ids.index(latest_node_id)]
-            summary += f" -{edge_predicates.pop(idx)}-> {latest_node['name']}"
-        elif latest_node_id in edge_ends:
-            idx = edge_ends.index(latest_node_id)
-            edge_ends.pop(idx)
-            latest_node_id = edge_starts.pop(idx)
-            latest_node = nodes[node_ids.index(latest_node_id)]
-            summary += f" <-{edge_predicates.pop(idx)}- {latest_node['name']}"
-        else:
-            break
-    return summary
-
-def standardize_edge(edge):
-    '''
-    confidence
-    provided_by
-    source_id
-    target_id
-    type
-    '''
-    output = {
-        'confidence': edge['weight'],
-        'provided_by': edge['edge_source'],
-        'source_id': edge['source_id'],
-        'target_id': edge['target_id'],
-        'type': edge['type'],
-        'publications': edge['publications'],
-        'num_publications': len(edge['publications']) + (edge['num_publications'] if 'num_publications' in edge else 0)
-    }
-    return output
-
-def standardize_node(node):
-    '''
-    description
-    id
-    name
-    node_attributes
-    symbol
-    type
-    '''
-    output = {
-        'description': node['name'],
-        'id': node['id'],
-        'name': node['name'],
-        'type': node['type']
-    }
-    return output
+    @staticmethod
+    def standardize(json, summary):
+        '''Standardize the to_json() output of an answer with a generated summary.'''
+        return standardize_answer(json, summary)
 
 def list_answersets(session=None):
     if session is None:
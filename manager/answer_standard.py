@@ -0,0 +1,105 @@
+'''
+The standard answer format, built from plain answer dicts
+
+Answers are the to_json() output of manager.answer.Answer, or any dicts
+with the same keys: id, score, nodes and edges.
+'''
+
+import json
+import logging
+
+from manager.answer_summary import generate_summaries
+from manager.message_formats import json_array
+
+logger = logging.getLogger(__name__)
+
+# Answers summarized together by iter_standard
+standard_batch_size = 1000
+
+
+def standardize_edge(edge):
+    '''
+    confidence
+    provided_by
+    source_id
+    target_id
+    type
+    '''
+    output = {
+        'confidence': edge['weight'],
+        'provided_by': edge['edge_source'],
+        'source_id': edge['source_id'],
+        'target_id': edge['target_id'],
+        'type': edge['type'],
+        'publications': edge['publications'],
+        'num_publications': len(edge['publications']) + (edge['num_publications'] if 'num_publications' in edge else 0)
+    }
+    return output
+
+
+def standardize_node(node):
+    '''
+    description
+    id
+    name
+    node_attributes
+    symbol
+    type
+    '''
+    output = {
+        'description': node['name'],
+        'id': node['id'],
+        'name': node['name'],
+        'type': node['type']
+    }
+    return output
+
+
+def standardize_answer(answer, summary):
+    '''Standardize an answer dict with a generated summary.'''
+    output = {
+        'confidence': answer['score'],
+        'id': answer['id'],
+        'result_graph': {
+            'node_list': [standardize_node(n) for n in answer['nodes']],
+            'edge_list': [standardize_edge(e) for e in answer['edges']]
+        },
+        'result_type': 'individual query answer',
+        'text': summary
+    }
+    return output
+
+
+def standardize_answers(answers):
+    '''Standardize many answer dicts, summarizing them in one batch.'''
+    summaries = generate_summaries(answers)
+    return [standardize_answer(a, summary) for a, summary in zip(answers, summaries)]
+
+
+def iter_standard(answers, batch_size=None):
+    '''
+    Yield standardized answers one at a time.
+
+    answers may be any iterable of answer dicts, e.g. a generator over
+    database rows. They are summarized batch_size at a time, so only one
+    batch of them is held in memory.
+    '''
+    batch_size = batch_size or standard_batch_size
+    batch = []
+    for answer in answers:
+        batch.append(answer)
+        if len(batch) >= batch_size:
+            yield from standardize_answers(batch)
+            batch = []
+    yield from standardize_answers(batch)
+
+
+def standard_stream(header, answers, batch_size=None):
+    '''
+    A standard format answerset as JSON bytes: header with a result_list
+    of the standardized answers, encoded as they are standardized.
+    '''
+    opening = json.dumps(header)[:-1] + (', ' if header else '') + '"result_list": '
+    yield opening.encode('utf-8')
+    yield from json_array(json.dumps(result).encode('utf-8') for result in iter_standard(answers, batch_size))
+    yield b'}'
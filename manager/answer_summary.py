@@ -0,0 +1,74 @@
+'''
+Text summaries of answer walks
+'''
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def generate_summary(nodes, edges):
+    '''
+    Describe the walk through an answer's nodes and edges as text.
+
+    The walk starts at the first node and at each step follows the first
+    unused edge leaving the current node, or failing that the first unused
+    edge entering it. Literature co-occurrence edges are skipped.
+    '''
+    # assume that the first node is at one end
+    logger.debug(nodes)
+    logger.debug(edges)
+    # The first node with an id names it
+    names = {node['id']: node['name'] for node in reversed(nodes)}
+
+    # Unused edges by the node they leave and the node they enter, the
+    # first at the end of each list. Used edges are dropped lazily.
+    walk = [e for e in edges if e['type'] != 'literature_co-occurrence']
+    outgoing = {}
+    incoming = {}
+    for idx in range(len(walk) - 1, -1, -1):
+        edge = walk[idx]
+        outgoing.setdefault(edge['source_id'], []).append(idx)
+        incoming.setdefault(edge['target_id'], []).append(idx)
+    used = [False] * len(walk)
+
+    latest_node_id = nodes[0]['id']
+    parts = [nodes[0]['name']]
+    while True:
+        stack = outgoing.get(latest_node_id)
+        while stack and used[stack[-1]]:
+            stack.pop()
+        if stack:
+            idx = stack.pop()
+            edge = walk[idx]
+            latest_node_id = edge['target_id']
+            parts.append(f" -{edge['type']}-> {names[latest_node_id]}")
+        else:
+            stack = incoming.get(latest_node_id)
+            while stack and used[stack[-1]]:
+                stack.pop()
+            if not stack:
+                break
+            idx = stack.pop()
+            edge = walk[idx]
+            latest_node_id = edge['source_id']
+            parts.append(f" <-{edge['type']}- {names[latest_node_id]}")
+        used[idx] = True
+    return ''.join(parts)
+
+
+def generate_summaries(answers):
+    '''
+    Summaries of many answers (dicts with nodes and edges) at once.
+
+    Nodes whose names are missing are called "<unknown>", as in
+    Answer.toStandard.
+    '''
+    summaries = []
+    for answer in answers:
+        nodes = answer['nodes']
+        for node in nodes:
+            if 'name' not in node:
+                node['name'] = "<unknown>"
+        summaries.append(generate_summary(nodes, answer['edges']))
+    return summaries
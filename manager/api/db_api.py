@@ -0,0 +1,48 @@
+'''
+Blueprint for /api/db/* endpoints
+'''
+
+import logging
+
+from flask_restful import Resource
+
+from manager.setup import api
+from manager.setup_db import pool_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class DatabasePool(Resource):
+    def get(self):
+        """
+        Get database connection pool metrics
+        ---
+        tags: [util]
+        responses:
+            200:
+                description: Pool size and use
+                content:
+                    application/json:
+                        schema:
+                            type: object
+                            properties:
+                                size:
+                                    type: integer
+                                checked_out:
+                                    type: integer
+                                checked_in:
+                                    type: integer
+                                overflow:
+                                    type: integer
+                                connects:
+                                    type: integer
+                                checkouts:
+                                    type: integer
+                                wait_seconds_total:
+                                    type: number
+                                wait_seconds_max:
+                                    type: number
+        """
+        return pool_metrics.snapshot()
+
+api.add_resource(DatabasePool, '/db/pool/')
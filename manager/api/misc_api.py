@@ -6,13 +6,20 @@ import os
 import sys
 import json
 import time
+from functools import partial
+
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout, wait as futures_wait
 
 import requests
-from flask import request, Response
+from flask import request, Response, jsonify
 from flask_restful import Resource, abort
 
 from manager.setup import app, api
 from manager.logging_config import logger
+from manager.cache import TTLCache, LRUCache, SQLiteCache, TieredCache
+from manager.upstream import upstream, UpstreamUnavailable, connect_timeout
+from manager.pubmed import PubmedCache, CacheUnavailable as PubmedCacheUnavailable
+from manager.publications import PublicationStore, normalize_pmid, fields as publication_fields
 
 
 concept_map = {}
@@ -25,6 +32,41 @@ except Exception as e:
         'misc_api.py:: Could not '
         f'find/read concept_map.json - {e}')
 
+# Seconds Predicates.post waits for the builder to rebuild the predicates
+predicates_refresh_timeout = float(os.environ.get('PREDICATES_REFRESH_TIMEOUT', 600))
+
+@app.errorhandler(UpstreamUnavailable)
+def handle_upstream_unavailable(ex):
+    """Upstream service skipped by its circuit breaker."""
+    return str(ex), 503
+
+@app.errorhandler(requests.exceptions.Timeout)
+def handle_upstream_timeout(ex):
+    """Upstream service too slow."""
+    logger.warning(f'Upstream timeout: {ex}')
+    return 'Upstream service timed out', 504
+
+# Builder metadata only changes when the predicates are rebuilt (see
+# Predicates.post). Stale lists are served while they are refreshed.
+metadata_cache = TTLCache(
+    ttl=int(os.environ.get('METADATA_CACHE_TTL', 300)),
+    stale=int(os.environ.get('METADATA_CACHE_STALE', 3600)))
+
+def builder_metadata(name):
+    r = upstream.get(f"http://{os.environ['BUILDER_HOST']}:{os.environ['BUILDER_PORT']}/api/{name}")
+    r.raise_for_status()
+    return r.json()
+
+def cached_metadata(name, loader=None):
+    '''Response holding builder metadata from metadata_cache, with an ETag.'''
+    entry = metadata_cache.get_entry(name, loader or (lambda: builder_metadata(name)))
+    response = jsonify(entry.value)
+    response.set_etag(entry.etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = metadata_cache.ttl
+    response.cache_control.stale_while_revalidate = metadata_cache.stale
+    return response.make_conditional(request)
+
 class Concepts(Resource):
     def get(self):
         """
@@ -41,17 +83,150 @@ class Concepts(Resource):
                             items:
                                 type: string
         """
-        r = requests.get(f"http://{os.environ['BUILDER_HOST']}:{os.environ['BUILDER_PORT']}/api/concepts")
-        concepts = r.json()
-        bad_concepts =['NAME.DISEASE', 'NAME.PHENOTYPE', 'NAME.DRUG']
-        concepts = [c for c in concepts if not c in bad_concepts]
-        concepts.sort()
+        def load_concepts():
+            concepts = builder_metadata('concepts')
+            bad_concepts =['NAME.DISEASE', 'NAME.PHENOTYPE', 'NAME.DRUG']
+            concepts = [c for c in concepts if not c in bad_concepts]
+            concepts.sort()
+            return concepts
 
-        return concepts
+        return cached_metadata('concepts', load_concepts)
 
 api.add_resource(Concepts, '/concepts/')
 
 
+# Ranker lookups run at once for batch Omnicorp requests
+omnicorp_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('OMNICORP_CONCURRENCY', 8)))
+
+# Most pairs accepted by one batch Omnicorp request
+omnicorp_batch_max = int(os.environ.get('OMNICORP_BATCH_MAX', 1000))
+
+# Omnicorp publications hardly ever change. They are kept in memory by
+# each worker and on disk in a file shared by all workers, for
+# OMNICORP_CACHE_TTL seconds.
+omnicorp_cache_dir = f"{os.environ['ROBOKOP_HOME']}/cache/"
+os.makedirs(omnicorp_cache_dir, exist_ok=True)
+omnicorp_cache = TieredCache(
+    LRUCache(int(os.environ.get('OMNICORP_CACHE_SIZE', 100000))),
+    SQLiteCache(
+        os.environ.get('OMNICORP_CACHE_PATH', os.path.join(omnicorp_cache_dir, 'omnicorp.sqlite')),
+        ttl=int(os.environ.get('OMNICORP_CACHE_TTL', 30 * 24 * 3600)) or None))
+
+def omnicorp_key(id1, id2=None):
+    """Cache key of a lookup. Pairs are unordered, so (a, b) and (b, a) share one."""
+    if id2 is None:
+        return id1
+    return '|'.join(sorted((id1, id2)))
+
+def fetch_omnicorp_publications(id1, id2=None):
+    """Publications mentioning id1 (and id2), from the ranker."""
+    path = f'{id1}/{id2}' if id2 is not None else id1
+    r = upstream.get(f"http://{os.environ['RANKER_HOST']}:{os.environ['RANKER_PORT']}/api/omnicorp/{path}")
+    r.raise_for_status()
+    return r.json()
+
+def omnicorp_publications(id1, id2=None):
+    """Publications mentioning id1 (and id2), from omnicorp_cache or the ranker."""
+    return omnicorp_cache.get(omnicorp_key(id1, id2), lambda: fetch_omnicorp_publications(id1, id2))
+
+def parse_omnicorp_batch(body):
+    """Pairs of curies requested by a batch Omnicorp body."""
+    if not isinstance(body, dict):
+        raise RuntimeError('Expected a JSON object with pairs or curies')
+    if 'curies' in body:
+        curies = body['curies']
+        if not isinstance(curies, list) or not all(isinstance(c, str) for c in curies):
+            raise RuntimeError('curies must be a list of strings')
+        curies = list(dict.fromkeys(curies))
+        pairs = [[a, b] for i, a in enumerate(curies) for b in curies[i + 1:]]
+    else:
+        pairs = body.get('pairs')
+        if not isinstance(pairs, list) or \
+                not all(isinstance(p, list) and len(p) == 2 and all(isinstance(c, str) for c in p) for p in pairs):
+            raise RuntimeError('pairs must be a list of [curie, curie] lists')
+    if len(pairs) > omnicorp_batch_max:
+        raise RuntimeError(f'At most {omnicorp_batch_max} pairs can be looked up at once')
+    return pairs
+
+class OmnicorpBatch(Resource):
+    def post(self):
+        """
+        Get publications for many pairs of identifiers
+        Pairs are looked up concurrently. Results are in the order of the
+        requested pairs; pairs that could not be looked up have null
+        publications and an error.
+        ---
+        tags: [util]
+        requestBody:
+            description: "Either pairs of curies, or curies to look up every pair of"
+            content:
+                application/json:
+                    schema:
+                        type: object
+                        properties:
+                            pairs:
+                                type: array
+                                items:
+                                    type: array
+                                    items:
+                                        type: string
+                            curies:
+                                type: array
+                                items:
+                                    type: string
+                    example:
+                        pairs: [["MONDO:0005737", "HGNC:7897"]]
+            required: true
+        responses:
+            200:
+                description: publications of each pair
+                content:
+                    application/json:
+                        schema:
+                            type: array
+                            items:
+                                type: object
+                                properties:
+                                    pair:
+                                        type: array
+                                        items:
+                                            type: string
+                                    publications:
+                                        type: array
+                                        items:
+                                            type: string
+                                    error:
+                                        type: string
+            400:
+                description: Invalid request body
+        """
+        try:
+            pairs = parse_omnicorp_batch(request.get_json(silent=True))
+        except RuntimeError as err:
+            return str(err), 400
+
+        # Cached pairs are read in one pass, only the others go to the ranker
+        cached = omnicorp_cache.get_many(omnicorp_key(id1, id2) for id1, id2 in pairs)
+        futures = {}
+        for id1, id2 in pairs:
+            key = omnicorp_key(id1, id2)
+            if key not in cached and key not in futures:
+                futures[key] = omnicorp_pool.submit(
+                    omnicorp_cache.load, key, partial(fetch_omnicorp_publications, id1, id2))
+        results = []
+        for pair in pairs:
+            key = omnicorp_key(*pair)
+            try:
+                publications = cached[key] if key in cached else futures[key].result()
+                results.append({'pair': pair, 'publications': publications})
+            except (requests.exceptions.RequestException, ValueError) as err:
+                logger.warning(f'Omnicorp lookup of {pair} failed: {err}')
+                results.append({'pair': pair, 'publications': None, 'error': str(err)})
+        return results
+
+api.add_resource(OmnicorpBatch, '/omnicorp/')
+
+
 class Omnicorp(Resource):
     def get(self, id1, id2):
         """
@@ -84,8 +259,7 @@ class Omnicorp(Resource):
                                 type: string
         """
 
-        r = requests.get(f"http://{os.environ['RANKER_HOST']}:{os.environ['RANKER_PORT']}/api/omnicorp/{id1}/{id2}")
-        return r.json()
+        return omnicorp_publications(id1, id2)
 
 api.add_resource(Omnicorp, '/omnicorp/<id1>/<id2>')
 
@@ -115,12 +289,39 @@ class Omnicorp1(Resource):
                                 type: string
         """
 
-        r = requests.get(f"http://{os.environ['RANKER_HOST']}:{os.environ['RANKER_PORT']}/api/omnicorp/{id1}")
-        return r.json()
+        return omnicorp_publications(id1)
 
 api.add_resource(Omnicorp1, '/omnicorp/<id1>')
 
 
+class OmnicorpCache(Resource):
+    def get(self):
+        """
+        Get hit and miss counts of the Omnicorp cache of this worker
+        ---
+        tags: [util]
+        responses:
+            200:
+                description: cache counters
+                content:
+                    application/json:
+                        schema:
+                            type: object
+                            properties:
+                                memory_entries:
+                                    type: integer
+                                memory_hits:
+                                    type: integer
+                                disk_hits:
+                                    type: integer
+                                misses:
+                                    type: integer
+        """
+        return omnicorp_cache.stats()
+
+api.add_resource(OmnicorpCache, '/omnicorp/cache/')
+
+
 class Connections(Resource):
     def get(self):
         """
@@ -137,10 +338,7 @@ class Connections(Resource):
                             items:
                                 type: string
         """
-        r = requests.get(f"http://{os.environ['BUILDER_HOST']}:{os.environ['BUILDER_PORT']}/api/connections")
-        connections = r.json()
-
-        return connections
+        return cached_metadata('connections')
 
 api.add_resource(Connections, '/connections/')
     
@@ -160,10 +358,7 @@ class Operations(Resource):
                             items:
                                 type: string
         """
-        r = requests.get(f"http://{os.environ['BUILDER_HOST']}:{os.environ['BUILDER_PORT']}/api/operations")
-        operations = r.json()
-
-        return operations
+        return cached_metadata('operations')
 
 api.add_resource(Operations, '/operations/')
 
@@ -181,11 +376,7 @@ class Predicates(Resource):
                         schema:
                             type: object
         """
-        get_url = f"http://{os.environ['BUILDER_HOST']}:{os.environ['BUILDER_PORT']}/api/predicates"
-        r = requests.get(get_url)
-        operations = r.json()
-
-        return operations
+        return cached_metadata('predicates')
 
     def post(self):
         """
@@ -208,7 +399,11 @@ class Predicates(Resource):
         """
         post_url = f"http://{os.environ['BUILDER_HOST']}:{os.environ['BUILDER_PORT']}/api/predicates"
         logger.debug(f'Predicates:post:: Trying to post to: {post_url}')
-        response = requests.post(post_url)
+        # Rebuilding the predicates takes a while
+        response = upstream.post(post_url, timeout=(connect_timeout, predicates_refresh_timeout))
+        if response.ok:
+            # Connections, operations etc. are derived from the same graph
+            metadata_cache.invalidate()
         return Response(response.content, response.status_code)
 
 api.add_resource(Predicates, '/predicates/')
@@ -225,17 +420,77 @@ class Properties(Resource):
                 content:
                     application/json:
         """
-        r = requests.get(f"http://{os.environ['BUILDER_HOST']}:{os.environ['BUILDER_PORT']}/api/properties")
-        props = r.json()
-
-        return props
+        return cached_metadata('properties')
 
 api.add_resource(Properties, '/properties/')
 
+# Seconds a PubMed request waits for summaries that are not cached before
+# answering 202 and letting the client poll
+pubmed_wait = float(os.environ.get('PUBMED_WAIT', 30))
+
+# Most PMIDs accepted by one bulk PubMed request
+pubmed_batch_max = int(os.environ.get('PUBMED_BATCH_MAX', 1000))
+
+pubmed_cache = PubmedCache()
+
+# Publications imported with python -m manager.publications are answered
+# from this file without asking redis or PubMed
+publication_store = PublicationStore()
+
+@app.errorhandler(PubmedCacheUnavailable)
+def handle_pubmed_cache_unavailable(ex):
+    """PubMed redis cache unreachable."""
+    logger.warning(str(ex))
+    return str(ex), 503
+
+def respond_async():
+    """Whether the client asked to poll rather than wait for summaries being fetched."""
+    return request.args.get('async', 'false').lower() == 'true' or \
+        'respond-async' in request.headers.get('Prefer', '')
+
+def pubmed_result(pmid, future):
+    """Summary fetched by a done future as (summary, None), or (None, (error, status))."""
+    try:
+        return future.result(timeout=0), None
+    except Exception as err:
+        pubmed_cache.forget(pmid, future)
+        if isinstance(err, KeyError):
+            return None, (f'Pubmed info of {pmid} could not be found', 404)
+        logger.warning(f'Fetching Pubmed info of {pmid} failed: {err}')
+        return None, (f'Fetching Pubmed info of {pmid} failed: {err}', 502)
+
+def parse_pmids(body):
+    """PMIDs (without PMID: prefixes) and fields requested by a bulk PubMed body."""
+    pmids = body.get('pmids') if isinstance(body, dict) else None
+    if not isinstance(pmids, list) or not all(isinstance(pmid, (str, int)) for pmid in pmids):
+        raise RuntimeError('Expected a JSON object with a list of pmids')
+    if len(pmids) > pubmed_batch_max:
+        raise RuntimeError(f'At most {pubmed_batch_max} pmids can be looked up at once')
+    normalized = [normalize_pmid(pmid) for pmid in pmids]
+    invalid = [pmid for pmid, number in zip(pmids, normalized) if number is None]
+    if invalid:
+        raise RuntimeError(f'Invalid pmids: {invalid[:10]}')
+    fields = body.get('fields')
+    if fields is None:
+        return list(dict.fromkeys(normalized)), None
+    if not isinstance(fields, list) or not fields or not set(fields) <= set(publication_fields):
+        raise RuntimeError(f'fields must be a list of some of {list(publication_fields)}')
+    return list(dict.fromkeys(normalized)), tuple(dict.fromkeys(fields))
+
+def select_fields(info, fields):
+    """The given fields of a publication summary, or all of it when fields is None."""
+    if fields is None:
+        return info
+    return {field: info.get(field) for field in fields}
+
 class Pubmed(Resource):
     def get(self, pmid):
         """
         Get pubmed publication from id
+        Publications that are not cached yet are fetched from PubMed. The
+        request waits for them for a while, or not at all when async=true
+        is given or the Prefer header contains respond-async, and then
+        answers 202 with a Location to poll.
         ---
         tags: [util]
         parameters:
@@ -246,49 +501,165 @@ class Pubmed(Resource):
                 type: string
             required: true
             default: "10924274"
+          - in: query
+            name: async
+            description: "Answer 202 right away instead of waiting for PubMed"
+            schema:
+                type: boolean
+            default: false
         responses:
             200:
                 description: pubmed publication
                 content:
                     application/json:
+            202:
+                description: "Publication is being fetched, poll the Location"
+            400:
+                description: Invalid pmid
+            404:
+                description: No such publication
         """
-        
-        # logger.debug(f'Fetching pubmed info for pmid {pmid}')
-
-        pubmed_redis_client = redis.Redis(
-            host=os.environ['PUBMED_CACHE_HOST'],
-            port=os.environ['PUBMED_CACHE_PORT'],
-            db=os.environ['PUBMED_CACHE_DB'],
-            password=os.environ['PUBMED_CACHE_PASSWORD'])
-
-        pubmed_cache_key = f'robokop_pubmed_cache_{pmid}'
-        pm_string = pubmed_redis_client.get(pubmed_cache_key)
-        if pm_string is None:
-            # logger.debug(f'Pubmed info for {pmid} not found in cache. Fetching from pubmed')
-
-            result = fetch_pubmed_info.apply_async(
-                args=[pmid, pubmed_cache_key]
-            )
-            
-            try:
-                task_status = result.get() # Blocking call to wait for task completion
-            except (redis.exceptions.InvalidResponse, redis.exceptions.ConnectionError) as err:
-                return "Celery results is bad: " + str(err), 500
-
-            if task_status != 'cached':
-                return task_status, 500
-            
-            pm_string = pubmed_redis_client.get(pubmed_cache_key)
-            if pm_string is None:
-                return 'Pubmed info could not be found', 500
-        
-        pubmed_info = json.loads(pm_string)
-        # logger.debug(f'Pubmed info for {pmid} found in cache.')
-        
-        return pubmed_info, 200
+        number = normalize_pmid(pmid)
+        if number is None:
+            return f'Invalid pmid: {pmid}', 400
+        pmid = number
+        stored = publication_store.get_many([pmid])
+        if pmid in stored:
+            return stored[pmid], 200
+
+        found, pending = pubmed_cache.lookup([pmid])
+        if pmid in found:
+            return found[pmid], 200
+
+        future = pending[pmid]
+        futures_wait([future], timeout=0 if respond_async() else pubmed_wait)
+        if not future.done():
+            return {'pmid': pmid, 'status': 'pending'}, 202, {
+                'Location': f'{request.path}?async=true',
+                'Retry-After': '1',
+            }
+        info, error = pubmed_result(pmid, future)
+        if error:
+            return error
+        return info, 200
 
 api.add_resource(Pubmed, '/pubmed/<pmid>')
 
+
+class PubmedBulk(Resource):
+    def post(self):
+        """
+        Get many pubmed publications from ids
+        Publications are read from the local publication store, then from
+        the cache. The others are fetched from PubMed; the request waits for
+        them like GET /pubmed/{pmid} does and lists those still being
+        fetched as pending (with status 202), to be requested again. PMIDs
+        may be given as PMID: curies and are answered without the prefix.
+        ---
+        tags: [util]
+        parameters:
+          - in: query
+            name: async
+            description: "Answer right away instead of waiting for PubMed"
+            schema:
+                type: boolean
+            default: false
+        requestBody:
+            content:
+                application/json:
+                    schema:
+                        type: object
+                        properties:
+                            pmids:
+                                type: array
+                                items:
+                                    type: string
+                            fields:
+                                type: array
+                                description: "Fields of each publication to return, all there are by default"
+                                items:
+                                    type: string
+                                    enum: [uid, title, authors, fulljournalname, source, pubdate, elocationid]
+                    example:
+                        pmids: ["10924274", "PMID:16488997"]
+                        fields: [uid, title, pubdate]
+            required: true
+        responses:
+            200:
+                description: publications by pmid
+                content:
+                    application/json:
+                        schema:
+                            type: object
+                            properties:
+                                publications:
+                                    type: object
+                                pending:
+                                    type: array
+                                    items:
+                                        type: string
+                                errors:
+                                    type: object
+            202:
+                description: "Some publications are being fetched, request them again"
+            400:
+                description: Invalid request body
+        """
+        try:
+            pmids, fields = parse_pmids(request.get_json(silent=True))
+        except RuntimeError as err:
+            return str(err), 400
+
+        publications = publication_store.get_many(pmids, fields or publication_fields)
+        found, pending = pubmed_cache.lookup([pmid for pmid in pmids if pmid not in publications])
+        for pmid, info in found.items():
+            publications[pmid] = select_fields(info, fields)
+        futures_wait(list(pending.values()), timeout=0 if respond_async() else pubmed_wait)
+        errors = {}
+        still_pending = []
+        for pmid, future in pending.items():
+            if not future.done():
+                still_pending.append(pmid)
+                continue
+            info, error = pubmed_result(pmid, future)
+            if error:
+                errors[pmid] = error[0]
+            else:
+                publications[pmid] = select_fields(info, fields)
+        return {
+            'publications': publications,
+            'pending': still_pending,
+            'errors': errors,
+        }, 202 if still_pending else 200
+
+api.add_resource(PubmedBulk, '/pubmed/')
+
+# Bionames lookups running at once, shared by all Search requests
+search_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('SEARCH_CONCURRENCY', 8)))
+
+# Seconds Search waits for lookups before returning what it has
+search_deadline = float(os.environ.get('SEARCH_DEADLINE', 10))
+
+def lookup_bioname(term, bioname):
+    """Look up term as bioname. Returns the status code and the results with an id and a label."""
+    url = f"https://bionames.renci.org/lookup/{term}/{bioname}/"
+    r = upstream.get(url)
+    if not r.ok:
+        return r.status_code, []
+    results = []
+    for r in r.json():
+        if not 'id' in r:
+            continue
+        if 'label' in r:
+            r['label'] = r['label'] or r['id']
+        elif 'desc' in r:
+            r['label'] = r['desc'] or r['id']
+            r.pop('desc')
+        else:
+            continue
+        results.append(r)
+    return 200, results
+
 class Search(Resource):
     def get(self, term, category):
         """
@@ -327,28 +698,31 @@ class Search(Resource):
         if not bionames: # No matching biolink name for this category
             return []
         
-        results = []
+        # Look up every bioname at once and keep whatever has arrived by
+        # the deadline
+        found_by_future = {}
         error_status = {'isError': False}
-        for bioname in bionames:
-            url = f"https://bionames.renci.org/lookup/{term}/{bioname}/"
-            r = requests.get(url)
-            if r.ok:
-                all_results = r.json()
-                for r in all_results:
-                    if not 'id' in r:
-                        continue
-                    if 'label' in r:
-                        r['label'] = r['label'] or r['id']
-                    elif 'desc' in r:
-                        r['label'] = r['desc'] or r['id']
-                        r.pop('desc')
-                    else:
-                        continue
-                    results.append(r)
-            else:
-                error_status['isError'] = True
-                error_status['code'] = r.status_code
-
+        futures = [search_pool.submit(lookup_bioname, term, bioname) for bioname in bionames]
+        try:
+            for future in as_completed(futures, timeout=search_deadline):
+                try:
+                    status, found = future.result()
+                except requests.exceptions.RequestException as err:
+                    logger.warning(f'Bionames lookup failed: {err}')
+                    status, found = 503, []
+                if status != 200:
+                    error_status['isError'] = True
+                    error_status['code'] = status
+                found_by_future[future] = found
+        except FuturesTimeout:
+            logger.warning(f'Bionames lookup of {term} as {category} hit the {search_deadline} s deadline')
+            error_status['isError'] = True
+            error_status['code'] = 504
+            for future in futures:
+                future.cancel()
+
+        # Merged in the order of the bionames, as they used to be looked up
+        results = [r for future in futures for r in found_by_future.get(future, [])]
         results = list({r['id']:r for r in results}.values())
         if not results and error_status['isError'] :
             abort(error_status['code'], message=f"Bionames lookup endpoint returned {error_status['code']} error code")
@@ -1,32 +1,285 @@
+import os
+from collections import defaultdict
+
 import graphene
 from graphene import relay
-from graphene_sqlalchemy import SQLAlchemyObjectType, SQLAlchemyConnectionField
-from manager.question import Question as QuestionModel
-from manager.answer import Answerset as AnswersetModel, Answer as AnswerModel
+from graphql.language import ast
+from graphql.language.parser import parse
+from graphql_relay.connection.arrayconnection import connection_from_list_slice, get_offset_with_default
+from promise import Promise
+from promise.dataloader import DataLoader
+from sqlalchemy import func, select
+from sqlalchemy.orm import aliased, joinedload
+
+from manager.setup_db import session_scope
+from manager.tables import Question as QuestionModel, Answerset as AnswersetModel, Answer as AnswerModel
+
+# Page size of list fields queried without first or last
+default_page_size = int(os.environ.get('GRAPHQL_PAGE_SIZE', 100))
+
+# Largest number of objects a query may ask for (see query_cost)
+max_query_cost = int(os.environ.get('GRAPHQL_MAX_COST', 10000))
+
+# Fields returning lists, which multiply the cost of what they select
+list_fields = {'questions', 'answersets', 'answers'}
+
+
+def _store(context):
+    return context if isinstance(context, dict) else context.__dict__
+
+
+def _session(context):
+    '''The database session of a query, put in its context by execute().'''
+    return _store(context)['session']
+
+
+def ranked_page(session, model, parent, parent_ids, order_by, first, offset):
+    '''
+    Query for the children of many parents, at most first of each after
+    skipping offset, in one SELECT.
+
+    The children of each parent are numbered in order_by with
+    row_number() OVER (PARTITION BY parent), so the database limits every
+    page instead of returning all children to be sliced here.
+    '''
+    parent_column = getattr(model, parent)
+    rank = func.row_number().over(partition_by=parent_column, order_by=order_by).label('rank')
+    ranked = select(model, rank).where(parent_column.in_(parent_ids)).subquery()
+    return session.query(aliased(model, ranked))\
+        .filter(ranked.c.rank > offset, ranked.c.rank <= offset + first)\
+        .order_by(ranked.c[parent], ranked.c.rank)
+
+
+class PageLoader(DataLoader):
+    '''
+    Pages of the children of many parents, loaded by (parent id, first,
+    offset) keys. Parents asking for the same page share one query.
+    '''
+
+    model = None
+    parent = None
+    order_by = ()
+
+    def __init__(self, session):
+        super().__init__()
+        self.session = session
+
+    def batch_load_fn(self, keys):
+        parent_ids = defaultdict(set)
+        for parent_id, first, offset in keys:
+            parent_ids[first, offset].add(parent_id)
+        pages = defaultdict(list)
+        for (first, offset), ids in parent_ids.items():
+            for child in ranked_page(self.session, self.model, self.parent, ids, self.order_by, first, offset):
+                pages[getattr(child, self.parent), first, offset].append(child)
+        return Promise.resolve([pages[key] for key in keys])
+
+
+class AnswersetsByQGraphLoader(PageLoader):
+    """Answersets of many question graphs, newest first."""
+
+    model = AnswersetModel
+    parent = 'qgraph_id'
+    order_by = (AnswersetModel.timestamp.desc(), AnswersetModel.id)
+
+
+class AnswersByAnswersetLoader(PageLoader):
+    """Answers of many answersets, best scored first."""
+
+    model = AnswerModel
+    parent = 'answerset_id'
+    order_by = (AnswerModel.score.desc().nulls_last(), AnswerModel.id)
+
+
+def loaders(context):
+    """Loaders of the current request, created on first use so batches never outlive it."""
+    store = _store(context)
+    if 'loaders' not in store:
+        session = _session(context)
+        store['loaders'] = {
+            'answersets': AnswersetsByQGraphLoader(session),
+            'answers': AnswersByAnswersetLoader(session),
+        }
+    return store['loaders']
+
+
+def load_page(info, loader, parent_id, first=None, offset=0):
+    first = default_page_size if first is None else first
+    return loaders(info.context)[loader].load((parent_id, first, offset))
+
+
+def paged_connection(query, connection_type, args):
+    '''
+    The page of query selected by the relay arguments (first, last, after,
+    before) as a connection, read with LIMIT and OFFSET. Without first or
+    last, the page holds default_page_size items.
+    '''
+    if args.get('first') is None and args.get('last') is None:
+        args = {**args, 'first': default_page_size}
+    length = query.order_by(None).count()
+    start = max(get_offset_with_default(args.get('after'), -1) + 1, 0)
+    end = min(get_offset_with_default(args.get('before'), length), length)
+    if args.get('first') is not None:
+        end = min(end, start + args['first'])
+    if args.get('last') is not None:
+        start = max(start, end - args['last'])
+    items = query.offset(start).limit(max(end - start, 0)).all()
+    return connection_from_list_slice(
+        items, args,
+        connection_type=connection_type,
+        edge_type=connection_type.Edge,
+        pageinfo_type=relay.PageInfo,
+        slice_start=start,
+        list_length=length,
+        list_slice_length=len(items))
 
-class Question(SQLAlchemyObjectType):
+
+def _question_query(context):
+    return _session(context).query(QuestionModel).options(joinedload(QuestionModel.question_graph))
+
+
+class Question(graphene.ObjectType):
     class Meta:
-        model = QuestionModel
+        interfaces = (relay.Node,)
+        possible_types = (QuestionModel,)
+
+    natural_question = graphene.String()
+    notes = graphene.String()
+    timestamp = graphene.DateTime()
+    question_graph = graphene.JSONString()
+    answersets = graphene.List(lambda: Answerset, first=graphene.Int(), offset=graphene.Int(default_value=0))
 
-class Answerset(SQLAlchemyObjectType):
+    @classmethod
+    def get_node(cls, info, id):
+        return _question_query(info.context).filter(QuestionModel.id == id).first()
+
+    def resolve_question_graph(self, info):
+        return self.question_graph.body if self.question_graph is not None else None
+
+    def resolve_answersets(self, info, first=None, offset=0):
+        return load_page(info, 'answersets', self.qgraph_id, first, offset)
+
+class Answerset(graphene.ObjectType):
     class Meta:
-        model = AnswersetModel
+        interfaces = (relay.Node,)
+        possible_types = (AnswersetModel,)
+
+    timestamp = graphene.DateTime()
+    answers = graphene.List(lambda: Answer, first=graphene.Int(), offset=graphene.Int(default_value=0))
+
+    @classmethod
+    def get_node(cls, info, id):
+        return _session(info.context).query(AnswersetModel).filter(AnswersetModel.id == id).first()
+
+    def resolve_answers(self, info, first=None, offset=0):
+        return load_page(info, 'answers', self.id, first, offset)
+
+class Answer(graphene.ObjectType):
+    class Meta:
+        interfaces = (relay.Node,)
+        possible_types = (AnswerModel,)
+
+    score = graphene.Float()
+    body = graphene.JSONString()
+
+    @classmethod
+    def get_node(cls, info, id):
+        return _session(info.context).query(AnswerModel).filter(AnswerModel.id == int(id)).first()
+
 
-class Answer(SQLAlchemyObjectType):
+class QuestionConnection(relay.Connection):
     class Meta:
-        model = AnswerModel
+        node = Question
+
+class AnswerConnection(relay.Connection):
+    class Meta:
+        node = Answer
+
 
 class Query(graphene.ObjectType):
-    questions = graphene.List(Question)
+    node = relay.Node.Field()
+
+    questions = relay.ConnectionField(QuestionConnection)
+
+    answers = relay.ConnectionField(AnswerConnection)
+
+    def resolve_questions(self, info, **args):
+        query = _question_query(info.context).order_by(QuestionModel.timestamp.desc(), QuestionModel.id)
+        return paged_connection(query, QuestionConnection, args)
+
+    def resolve_answers(self, info, **args):
+        query = _session(info.context).query(AnswerModel).order_by(AnswerModel.id)
+        return paged_connection(query, AnswerConnection, args)
+
+schema = graphene.Schema(query=Query, types=[Question, Answerset, Answer])
+
+
+def _argument(field, name, variables):
+    for argument in field.arguments or []:
+        if argument.name.value == name:
+            value = argument.value
+            if isinstance(value, ast.Variable):
+                return variables.get(value.name.value)
+            if isinstance(value, ast.IntValue):
+                return int(value.value)
+    return None
+
+
+def _selection_cost(selection_set, fragments, variables, multiplier):
+    cost = 0
+    for selection in selection_set.selections:
+        if isinstance(selection, ast.FragmentSpread):
+            fragment = fragments[selection.name.value]
+            cost += _selection_cost(fragment.selection_set, fragments, variables, multiplier)
+            continue
+        if isinstance(selection, ast.InlineFragment):
+            cost += _selection_cost(selection.selection_set, fragments, variables, multiplier)
+            continue
+        if selection.selection_set is None:
+            continue
+        count = _argument(selection, 'first', variables) or _argument(selection, 'last', variables)
+        if count is None:
+            count = default_page_size if selection.name.value in list_fields else 1
+        cost += multiplier * count
+        cost += _selection_cost(selection.selection_set, fragments, variables, multiplier * count)
+    return cost
+
+
+def query_cost(query, variables=None):
+    '''
+    Upper bound of the number of objects a query can return.
 
-    def resolve_questions(self, info):
-        query = Question.get_query(info)  # SQLAlchemy query
-        return query.all()
+    Each list field costs its page size (first or last, or
+    default_page_size) times the cost of the fields it is nested in.
+    '''
+    document = parse(query)
+    fragments = {
+        definition.name.value: definition
+        for definition in document.definitions
+        if isinstance(definition, ast.FragmentDefinition)
+    }
+    return sum(
+        _selection_cost(definition.selection_set, fragments, variables or {}, 1)
+        for definition in document.definitions
+        if isinstance(definition, ast.OperationDefinition)
+    )
 
-    answers = graphene.List(Answer)
 
-    def resolve_answers(self, info):
-        query = Answer.get_query(info)  # SQLAlchemy query
-        return query.all()
+def execute(query, variables=None, context=None):
+    '''
+    Execute a query against schema, refusing those costing more than max_query_cost.
 
-schema = graphene.Schema(query=Query)
\ No newline at end of file
+    The query runs in one session_scope, whose session resolvers find in
+    the context.
+    '''
+    cost = query_cost(query, variables)
+    if cost > max_query_cost:
+        return {'errors': [{'message': f'Query cost {cost} exceeds the limit of {max_query_cost}.'}]}
+    context = {} if context is None else context
+    with session_scope() as session:
+        _store(context).setdefault('session', session)
+        result = schema.execute(query, variable_values=variables, context_value=context)
+        response = {'data': result.data}
+        if result.errors:
+            response['errors'] = [{'message': str(error)} for error in result.errors]
+    return response
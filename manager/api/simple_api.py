@@ -11,17 +11,21 @@ from uuid import uuid4
 import logging
 from datetime import datetime
 import requests
-from flask import jsonify, request
+from flask import jsonify, request, send_file, Response
 from flask_security import auth_required
 from flask_restful import Resource
 
 from manager.setup import api
+from manager.uploads import view_storage_dir, save_message, message_path, message_info, \
+    iter_message, open_index, delete_message, MessageError, UploadTooLarge
+from manager.message_formats import serializers, whole_message
 
 logger = logging.getLogger(__name__)
 
-view_storage_dir = f"{os.environ['ROBOKOP_HOME']}/uploads/"
-if not os.path.exists(view_storage_dir):
-    os.mkdir(view_storage_dir)
+# Internal nginx location aliased to view_storage_dir. When set, stored
+# messages are handed to nginx with X-Accel-Redirect instead of being sent
+# by the worker.
+accel_redirect_location = os.environ.get('VIEW_ACCEL_REDIRECT_LOCATION', None)
 
 output_formats = ['DENSE', 'MESSAGE', 'CSV', 'ANSWERS']
 
@@ -30,13 +34,57 @@ def parse_args_output_format(req_args):
     if output_format.upper() not in output_formats:
         raise RuntimeError(f'output_format must be one of [{" ".join(output_formats)}]')
     
-    return output_format
+    return output_format.upper()
 
 def parse_args_max_results(req_args):
     max_results = req_args.get('max_results', default=None)
     max_results = max_results if max_results is not None else 250
+
+    if isinstance(max_results, str):
+        if max_results.lower() == 'none':
+            max_results = None
+        else:
+            try:
+                max_results = int(max_results)
+            except ValueError:
+                raise RuntimeError(f'max_results should be an integer')
+            if max_results < 0:
+                max_results = None
+
     return max_results
 
+def parse_args_offset(req_args):
+    try:
+        offset = int(req_args.get('offset', default=0))
+    except ValueError:
+        raise RuntimeError(f'offset should be an integer')
+    if offset < 0:
+        raise RuntimeError(f'offset must not be negative')
+
+    return offset
+
+def parse_args_limit(req_args):
+    limit = req_args.get('limit', default=None)
+    if limit is None:
+        return None
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise RuntimeError(f'limit should be an integer')
+    if limit < 0:
+        raise RuntimeError(f'limit must not be negative')
+
+    return limit
+
+sort_orders = ['SCORE', 'NONE']
+
+def parse_args_sort(req_args):
+    sort = req_args.get('sort', default=sort_orders[0])
+    if sort.upper() not in sort_orders:
+        raise RuntimeError(f'sort must be one of [{" ".join(sort_orders)}]')
+
+    return sort.upper()
+
 def parse_args_max_connectivity(req_args):
     max_connectivity = req_args.get('max_connectivity', default=None)
     
@@ -81,29 +129,239 @@ class View(Resource):
         responses:
             200:
                 description: A URL for further viewing
+            400:
+                description: The body is not a valid Message
+            413:
+                description: The body is larger than VIEW_MAX_UPLOAD_SIZE bytes
         """
         
         logger.info('Recieving Answerset for storage and later viewing')
-        message = request.json
-        
-        # Save the message to archive folder
-        for _ in range(25):
-            try:
-                uid = str(uuid4())
-                this_file = os.path.join(view_storage_dir, f'{uid}.json')
-                with open(this_file, 'x') as answerset_file:
-                    logger.info('Saving Message')
-                    json.dump(message, answerset_file)
-                break
-            except:
-                logger.info('Error encountered writting file. Retrying')
-                pass
-        else:
-            logger.info('Error encountered writting file')
+
+        # Stream the body to disk rather than parsing it with request.json,
+        # so large messages are never held in memory
+        try:
+            uid = save_message(request.stream, content_length=request.content_length)
+        except UploadTooLarge as err:
+            return str(err), 413
+        except MessageError as err:
+            return f'Invalid message: {err}', 400
+        except:
+            logger.exception('Error encountered writting file')
             return "Failed to save resource. Internal server error", 500
-        
+
         return uid, 200
 
+
+class ViewData(Resource):
+    def get(self, uid):
+        """
+        Get a previously uploaded answerset
+        The message is sent with Content-Encoding br, zstd or gzip when
+        Accept-Encoding allows it.
+        ---
+        tags: [simple]
+        parameters:
+          - in: path
+            name: uid
+            description: "id returned when the answerset was uploaded"
+            schema:
+                type: string
+            required: true
+        responses:
+            200:
+                description: The uploaded message
+                content:
+                    application/json:
+                        schema:
+                            $ref: '#/components/schemas/Message'
+            206:
+                description: The requested byte range of the uploaded message
+            304:
+                description: The cached copy identified by If-None-Match is current
+            404:
+                description: No such upload
+        """
+        try:
+            info = message_info(uid)
+        except KeyError:
+            return 'No such upload', 404
+        last_modified = datetime.strptime(info['timestamp'][:19], '%Y-%m-%dT%H:%M:%S')
+
+        # Pick one of the precompressed copies the client accepts. Each
+        # representation gets its own strong ETag.
+        encoding = request.accept_encodings.best_match(list(info['encodings']))
+        etag = f"{info['sha256']}-{encoding}" if encoding else info['sha256']
+
+        if encoding is None and info['encodings']:
+            # Only compressed copies are stored, inflate this one as it is sent
+            response = Response(iter_message(uid), mimetype='application/json')
+            response.content_length = info['size']
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.make_conditional(request)
+        elif accel_redirect_location is not None:
+            response = Response(mimetype='application/json')
+            response.headers['X-Accel-Redirect'] = \
+                f'{accel_redirect_location.rstrip("/")}/' \
+                f'{os.path.relpath(message_path(info, encoding), view_storage_dir)}'
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.make_conditional(request)
+            if response.status_code == 304:
+                del response.headers['X-Accel-Redirect']
+        else:
+            # send_file hands the open file to the server's wsgi.file_wrapper,
+            # which gunicorn implements with sendfile(2), and answers
+            # conditional and Range requests itself
+            response = send_file(
+                message_path(info, encoding),
+                mimetype='application/json',
+                conditional=True,
+                etag=etag,
+                last_modified=last_modified)
+
+        if encoding:
+            response.content_encoding = encoding
+        response.vary.add('Accept-Encoding')
+        # Uploads are never modified once written
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+        return response
+
+    def delete(self, uid):
+        """
+        Delete a previously uploaded answerset
+        ---
+        tags: [simple]
+        parameters:
+          - in: path
+            name: uid
+            description: "id returned when the answerset was uploaded"
+            schema:
+                type: string
+            required: true
+        responses:
+            204:
+                description: The upload was deleted
+            404:
+                description: No such upload
+        """
+        try:
+            delete_message(uid)
+        except KeyError:
+            return 'No such upload', 404
+        return '', 204
+
+
+class ViewAnswers(Resource):
+    def get(self, uid):
+        """
+        Get a page of answers from a previously uploaded answerset
+        By default the response is a message holding the question graph,
+        the selected answers and only the knowledge graph nodes and edges
+        they bind. The response is streamed as it is read from disk. The
+        number of answers the page was taken from is in X-Total-Count.
+        ---
+        tags: [simple]
+        parameters:
+          - in: path
+            name: uid
+            description: "id returned when the answerset was uploaded"
+            schema:
+                type: string
+            required: true
+          - in: query
+            name: offset
+            description: "Number of answers to skip"
+            schema:
+                type: integer
+                default: 0
+          - in: query
+            name: limit
+            description: "Number of answers to return, all remaining if omitted"
+            schema:
+                type: integer
+          - in: query
+            name: max_results
+            description: "Number of top answers to page through, or none for all"
+            schema:
+                type: string
+                default: 250
+          - in: query
+            name: sort
+            description: "SCORE for descending score, NONE for upload order"
+            schema:
+                type: string
+                default: SCORE
+          - in: query
+            name: output_format
+            description: "MESSAGE for a message, ANSWERS for the answers only, DENSE for answers with their nodes and edges inlined, CSV for a table of node bindings and names"
+            schema:
+                type: string
+                default: MESSAGE
+          - in: query
+            name: max_connectivity
+            description: "Leave out answers binding a node with more neighbours in the knowledge graph than this, or none to keep all. Nodes given by curie in the question graph are not counted."
+            schema:
+                type: string
+        responses:
+            200:
+                description: A page of answers in the requested format
+                content:
+                    application/json:
+                        schema:
+                            $ref: '#/components/schemas/Message'
+                    text/csv:
+                        schema:
+                            type: string
+            400:
+                description: Invalid query parameters
+            404:
+                description: No such upload
+        """
+        try:
+            offset = parse_args_offset(request.args)
+            limit = parse_args_limit(request.args)
+            max_results = parse_args_max_results(request.args)
+            sort = parse_args_sort(request.args)
+            output_format = parse_args_output_format(request.args)
+            max_connectivity = parse_args_max_connectivity(request.args)
+        except RuntimeError as err:
+            return str(err), 400
+
+        try:
+            index = open_index(uid)
+        except KeyError:
+            return 'No such upload', 404
+
+        # Only the selected answers and what they bind are read from disk,
+        # a batch at a time, while the response is being sent
+        serializer, mimetype = serializers[output_format]
+        page = {
+            'offset': offset,
+            'limit': limit,
+            'max_results': max_results,
+            'sort': sort,
+            'max_connectivity': max_connectivity,
+        }
+        try:
+            total = index.answer_total(max_results, max_connectivity)
+        except BaseException:
+            index.close()
+            raise
+        if output_format == 'MESSAGE' and whole_message(page):
+            index.close()
+            response = Response(iter_message(uid), mimetype=mimetype)
+        else:
+            response = Response(serializer(index, page), mimetype=mimetype)
+            # Also closes the index when the body is never iterated
+            response.call_on_close(index.close)
+        response.headers['X-Total-Count'] = str(total)
+        return response
+
 api.add_resource(View, '/simple/view/')
+api.add_resource(ViewData, '/simple/view/<uid>')
+api.add_resource(ViewAnswers, '/simple/view/<uid>/answers/')
 
 
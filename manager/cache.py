@@ -0,0 +1,273 @@
+'''
+Caches for upstream responses
+'''
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_missing = object()
+
+
+class CacheEntry():
+    '''A cached value with the time it was loaded and an ETag of its JSON.'''
+
+    def __init__(self, value, loaded):
+        self.value = value
+        self.loaded = loaded
+        self.etag = hashlib.sha1(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class TTLCache():
+    '''
+    Cache of loader results with stale-while-revalidate.
+
+    An entry is fresh for ttl seconds and is returned as is. For stale
+    seconds after that it is still returned right away while a background
+    thread loads a new value. Older entries are loaded again before
+    returning. Concurrent loads of the same key are coalesced into one.
+    If a load fails, a stale entry is returned instead (if there is one).
+    '''
+
+    def __init__(self, ttl, stale=0, clock=time.monotonic):
+        self.ttl = ttl
+        self.stale = stale
+        self._clock = clock
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._loading = {}
+
+    def _load(self, key, loader):
+        '''Load key, or wait for the load already running. Returns the entry.'''
+        with self._lock:
+            event = self._loading.get(key)
+            owner = event is None
+            if owner:
+                event = self._loading[key] = threading.Event()
+        if not owner:
+            event.wait()
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is None:
+                raise RuntimeError(f'Loading {key} failed')
+            return entry
+        try:
+            entry = CacheEntry(loader(), self._clock())
+            with self._lock:
+                self._entries[key] = entry
+            return entry
+        finally:
+            with self._lock:
+                del self._loading[key]
+            event.set()
+
+    def _refresh(self, key, loader):
+        try:
+            self._load(key, loader)
+        except Exception:
+            logger.exception(f'Refreshing {key} failed, serving the stale value')
+
+    def get_entry(self, key, loader):
+        '''The CacheEntry of key, calling loader() to fill it when needed.'''
+        with self._lock:
+            entry = self._entries.get(key)
+            refreshing = key in self._loading
+        if entry is not None:
+            age = self._clock() - entry.loaded
+            if age < self.ttl:
+                return entry
+            if age < self.ttl + self.stale:
+                if not refreshing:
+                    threading.Thread(target=self._refresh, args=(key, loader), daemon=True).start()
+                return entry
+        try:
+            return self._load(key, loader)
+        except Exception:
+            if entry is None:
+                raise
+            logger.exception(f'Loading {key} failed, serving the stale value')
+            return entry
+
+    def get(self, key, loader):
+        '''The value of key, calling loader() to fill it when needed.'''
+        return self.get_entry(key, loader).value
+
+    def invalidate(self, key=None):
+        '''Drop key, or every entry.'''
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+class LRUCache():
+    '''Mapping of at most maxsize entries, dropping the least recently used.'''
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+            except KeyError:
+                return default
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCache():
+    '''
+    JSON values in an SQLite file, shared by every process opening it.
+
+    Each thread keeps its own connection. Entries older than ttl seconds
+    (if given) are treated as missing.
+    '''
+
+    def __init__(self, path, ttl=None, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self._clock = clock
+        self._local = threading.local()
+        connection = self._connection()
+        with connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('''CREATE TABLE IF NOT EXISTS entry (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                stored REAL NOT NULL)''')
+
+    def _connection(self):
+        # Connections must not cross a fork into gunicorn workers
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            self._local.connection = sqlite3.connect(self.path, timeout=60)
+            self._local.pid = pid
+        return self._local.connection
+
+    def get_many(self, keys):
+        '''Values of those keys that are stored, by key.'''
+        keys = list(dict.fromkeys(keys))
+        oldest = self._clock() - self.ttl if self.ttl else float('-inf')
+        found = {}
+        connection = self._connection()
+        # Stay below the SQLite limit of bound parameters
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            rows = connection.execute(
+                f"SELECT key, value FROM entry WHERE stored >= ? AND key IN ({','.join('?' * len(batch))})",
+                [oldest, *batch])
+            found.update((key, json.loads(value)) for key, value in rows)
+        return found
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def set(self, key, value):
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO entry (key, value, stored) VALUES (?, ?, ?)',
+                (key, json.dumps(value), self._clock()))
+
+    def clear(self):
+        connection = self._connection()
+        with connection:
+            connection.execute('DELETE FROM entry')
+
+
+class TieredCache():
+    '''
+    Cache of loader results in an LRUCache in front of an SQLiteCache.
+
+    Values found on disk are copied into memory; loaded values are stored
+    in both. Failed loads are not cached. Hits of each tier and misses are
+    counted (see stats).
+    '''
+
+    def __init__(self, memory, disk):
+        self.memory = memory
+        self.disk = disk
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _count(self, memory_hits=0, disk_hits=0, misses=0):
+        with self._lock:
+            self.memory_hits += memory_hits
+            self.disk_hits += disk_hits
+            self.misses += misses
+
+    def get_many(self, keys):
+        '''Values of those keys that are cached, by key. Keys left out are counted as misses.'''
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        for key in keys:
+            value = self.memory.get(key, _missing)
+            if value is not _missing:
+                found[key] = value
+        memory_hits = len(found)
+        if len(found) < len(keys):
+            stored = self.disk.get_many([key for key in keys if key not in found])
+            for key, value in stored.items():
+                self.memory.set(key, value)
+            found.update(stored)
+        self._count(memory_hits, len(found) - memory_hits, len(keys) - len(found))
+        return found
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        self.disk.set(key, value)
+
+    def load(self, key, loader):
+        '''Call loader() and cache its value as key, without looking key up first.'''
+        value = loader()
+        self.set(key, value)
+        return value
+
+    def get(self, key, loader):
+        '''The value of key, calling loader() to fill it when needed.'''
+        found = self.get_many([key])
+        if key in found:
+            return found[key]
+        return self.load(key, loader)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'memory_entries': len(self.memory),
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+            }
+
+    def clear(self):
+        self.memory.clear()
+        self.disk.clear()
+        with self._lock:
+            self.memory_hits = self.disk_hits = self.misses = 0
+
@@ -0,0 +1,29 @@
+'''
+gunicorn settings of the manager in production
+
+    gunicorn -c python:manager.gunicorn_conf manager.wsgi:app
+
+Most endpoints proxy the builder, ranker, bionames and PubMed, and spend
+their time waiting for them. By default each worker is an eventlet worker:
+requests run in green threads and the socket calls of requests, redis and
+the worker pools are monkey patched to yield while they wait, so one
+worker keeps many upstream calls in flight instead of one per thread.
+SQLite reads of stored uploads and caches still block their worker while
+they run. Set MANAGER_WORKER_CLASS=sync for plain blocking workers.
+'''
+
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.environ.get('MANAGER_PORT', 80)}"
+
+worker_class = os.environ.get('MANAGER_WORKER_CLASS', 'eventlet')
+
+workers = int(os.environ.get('MANAGER_WORKERS', multiprocessing.cpu_count() + 1))
+
+# Requests served at once by each eventlet worker
+worker_connections = int(os.environ.get('MANAGER_WORKER_CONNECTIONS', 1000))
+
+# Seconds a worker may go without notifying the arbiter. Under eventlet this
+# only fires when the hub itself is blocked, not on slow upstream calls.
+timeout = int(os.environ.get('MANAGER_WORKER_TIMEOUT', 120))
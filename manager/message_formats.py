@@ -0,0 +1,194 @@
+'''
+Streaming serializers for stored messages
+
+Each serializer takes an open MessageIndex and a page of answers and
+yields the response body in pieces, so exports start right away and never
+hold more than a batch of answers in memory.
+'''
+
+import io
+import csv
+import json
+
+# Size of the pieces handed to the server
+stream_chunk_size = 64 * 1024
+
+# Answers whose knowledge graph nodes and edges are looked up together
+answer_batch_size = 100
+
+
+def chunked(parts, size=None):
+    '''Join the bytes in parts into pieces of about size bytes.'''
+    size = size or stream_chunk_size
+    buffer = []
+    buffered = 0
+    for part in parts:
+        buffer.append(part)
+        buffered += len(part)
+        if buffered >= size:
+            yield b''.join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def json_array(items):
+    '''Wrap the JSON encoded items in a JSON array.'''
+    yield b'['
+    for i, item in enumerate(items):
+        if i:
+            yield b','
+        yield item
+    yield b']'
+
+
+def _raw(index, spans):
+    for start, end in spans:
+        yield index.read(start, end)
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def binding_ids(bindings):
+    '''Knowledge graph ids bound in node_bindings or edge_bindings of an answer.'''
+    for value in bindings.values():
+        if isinstance(value, list):
+            yield from value
+        else:
+            yield value
+
+
+def _bound_ids(answers):
+    node_ids = set()
+    edge_ids = set()
+    for answer in answers:
+        node_ids.update(map(str, binding_ids(answer.get('node_bindings', {}))))
+        edge_ids.update(map(str, binding_ids(answer.get('edge_bindings', {}))))
+    return node_ids, edge_ids
+
+
+def _by_id(values):
+    return {str(value['id']): value for value in values}
+
+
+def _batched_answers(index, page):
+    '''Yield batches of answers together with the nodes and edges they bind, by id.'''
+    for batch in _batches(index.load(index.answer_spans(**page)), answer_batch_size):
+        node_ids, edge_ids = _bound_ids(batch)
+        yield batch, _by_id(index.nodes(node_ids)), _by_id(index.edges(edge_ids))
+
+
+def whole_message(page):
+    '''Whether page selects every answer in stored order, so the stored message can be sent as is.'''
+    return page['offset'] == 0 and page['limit'] is None and page['max_results'] is None \
+        and page.get('sort', 'SCORE') != 'SCORE' and page.get('max_connectivity') is None
+
+
+def message_stream(index, page):
+    '''
+    The question graph, a page of answers and the knowledge graph they bind.
+
+    page holds the answer_spans arguments. Everything is copied from the
+    stored message as is, but nodes and edges bound only by answers left
+    out of the page (such as hubs pruned by max_connectivity) are left out
+    too. Pages covering the whole message are better served from the
+    stored message itself (see whole_message).
+    '''
+    def parts():
+        yield b'{"question_graph":'
+        yield index.read(*index.question_graph_span())
+        yield b',"knowledge_graph":{"nodes":'
+        node_ids, edge_ids = _bound_ids(index.load(index.answer_spans(**page)))
+        node_spans = index.node_spans(node_ids)
+        edge_spans = index.edge_spans(edge_ids)
+        yield from json_array(_raw(index, node_spans))
+        yield b',"edges":'
+        yield from json_array(_raw(index, edge_spans))
+        yield b'},"answers":'
+        yield from json_array(_raw(index, index.answer_spans(**page)))
+        yield b'}'
+    return chunked(parts())
+
+
+def answers_stream(index, page):
+    '''A JSON array of a page of answers, as stored.'''
+    return chunked(json_array(_raw(index, index.answer_spans(**page))))
+
+
+def _dense(bindings, values):
+    dense = {}
+    for key, value in bindings.items():
+        if isinstance(value, list):
+            dense[key] = [values.get(str(i), {'id': i}) for i in value]
+        else:
+            dense[key] = values.get(str(value), {'id': value})
+    return dense
+
+
+def dense_stream(index, page):
+    '''
+    A JSON array of a page of answers with the knowledge graph inlined.
+
+    The ids in node_bindings and edge_bindings are replaced by the bound
+    nodes and edges. Ids missing from the knowledge graph are kept as {"id": id}.
+    '''
+    def parts():
+        answers = (
+            {
+                **answer,
+                'node_bindings': _dense(answer.get('node_bindings', {}), nodes),
+                'edge_bindings': _dense(answer.get('edge_bindings', {}), edges),
+            }
+            for batch, nodes, edges in _batched_answers(index, page)
+            for answer in batch
+        )
+        yield from json_array(json.dumps(answer).encode('utf-8') for answer in answers)
+    return chunked(parts())
+
+
+def _csv_line(row):
+    line = io.StringIO()
+    csv.writer(line).writerow(row)
+    return line.getvalue().encode('utf-8')
+
+
+def csv_stream(index, page):
+    '''
+    A CSV table of the node bindings of a page of answers.
+
+    Each question graph node gets a column of bound ids and a column of
+    their names, after the score column. Sets of nodes are joined with |.
+    '''
+    qnode_ids = [str(qnode['id']) for qnode in index.question_graph().get('nodes', [])]
+
+    def parts():
+        yield _csv_line(['score'] + [f'{qid}{suffix}' for qid in qnode_ids for suffix in ('', '_name')])
+        for batch, nodes, _ in _batched_answers(index, page):
+            for answer in batch:
+                bindings = answer.get('node_bindings', {})
+                row = [answer.get('score', '')]
+                for qid in qnode_ids:
+                    ids = bindings.get(qid, [])
+                    ids = ids if isinstance(ids, list) else [ids]
+                    row.append('|'.join(str(i) for i in ids))
+                    row.append('|'.join(str(nodes.get(str(i), {}).get('name') or '') for i in ids))
+                yield _csv_line(row)
+    return chunked(parts())
+
+
+serializers = {
+    'MESSAGE': (message_stream, 'application/json'),
+    'ANSWERS': (answers_stream, 'application/json'),
+    'DENSE': (dense_stream, 'application/json'),
+    'CSV': (csv_stream, 'text/csv'),
+}
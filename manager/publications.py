@@ -0,0 +1,147 @@
+'''
+Local store of PubMed publication summaries
+
+Summaries are kept in an SQLite file keyed by PMID, one column per field,
+so that many publications are read with one indexed lookup and only the
+fields asked for. The file is filled by
+
+    python -m manager.publications import FILE...
+
+from NCBI esummary responses (JSON objects with a "result") or JSON
+lines files (.jsonl) of single summaries, optionally gzipped. Importing
+again replaces the summaries of the same PMIDs.
+'''
+
+import os
+import re
+import json
+import gzip
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+store_path = os.environ.get(
+    'PUBMED_STORE_PATH', f"{os.environ['ROBOKOP_HOME']}/publications/pubmed.sqlite")
+
+# Summary fields kept, as named by esummary. Those holding lists or
+# objects are stored as JSON.
+fields = ('uid', 'title', 'authors', 'fulljournalname', 'source', 'pubdate', 'elocationid')
+json_fields = {'authors'}
+
+# PMIDs looked up per SELECT, below the SQLite limit of bound parameters
+lookup_batch_size = 500
+
+import_batch_size = 10000
+
+
+def normalize_pmid(pmid):
+    '''The number of a PMID given as a number, a string or a PMID: curie, or None.'''
+    match = re.fullmatch(r'(?:pmid:)?\s*(\d+)', str(pmid).strip(), re.IGNORECASE)
+    return match.group(1) if match else None
+
+
+class PublicationStore():
+    '''PubMed summaries in an SQLite file, read by every worker.'''
+
+    def __init__(self, path=store_path):
+        self.path = path
+        self._local = threading.local()
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _connection(self):
+        # Connections must not cross a fork into gunicorn workers
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            self._local.connection = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, timeout=60)
+            self._local.pid = pid
+        return self._local.connection
+
+    def get_many(self, pmids, requested=fields):
+        '''Stored summaries of pmids (normalized PMIDs), by PMID, with the requested fields.'''
+        if not self.exists():
+            return {}
+        columns = ', '.join(requested)
+        numbers = [int(pmid) for pmid in dict.fromkeys(pmids)]
+        found = {}
+        connection = self._connection()
+        for i in range(0, len(numbers), lookup_batch_size):
+            batch = numbers[i:i + lookup_batch_size]
+            rows = connection.execute(
+                f"SELECT pmid, {columns} FROM publication WHERE pmid IN ({','.join('?' * len(batch))})",
+                batch)
+            for pmid, *values in rows:
+                found[str(pmid)] = {
+                    field: json.loads(value) if field in json_fields and value is not None else value
+                    for field, value in zip(requested, values)
+                }
+        return found
+
+
+def _summaries(path):
+    '''Summaries in a JSON lines file (.jsonl) or in an esummary response.'''
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        if path.endswith(('.jsonl', '.jsonl.gz')):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        result = json.load(f)['result']
+    for uid in result.get('uids', []):
+        yield result[uid]
+
+
+def _row(summary):
+    pmid = normalize_pmid(summary.get('uid', ''))
+    if pmid is None or 'error' in summary:
+        return None
+    values = [
+        json.dumps(summary.get(field)) if field in json_fields else summary.get(field)
+        for field in fields
+    ]
+    return [int(pmid), *values]
+
+
+def import_summaries(summaries, path=store_path):
+    '''Add summaries to the store at path, creating it if needed. Returns how many were added.'''
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    connection = sqlite3.connect(path, timeout=60)
+    try:
+        with connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(f'''CREATE TABLE IF NOT EXISTS publication (
+                pmid INTEGER PRIMARY KEY,
+                {', '.join(f'{field} TEXT' for field in fields)})''')
+        insert = f"INSERT OR REPLACE INTO publication (pmid, {', '.join(fields)}) " \
+            f"VALUES ({', '.join('?' * (len(fields) + 1))})"
+        count = 0
+        batch = []
+        for summary in summaries:
+            row = _row(summary)
+            if row is None:
+                continue
+            batch.append(row)
+            if len(batch) >= import_batch_size:
+                with connection:
+                    connection.executemany(insert, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            with connection:
+                connection.executemany(insert, batch)
+            count += len(batch)
+        return count
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) < 3 or sys.argv[1] != 'import':
+        sys.exit(f'usage: {sys.argv[0]} import FILE...')
+    for path in sys.argv[2:]:
+        print(f'{path}: imported {import_summaries(_summaries(path))} publications')
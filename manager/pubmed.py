@@ -0,0 +1,153 @@
+'''
+PubMed publication summaries, cached in redis
+'''
+
+import os
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+from manager.upstream import upstream
+
+logger = logging.getLogger(__name__)
+
+# Summaries are fetched from the NCBI E-utilities
+pubmed_summary_url = os.environ.get(
+    'PUBMED_SUMMARY_URL', 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi')
+
+# Fetches from PubMed running at once, per worker
+fetch_concurrency = int(os.environ.get('PUBMED_CONCURRENCY', 4))
+
+# Seconds summaries are cached, 0 keeps them forever
+cache_ttl = int(os.environ.get('PUBMED_CACHE_TTL', 0))
+
+if redis is not None:
+    cache_errors = (redis.exceptions.RedisError, OSError)
+else:
+    cache_errors = (OSError,)
+
+
+class CacheUnavailable(RuntimeError):
+    '''The redis cache cannot be reached.'''
+    pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def redis_client():
+    '''Client of the PubMed cache. All clients of a process share one connection pool.'''
+    global _pool
+    if redis is None:
+        raise CacheUnavailable('The redis module is not installed')
+    with _pool_lock:
+        if _pool is None:
+            _pool = redis.ConnectionPool(
+                host=os.environ['PUBMED_CACHE_HOST'],
+                port=int(os.environ['PUBMED_CACHE_PORT']),
+                db=int(os.environ['PUBMED_CACHE_DB']),
+                password=os.environ.get('PUBMED_CACHE_PASSWORD') or None)
+    return redis.Redis(connection_pool=_pool)
+
+
+def fetch_pubmed_info(pmid):
+    '''Summary of one publication, from PubMed.'''
+    r = upstream.get(pubmed_summary_url, params={'db': 'pubmed', 'id': pmid, 'retmode': 'json'})
+    r.raise_for_status()
+    result = r.json().get('result', {})
+    if pmid not in result or 'error' in result[pmid]:
+        raise KeyError(f'PubMed has no publication {pmid}')
+    return result[pmid]
+
+
+class PubmedCache():
+    '''
+    PubMed summaries in redis, fetched in the background when missing.
+
+    client is a redis client, or a function returning one; fetch maps a
+    PMID to its summary. Both can be replaced by stand-ins. Concurrent
+    misses of one PMID share a single fetch. A fetch that failed is kept
+    until the next lookup of its PMID reports the error, so clients
+    polling for it do not start it over and over.
+    '''
+
+    def __init__(self, client=redis_client, fetch=fetch_pubmed_info, executor=None,
+                 prefix='robokop_pubmed_cache_', ttl=cache_ttl):
+        self._client = client
+        self.fetch = fetch
+        self.executor = executor or ThreadPoolExecutor(max_workers=fetch_concurrency)
+        self.prefix = prefix
+        self.ttl = ttl
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if callable(self._client):
+            self._client = self._client()
+        return self._client
+
+    def key(self, pmid):
+        return f'{self.prefix}{pmid}'
+
+    def get_many(self, pmids):
+        '''Cached summaries of pmids, by PMID, read with one MGET.'''
+        pmids = list(dict.fromkeys(pmids))
+        if not pmids:
+            return {}
+        try:
+            values = self.client.mget([self.key(pmid) for pmid in pmids])
+        except cache_errors as err:
+            raise CacheUnavailable(f'PubMed cache: {err}') from err
+        return {pmid: json.loads(value) for pmid, value in zip(pmids, values) if value is not None}
+
+    def _store(self, pmid, info):
+        try:
+            self.client.set(self.key(pmid), json.dumps(info), ex=self.ttl or None)
+        except cache_errors:
+            logger.exception(f'Caching PubMed info of {pmid} failed')
+
+    def _fetch(self, pmid):
+        info = self.fetch(pmid)
+        self._store(pmid, info)
+        return info
+
+    def _done(self, pmid, future):
+        if future.exception() is None:
+            with self._lock:
+                if self._pending.get(pmid) is future:
+                    del self._pending[pmid]
+
+    def fetch_async(self, pmid):
+        '''Future of the summary of pmid, starting a fetch unless one is running.'''
+        with self._lock:
+            future = self._pending.get(pmid)
+            started = future is None
+            if started:
+                future = self._pending[pmid] = self.executor.submit(self._fetch, pmid)
+        # A fetch done already runs the callback right away, which takes the lock
+        if started:
+            future.add_done_callback(lambda future: self._done(pmid, future))
+        return future
+
+    def forget(self, pmid, future):
+        '''Drop the failed fetch future of pmid, so the next lookup tries again.'''
+        with self._lock:
+            if self._pending.get(pmid) is future:
+                del self._pending[pmid]
+
+    def lookup(self, pmids):
+        '''
+        Cached summaries by PMID, and futures of the others by PMID.
+
+        Fetches are started for the PMIDs that are not cached.
+        '''
+        found = self.get_many(pmids)
+        pending = {pmid: self.fetch_async(pmid) for pmid in dict.fromkeys(pmids) if pmid not in found}
+        return found, pending
@@ -6,20 +6,28 @@ import os
 
 from flask import render_template
 
-from manager.setup import app
+from manager.setup import app, api_blueprint
+from manager.setup_db import init_app
 
 import manager.logging_config
 
+# Share one database session per request
+init_app(app)
+
 # set up all apis
 import manager.api.misc_api
 import manager.api.simple_api
+import manager.api.db_api
+
+app.register_blueprint(api_blueprint)
 
 @app.route('/simple/view/')
 def viewer_blank():
     """Answerset Browser with upload capablitiy."""
     return render_template('simpleView.html', upload_id='')
 
-# Run Webserver
+# Run the development server. In production the app is served by gunicorn
+# with eventlet workers, see gunicorn_conf.py.
 if __name__ == '__main__':
 
     # Get host and port from environmental variables
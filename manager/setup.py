@@ -68,7 +68,7 @@ def handle_error(ex):
     """Handle all server errors."""
     if isinstance(ex, werkzeug.exceptions.HTTPException):
         raise ex
-    tb = traceback.format_exception(etype=type(ex), value=ex, tb=ex.__traceback__)
+    tb = traceback.format_exception(type(ex), ex, ex.__traceback__)
     logger.exception(ex)
     # return tb[-1], 500
     return "Internal server error. See the logs for details.", 500
@@ -0,0 +1,161 @@
+"""Set up SQLAlchemy and the database connection pool."""
+
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+from flask import g, has_request_context
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+database_uri = os.environ.get(
+    'DATABASE_URI',
+    f"postgresql://{os.environ.get('POSTGRES_USER', 'postgres')}:{os.environ.get('POSTGRES_PASSWORD', '')}"
+    f"@{os.environ.get('POSTGRES_HOST', 'localhost')}:{os.environ.get('POSTGRES_PORT', 5432)}"
+    f"/{os.environ.get('POSTGRES_DB', 'robokop')}")
+
+# Connection pool settings, see sqlalchemy.create_engine
+pool_settings = {
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+    'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+    'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+    # Reconnect before the server or a firewall drops idle connections
+    'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true',
+}
+
+# Settings of any pool class; the others only apply to QueuePool
+common_pool_settings = ('pool_recycle', 'pool_pre_ping')
+
+
+def engine_settings(uri):
+    """The pool_settings accepted by the pool class the dialect of uri uses."""
+    url = make_url(uri)
+    if issubclass(url.get_dialect().get_pool_class(url), QueuePool):
+        return dict(pool_settings)
+    return {key: value for key, value in pool_settings.items() if key in common_pool_settings}
+
+
+engine = create_engine(database_uri, **engine_settings(database_uri))
+Session = sessionmaker(bind=engine)
+Base = declarative_base()
+
+
+class PoolMetrics():
+    """Counters of connection pool use, updated by pool events and session_scope."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def snapshot(self):
+        """Current pool state and counters as a dict."""
+        pool = engine.pool
+        state = {}
+        if isinstance(pool, QueuePool):
+            state = {
+                'size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'checked_in': pool.checkedin(),
+                'overflow': pool.overflow(),
+            }
+        with self._lock:
+            return {
+                **state,
+                'connects': self.connects,
+                'checkouts': self.checkouts,
+                'wait_seconds_total': self.wait_seconds_total,
+                'wait_seconds_max': self.wait_seconds_max,
+            }
+
+
+pool_metrics = PoolMetrics()
+
+
+@event.listens_for(engine, 'connect')
+def _on_connect(dbapi_connection, connection_record):
+    with pool_metrics._lock:
+        pool_metrics.connects += 1
+
+
+@event.listens_for(engine, 'checkout')
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    with pool_metrics._lock:
+        pool_metrics.checkouts += 1
+
+
+def _open_session():
+    """New session with a connection checked out, timing the wait for the pool."""
+    session = Session()
+    start = time.perf_counter()
+    session.connection()
+    pool_metrics.record_wait(time.perf_counter() - start)
+    return session
+
+
+@contextmanager
+def session_scope():
+    """
+    Provide a transactional scope around a series of operations.
+
+    Within a Flask request all scopes share one session, opened on first
+    use and committed once when the request is done (see init_app), so
+    several accessor calls cost one connection checkout and one commit.
+    Each scope runs in a savepoint of its own: an exception leaving the
+    scope undoes that scope's changes only, and the request goes on.
+    Outside of requests each scope is its own transaction.
+    """
+    if has_request_context():
+        if 'db_session' not in g:
+            g.db_session = _open_session()
+        session = g.db_session
+        savepoint = session.begin_nested()
+        try:
+            yield session
+            savepoint.commit()
+        except:
+            savepoint.rollback()
+            raise
+        return
+
+    session = _open_session()
+    try:
+        yield session
+        session.commit()
+    except:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def init_app(app):
+    """Commit the request session of session_scope after each successful request of app."""
+
+    @app.after_request
+    def commit_session(response):
+        session = g.get('db_session')
+        if session is not None and response.status_code < 400:
+            session.commit()
+        return response
+
+    @app.teardown_request
+    def close_session(exc):
+        session = g.pop('db_session', None)
+        if session is not None:
+            # Uncommitted work (errors, error responses) is rolled back by close()
+            session.close()
@@ -2,7 +2,7 @@
 import logging
 import datetime
 
-from sqlalchemy import Column, String, Integer, ForeignKeyConstraint, DateTime
+from sqlalchemy import Column, String, Integer, Float, ForeignKeyConstraint, DateTime, Index
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy import inspect
@@ -29,27 +29,35 @@ class FromDictMixin():
         """Initialize FromDictMixin."""
         pass
 
+    @classmethod
+    def column_names(cls):
+        """Names of the mapped attributes of the class, computed once per class."""
+        # Looked up in the class's own __dict__ so subclasses get their own
+        if '_column_names' not in cls.__dict__:
+            cls._column_names = frozenset(x.key for x in inspect(cls).attrs)
+        return cls._column_names
+
     def preprocess_args(self, *args, **kwargs):
         """Prepare arguments for SQLAlchemy Model initializer."""
         if args and isinstance(args[0], dict):
             kwargs2 = args[0]
             kwargs2.update(kwargs)
             kwargs = kwargs2
-        for key in kwargs:
+        for key, constructor in self.constructors.items():
+            if key not in kwargs:
+                continue
             value = kwargs[key]
-            if key in self.constructors:
-                if isinstance(value, list):
-                    value = [x if isinstance(x, self.constructors[key]) else self.constructors[key](x) for x in value]
-                else:
-                    value = value if isinstance(value, self.constructors[key]) else self.constructors[key](value)
+            if isinstance(value, list):
+                value = [x if isinstance(x, constructor) else constructor(x) for x in value]
+            else:
+                value = value if isinstance(value, constructor) else constructor(value)
             kwargs[key] = value
-        mapper = inspect(self)
-        column_names = {x.key for x in mapper.attrs}
-        input_names = set(kwargs.keys())
-        data_keys = input_names - column_names
-        kwargs_keys = input_names - data_keys
-        column_kwargs = {key: kwargs[key] for key in kwargs_keys}
-        data_kwargs = {key: kwargs[key] for key in data_keys}
+        column_names = self.column_names()
+        if column_names.issuperset(kwargs):
+            # No extra keys to move into etc
+            return {**kwargs, 'etc': {}}
+        column_kwargs = {key: value for key, value in kwargs.items() if key in column_names}
+        data_kwargs = {key: value for key, value in kwargs.items() if key not in column_names}
         kwargs = {**column_kwargs, 'etc': data_kwargs}
         return kwargs
 
@@ -140,6 +148,22 @@ class Question(Base, FromDictMixin):
         self.timestamp = datetime.datetime.now()
 
 
+def answer_score(body):
+    """Score of an answer body, or None."""
+    score = body.get('score') if isinstance(body, dict) else None
+    return score if isinstance(score, (int, float)) and not isinstance(score, bool) else None
+
+
+def answer_bindings(body):
+    """(qnode_id, curie) pairs bound in node_bindings of an answer body."""
+    node_bindings = body.get('node_bindings', {}) if isinstance(body, dict) else {}
+    pairs = set()
+    for qnode_id, curies in node_bindings.items():
+        for curie in curies if isinstance(curies, list) else [curies]:
+            pairs.add((str(qnode_id), str(curie)))
+    return sorted(pairs)
+
+
 class Answer(Base):
     """Answer class."""
 
@@ -151,6 +175,8 @@ class Answer(Base):
     id = Column(Integer, primary_key=True)
     answerset_id = Column(ANSWERSET_ID_TYPE)
     qgraph_id = Column(QGRAPH_ID_TYPE)
+    # copied from body['score'] so answers can be ranked by the database
+    score = Column(Float)
     body = Column(JSON)
     etc = Column(JSON)
 
@@ -174,11 +200,22 @@ class Answer(Base):
         )
     )
 
+    bindings = relationship(
+        'AnswerBinding',
+        backref='answer',
+        cascade='delete,all'  # delete bindings when Answer is deleted
+    )
+
     def __init__(self, *args, **kwargs):
         """Initialize Answer."""
         if len(args) != 1:
             raise RuntimeError('Answer() expects exactly one positional argument.')
         kwargs['body'] = args[0]
+        kwargs['score'] = answer_score(args[0])
+        kwargs['bindings'] = [
+            AnswerBinding(qnode_id=qnode_id, curie=curie)
+            for qnode_id, curie in answer_bindings(args[0])
+        ]
         super().__init__(**kwargs)
 
     def dump(self):
@@ -186,6 +223,28 @@ class Answer(Base):
         return self.body
 
 
+# top-k answers of an answerset, and keyset pages by score. PostgreSQL
+# puts NULLs first in DESC order, so the index follows the NULLS LAST of
+# those queries. SQLite has no NULLS LAST in indexes and no need of it.
+answer_score_index = Index(
+    'ix_answer_answerset_score', Answer.answerset_id, Answer.score.desc().nulls_last(), Answer.id
+).ddl_if(dialect='postgresql')
+
+
+class AnswerBinding(Base):
+    """A curie bound to a question node by an answer, copied from its node_bindings."""
+
+    __tablename__ = 'answer_binding'
+    __table_args__ = (
+        ForeignKeyConstraint(['answer_id'], ['public.answer.id'], ondelete='CASCADE'),
+        Index('ix_answer_binding_curie', 'curie', 'answer_id'),
+        {'schema': 'public'},
+    )
+    answer_id = Column(Integer, primary_key=True)
+    qnode_id = Column(String, primary_key=True)
+    curie = Column(String, primary_key=True)
+
+
 class Answerset(Base, FromDictMixin):
     """Answerset class."""
 
@@ -1,9 +1,16 @@
+import io
 import os
 import json
 # import requests
 from uuid import uuid4
+from sqlalchemy import and_, or_, select, func, inspect, text
+from sqlalchemy.orm import joinedload, selectinload
+from manager import setup_db
 from manager.setup_db import session_scope
-from manager.tables import Answerset, Question
+from manager.tables import Answerset, Answer, AnswerBinding, Question, answer_score, answer_bindings, answer_score_index
+
+# Answers written per statement (or COPY) by add_answerset(bulk=True)
+answer_insert_batch_size = int(os.environ.get('ANSWER_INSERT_BATCH_SIZE', 5000))
 
 # def get_questions_list():
 #     """Get list of questions."""
@@ -55,12 +62,45 @@ from manager.tables import Answerset, Question
 #     return question
 
 
+def _question_query(session):
+    '''Query for questions loading their owner and question graph in the same SELECT, as dump() needs both.'''
+    return session.query(Question)\
+        .options(joinedload(Question.owner), joinedload(Question.question_graph))
+
 def get_question_by_id(qid):
     '''Note this only returns JSON because the Question SQLAlchemy object dies with the session, and we need to close the session'''
     with session_scope() as session:
-        question = session.query(Question).filter(Question.id == qid).first().dump()
-    if not question:
-        raise KeyError("No such question.")
+        question = _question_query(session).filter(Question.id == qid).first()
+        if not question:
+            raise KeyError("No such question.")
+        question = question.dump()
+    return question
+
+def get_question_with_answersets(qid):
+    '''
+    Get a question with its question graph and a summary of its answersets, in one query.
+
+    The answersets are listed as {id, timestamp, answer_count}, newest
+    first. Answers themselves are not loaded.
+    '''
+    answer_count = select(func.count(Answer.id))\
+        .where(Answer.answerset_id == Answerset.id, Answer.qgraph_id == Answerset.qgraph_id)\
+        .scalar_subquery()
+    with session_scope() as session:
+        rows = _question_query(session)\
+            .add_columns(Answerset.id, Answerset.timestamp, answer_count.label('answer_count'))\
+            .outerjoin(Answerset, Answerset.qgraph_id == Question.qgraph_id)\
+            .filter(Question.id == qid)\
+            .order_by(Answerset.timestamp.desc())\
+            .all()
+        if not rows:
+            raise KeyError("No such question.")
+        question = rows[0][0].dump()
+    question['answersets'] = [
+        {'id': aid, 'timestamp': timestamp, 'answer_count': count}
+        for _, aid, timestamp, count in rows
+        if aid is not None
+    ]
     return question
 
 def delete_question_by_id(qid):
@@ -80,18 +120,80 @@ def modify_question_by_id(qid, mods):
 
 def get_qgraph_id_by_question_id(qid):
     with session_scope() as session:
-        qgraph_id = session.query(Question).filter(Question.id == qid).first().qgraph_id
+        qgraph_id = session.query(Question.qgraph_id).filter(Question.id == qid).scalar()
     if not qgraph_id:
         raise KeyError("No such question.")
     return qgraph_id
 
 def get_answerset_by_id(aid):
     with session_scope() as session:
-        answerset = session.query(Answerset).filter(Answerset.id == aid).first().dump()
-    if not answerset:
-        raise KeyError("No such question.")
+        answerset = session.query(Answerset)\
+            .options(selectinload(Answerset.answers))\
+            .filter(Answerset.id == aid)\
+            .first()
+        if not answerset:
+            raise KeyError("No such answerset.")
+        answerset = answerset.dump()
     return answerset
 
+def _json_field(path):
+    """Database side JSON expression for a dotted path into Answer.body."""
+    keys = tuple(int(key) if key.isdigit() else key for key in path.split('.'))
+    return Answer.body[keys[0]] if len(keys) == 1 else Answer.body[keys]
+
+
+def get_answer_page(aid, after=None, limit=100, order='id', fields=None):
+    """
+    Get a page of answers of an answerset without loading the whole set.
+
+    Answers are ordered by id, or by descending score and then id for
+    order='score'. after is the key of the last answer of the previous
+    page (an id, or a (score, id) pair) as returned with that page; the
+    database seeks straight to it instead of counting rows as OFFSET would.
+
+    fields is a list of dotted paths into the answer body, such as
+    ['score', 'node_bindings']. When given, only those parts of each body
+    are read, by the database's JSON operators.
+
+    Returns the page as a list of dicts and the key of its last answer,
+    or None when there are no more answers.
+    """
+    score = Answer.score
+    if fields is None:
+        columns = [Answer.body]
+    else:
+        columns = [_json_field(path).label(path) for path in fields]
+    with session_scope() as session:
+        query = session.query(Answer.id, score, *columns)\
+            .filter(Answer.answerset_id == aid)
+        if order == 'score':
+            if after is not None:
+                after_score, after_id = after
+                if after_score is None:
+                    # Answers without a score come last
+                    query = query.filter(score.is_(None), Answer.id > after_id)
+                else:
+                    # score <= x bounds the index range, NULLs come after
+                    query = query.filter(or_(
+                        and_(score <= after_score, or_(score < after_score, Answer.id > after_id)),
+                        score.is_(None)))
+            query = query.order_by(score.desc().nulls_last(), Answer.id)
+        else:
+            if after is not None:
+                query = query.filter(Answer.id > after)
+            query = query.order_by(Answer.id)
+        rows = query.limit(limit).all()
+    if fields is None:
+        page = [row[2] for row in rows]
+    else:
+        page = [{path: row._mapping[path] for path in fields} for row in rows]
+    if len(rows) < limit:
+        return page, None
+    # By position, fields may hold 'id' or 'score' too
+    last_id, last_score = rows[-1][:2]
+    return page, (last_score, last_id) if order == 'score' else last_id
+
+
 def add_question(q_json, qid=None, **kwargs):
     """Add question."""
     if qid is None:
@@ -103,12 +205,183 @@ def add_question(q_json, qid=None, **kwargs):
     return qid
 
 
-def add_answerset(m_json, mid=None, **kwargs):
-    """Add answerset."""
+def add_answerset(m_json, mid=None, bulk=False, **kwargs):
+    """
+    Add answerset.
+
+    With bulk=True the answers are written with batched INSERTs (COPY on
+    PostgreSQL) instead of one ORM object per answer. Use it for large
+    answersets; the result is the same.
+    """
     if mid is None:
         mid = str(uuid4())
 
     with session_scope() as session:
-        aset = Answerset(m_json, id=mid, **kwargs)
-        session.add(aset)
-    return mid
\ No newline at end of file
+        if bulk:
+            aset = Answerset([], id=mid, **kwargs)
+            session.add(aset)
+            session.flush()
+            insert_answers(session.connection(), m_json, mid, aset.qgraph_id)
+        else:
+            aset = Answerset(m_json, id=mid, **kwargs)
+            session.add(aset)
+    return mid
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _copy_value(value):
+    """A value in COPY text format, where an empty string is NULL."""
+    if value is None:
+        return ''
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _copy(cursor, driver, table, columns, rows):
+    """Write rows with COPY, through a psycopg (3) or psycopg2 cursor."""
+    statement = f"COPY {table.fullname} ({', '.join(columns)}) FROM STDIN WITH (NULL '')"
+    lines = ('\t'.join(_copy_value(value) for value in row) + '\n' for row in rows)
+    if driver == 'psycopg2':
+        cursor.copy_expert(statement, io.StringIO(''.join(lines)))
+        return
+    with cursor.copy(statement) as copy:
+        for line in lines:
+            copy.write(line)
+
+
+def _binding_rows(ids, answers):
+    """(answer_id, qnode_id, curie) rows of answers, given their ids in the same order."""
+    return [
+        (answer_id, qnode_id, curie)
+        for answer_id, answer in zip(ids, answers)
+        for qnode_id, curie in answer_bindings(answer)
+    ]
+
+
+def _copy_answers(connection, answers, answerset_id, qgraph_id):
+    """Write answers and their bindings with COPY on PostgreSQL."""
+    driver = connection.dialect.driver
+    cursor = connection.connection.cursor()
+    try:
+        for batch in _batches(answers, answer_insert_batch_size):
+            # Ids are taken from the sequence up front and written with the
+            # rows, so each binding row names its answer whatever else runs.
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                (Answer.__table__.fullname, len(batch)))
+            ids = [row[0] for row in cursor.fetchall()]
+            _copy(cursor, driver, Answer.__table__, ['id', 'answerset_id', 'qgraph_id', 'score', 'body'], (
+                (answer_id, answerset_id, qgraph_id, answer_score(answer), json.dumps(answer))
+                for answer_id, answer in zip(ids, batch)
+            ))
+            _copy(cursor, driver, AnswerBinding.__table__, ['answer_id', 'qnode_id', 'curie'],
+                  _binding_rows(ids, batch))
+    finally:
+        cursor.close()
+
+
+def insert_answers(connection, answers, answerset_id, qgraph_id=None):
+    """
+    Write answers of an existing answerset without going through the ORM.
+
+    answers can be any iterable; it is consumed answer_insert_batch_size
+    answers at a time. Their score and binding rows are written too.
+    PostgreSQL through psycopg or psycopg2 gets COPY, other databases
+    multi-row INSERTs.
+    """
+    if connection.dialect.name == 'postgresql' and connection.dialect.driver in ('psycopg', 'psycopg2'):
+        _copy_answers(connection, answers, answerset_id, qgraph_id)
+        return
+    insert = Answer.__table__.insert().returning(Answer.__table__.c.id, sort_by_parameter_order=True)
+    for batch in _batches(answers, answer_insert_batch_size):
+        ids = connection.execute(insert, [
+            {'answerset_id': answerset_id, 'qgraph_id': qgraph_id, 'score': answer_score(answer), 'body': answer}
+            for answer in batch
+        ]).scalars().all()
+        bindings = [
+            {'answer_id': answer_id, 'qnode_id': qnode_id, 'curie': curie}
+            for answer_id, qnode_id, curie in _binding_rows(ids, batch)
+        ]
+        if bindings:
+            connection.execute(AnswerBinding.__table__.insert(), bindings)
+
+
+def index_stored_answers(batch_size=None):
+    """Fill in score and binding rows of answers stored before those existed."""
+    batch_size = batch_size or answer_insert_batch_size
+    last_id = 0
+    while True:
+        with session_scope() as session:
+            answers = session.query(Answer)\
+                .filter(Answer.id > last_id, Answer.score.is_(None), ~Answer.bindings.any())\
+                .order_by(Answer.id)\
+                .limit(batch_size)\
+                .all()
+            if not answers:
+                return
+            for answer in answers:
+                answer.score = answer_score(answer.body)
+                answer.bindings = [
+                    AnswerBinding(qnode_id=qnode_id, curie=curie)
+                    for qnode_id, curie in answer_bindings(answer.body)
+                ]
+            last_id = answers[-1].id
+
+
+def upgrade_answer_tables():
+    """
+    Bring a database created before answer scores and bindings up to date.
+
+    Adds the score column and the answer_binding table with their indexes
+    where they are missing, then fills them in with index_stored_answers().
+    Run it once after upgrading, with
+
+        python -m manager.tables_accessors upgrade
+    """
+    engine = setup_db.engine
+    table = Answer.__table__
+    columns = {column['name'] for column in inspect(engine).get_columns(table.name, schema=table.schema)}
+    with engine.begin() as connection:
+        if 'score' not in columns:
+            connection.execute(text(f'ALTER TABLE {table.fullname} ADD COLUMN score FLOAT'))
+        answer_score_index.create(connection, checkfirst=True)
+        AnswerBinding.__table__.create(connection, checkfirst=True)
+    index_stored_answers()
+
+
+def get_top_answers(aid, k=10):
+    """Bodies of the k best scored answers of an answerset, by an index scan."""
+    with session_scope() as session:
+        return [body for body, in session.query(Answer.body)
+                .filter(Answer.answerset_id == aid, Answer.score.isnot(None))
+                .order_by(Answer.score.desc().nulls_last(), Answer.id)
+                .limit(k)]
+
+
+def get_answers_by_curie(aid, curie, qnode_id=None, limit=100):
+    """Bodies of the best scored answers of an answerset binding curie (to qnode_id, if given)."""
+    with session_scope() as session:
+        matching = session.query(AnswerBinding.answer_id).filter(AnswerBinding.curie == curie)
+        if qnode_id is not None:
+            matching = matching.filter(AnswerBinding.qnode_id == qnode_id)
+        query = session.query(Answer.body)\
+            .filter(Answer.answerset_id == aid, Answer.id.in_(matching))\
+            .order_by(Answer.score.desc().nulls_last(), Answer.id)\
+            .limit(limit)
+        return [body for body, in query]
+
+
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1:] != ['upgrade']:
+        sys.exit(f'usage: {sys.argv[0]} upgrade')
+    upgrade_answer_tables()
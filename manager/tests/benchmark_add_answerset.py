@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+'''
+Compare the ORM and bulk paths of add_answerset.
+
+    python manager/tests/benchmark_add_answerset.py [number of answers]
+
+Answers of answerset.json are repeated up to the given number (20000 by
+default) and written to the configured database twice, once per path, as answersets
+of a new question graph. The question graph and both answersets are
+deleted afterwards.
+'''
+
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from manager.setup_db import session_scope
+from manager.tables import QGraph
+from manager.tables_accessors import add_answerset
+
+answerset_path = os.path.join(os.path.dirname(__file__), '..', '..', 'answerset.json')
+
+
+def timed_add(answers, qgraph_id, bulk):
+    start = time.perf_counter()
+    mid = add_answerset(answers, bulk=bulk, qgraph_id=qgraph_id)
+    return mid, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    with open(answerset_path) as answerset_file:
+        answers = json.load(answerset_file)['answers']
+    answers = [answers[i % len(answers)] for i in range(count)]
+
+    with session_scope() as session:
+        qgraph = QGraph({'nodes': [], 'edges': []})
+        session.add(qgraph)
+        session.flush()
+        qgraph_id = qgraph.id
+
+    for bulk in (False, True):
+        mid, seconds = timed_add(answers, qgraph_id, bulk)
+        print(f"{'bulk' if bulk else 'ORM'}: {count} answers in {seconds:.2f} s, {count / seconds:.0f} rows/s")
+
+    # Deleting the question graph deletes its answersets and their answers
+    with session_scope() as session:
+        session.delete(session.get(QGraph, qgraph_id))
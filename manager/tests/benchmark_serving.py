@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+'''
+Compare one sync gunicorn worker with one eventlet worker on proxy requests.
+
+    python manager/tests/benchmark_serving.py [concurrent requests]
+
+The manager is started with manager/gunicorn_conf.py against a local
+ranker stand-in answering every Omnicorp lookup after half a second. The
+given number of lookups (100 by default) is then sent at once to each
+worker class in turn.
+'''
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from manager.tests.test_serving import SlowUpstream, start_upstream, start_manager, load
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    upstream = start_upstream()
+    for worker_class in ('sync', 'eventlet'):
+        process, port = start_manager(worker_class, upstream.server_address[1], tempfile.mkdtemp())
+        try:
+            seconds = load(port, count)
+        finally:
+            process.terminate()
+            process.wait(10)
+        print(f'{worker_class}: {count} requests of {SlowUpstream.delay} s upstream time '
+              f'in {seconds:.2f} s, {count / seconds:.1f} requests/s')
+    upstream.shutdown()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+'''
+Compare generate_summary with the list based walk it replaced.
+
+    python manager/tests/benchmark_summary.py [number of answers]
+
+answerset.json is repeated up to the given number of answers (100000 by
+default), each answer holding the nodes and edges it binds. The same is
+then done with the same number of nodes in long walks, where the cost of
+list lookups grows with the square of the walk length.
+'''
+
+import os
+import sys
+import json
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from manager.answer_summary import generate_summary
+
+answerset_path = os.path.join(os.path.dirname(__file__), '..', '..', 'answerset.json')
+
+
+def list_summary(nodes, edges):
+    '''The quadratic walk generate_summary used to do.'''
+    summary = nodes[0]['name']
+    latest_node_id = nodes[0]['id']
+    node_ids = [n['id'] for n in nodes]
+    edges = [e for e in edges if not e['type'] == 'literature_co-occurrence']
+    edge_starts = [e['source_id'] for e in edges]
+    edge_ends = [e['target_id'] for e in edges]
+    edge_predicates = [e['type'] for e in edges]
+    while True:
+        if latest_node_id in edge_starts:
+            idx = edge_starts.index(latest_node_id)
+            edge_starts.pop(idx)
+            latest_node_id = edge_ends.pop(idx)
+            latest_node = nodes[node_ids.index(latest_node_id)]
+            summary += f" -{edge_predicates.pop(idx)}-> {latest_node['name']}"
+        elif latest_node_id in edge_ends:
+            idx = edge_ends.index(latest_node_id)
+            edge_ends.pop(idx)
+            latest_node_id = edge_starts.pop(idx)
+            latest_node = nodes[node_ids.index(latest_node_id)]
+            summary += f" <-{edge_predicates.pop(idx)}- {latest_node['name']}"
+        else:
+            break
+    return summary
+
+
+def bound(values, bindings):
+    ids = []
+    for value in bindings.values():
+        ids.extend(value if isinstance(value, list) else [value])
+    return [values[i] for i in ids if i in values]
+
+
+def load_answers(count):
+    '''Answers of answerset.json as {nodes, edges} walks, repeated up to count.'''
+    with open(answerset_path) as answerset_file:
+        message = json.load(answerset_file)
+    nodes = {n['id']: n for n in message['knowledge_graph']['nodes']}
+    edges = {e['id']: e for e in message['knowledge_graph']['edges']}
+    walks = [
+        {'nodes': bound(nodes, a['node_bindings']), 'edges': bound(edges, a['edge_bindings'])}
+        for a in message['answers']
+    ]
+    return [walks[i % len(walks)] for i in range(count)]
+
+
+def chain(answers, length):
+    '''Walks of length nodes taken from answers, with edges in shuffled order.'''
+    nodes = [n for a in answers[:83] for n in a['nodes']]
+    edges = [e for a in answers[:83] for e in a['edges'] if e['type'] != 'literature_co-occurrence']
+    rng = random.Random(0)
+    walks = []
+    for i in range(0, len(answers), length):
+        walk_nodes = [{**rng.choice(nodes), 'id': f'N:{j}'} for j in range(length)]
+        walk_edges = [
+            {**rng.choice(edges), 'source_id': f'N:{j}', 'target_id': f'N:{j + 1}'}
+            if j % 2 else
+            {**rng.choice(edges), 'source_id': f'N:{j + 1}', 'target_id': f'N:{j}'}
+            for j in range(length - 1)
+        ]
+        rng.shuffle(walk_edges)
+        walks.append({'nodes': walk_nodes, 'edges': walk_edges})
+    return walks
+
+
+def compare(name, answers):
+    start = time.perf_counter()
+    expected = [list_summary(a['nodes'], a['edges']) for a in answers]
+    list_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    summaries = [generate_summary(a['nodes'], a['edges']) for a in answers]
+    dict_time = time.perf_counter() - start
+
+    assert summaries == expected
+    print(f'{name}: list walk {list_time:.2f} s, adjacency walk {dict_time:.2f} s')
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    answers = load_answers(count)
+    compare(f'{count} answers', answers)
+    for length in (30, 300, 3000):
+        compare(f'{count} nodes in walks of {length}', chain(answers, length))
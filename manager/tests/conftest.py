@@ -0,0 +1,74 @@
+import os
+import sys
+import types
+import tempfile
+
+import pytest
+
+# manager modules read ROBOKOP_HOME and write logs when they are imported
+if 'ROBOKOP_HOME' not in os.environ:
+    os.environ['ROBOKOP_HOME'] = tempfile.mkdtemp(prefix='robokop-test-')
+os.makedirs(os.path.join(os.environ['ROBOKOP_HOME'], 'logs'), exist_ok=True)
+
+# manager.setup_db connects to PostgreSQL by default; tests run on SQLite
+os.environ.setdefault(
+    'DATABASE_URI', f"sqlite:///{os.path.join(os.environ['ROBOKOP_HOME'], 'robokop.sqlite')}")
+
+
+def _user_module():
+    '''
+    manager.tables imports manager.user and manager.task for the models its
+    relationships name, and neither is in this tree. Where they are missing,
+    stand in with the one model tables.py refers to.
+    '''
+    from sqlalchemy import Column, Integer, String
+    from manager.setup_db import Base
+
+    class User(Base):
+        __tablename__ = 'user'
+        __table_args__ = {'schema': 'private'}
+        id = Column(Integer, primary_key=True)
+        email = Column(String)
+
+    module = types.ModuleType('manager.user')
+    module.User = User
+    return module
+
+
+@pytest.fixture
+def tables():
+    '''The manager.tables module.'''
+    for name in ('manager.user', 'manager.task'):
+        try:
+            __import__(name)
+        except ModuleNotFoundError:
+            sys.modules[name] = _user_module() if name == 'manager.user' else types.ModuleType(name)
+    import manager.tables
+    return manager.tables
+
+
+@pytest.fixture
+def database(tables, tmp_path, monkeypatch):
+    '''Empty tables of manager.tables in fresh SQLite files, used by session_scope.'''
+    from sqlalchemy import create_engine, event
+    import manager.setup_db as setup_db
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'robokop.sqlite'}")
+
+    # SQLite has no schemas, each is an attached database
+    @event.listens_for(engine, 'connect')
+    def attach_schemas(dbapi_connection, connection_record):
+        for schema in ('public', 'private'):
+            dbapi_connection.execute(f"ATTACH DATABASE '{tmp_path / schema}.sqlite' AS {schema}")
+        # Let SQLAlchemy begin transactions, so that savepoints nest in them
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def begin(connection):
+        connection.exec_driver_sql('BEGIN')
+
+    setup_db.Base.metadata.create_all(engine)
+    monkeypatch.setattr(setup_db, 'engine', engine)
+    monkeypatch.setattr(setup_db, 'Session', setup_db.sessionmaker(bind=engine))
+    yield engine
+    engine.dispose()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+import json
+
+import manager.answer_standard
+from manager.answer_standard import iter_standard, standard_stream
+
+
+def make_answer(i):
+    return {
+        'id': i,
+        'score': 1 / (i + 1),
+        'nodes': [{'id': 'a', 'name': 'A', 'type': 'disease'}, {'id': f'b{i}', 'name': f'B{i}', 'type': 'gene'}],
+        'edges': [{
+            'source_id': 'a', 'target_id': f'b{i}', 'type': 'x', 'weight': 0.5,
+            'edge_source': 'test', 'publications': ['PMID:1'], 'num_publications': 2,
+        }],
+    }
+
+
+def test_iter_standard_summarizes_in_batches(monkeypatch):
+    batches = []
+    generate_summaries = manager.answer_standard.generate_summaries
+
+    def spy(answers):
+        batches.append(len(answers))
+        return generate_summaries(answers)
+    monkeypatch.setattr(manager.answer_standard, 'generate_summaries', spy)
+
+    read = []
+
+    def answers():
+        for i in range(7):
+            read.append(i)
+            yield make_answer(i)
+
+    results = iter_standard(answers(), batch_size=3)
+    first = next(results)
+    assert read == [0, 1, 2]
+    assert first == {
+        'confidence': 1.0,
+        'id': 0,
+        'result_graph': {
+            'node_list': [
+                {'description': 'A', 'id': 'a', 'name': 'A', 'type': 'disease'},
+                {'description': 'B0', 'id': 'b0', 'name': 'B0', 'type': 'gene'},
+            ],
+            'edge_list': [{
+                'confidence': 0.5, 'provided_by': 'test', 'source_id': 'a', 'target_id': 'b0',
+                'type': 'x', 'publications': ['PMID:1'], 'num_publications': 3,
+            }],
+        },
+        'result_type': 'individual query answer',
+        'text': 'A -x-> B0',
+    }
+    assert [result['id'] for result in results] == list(range(1, 7))
+    assert batches == [3, 3, 1]
+
+
+def test_standard_stream_is_json():
+    header = {'id': 1, 'message': '2 potential answers found.'}
+    body = b''.join(standard_stream(header, (make_answer(i) for i in range(2)), batch_size=1))
+    standard = json.loads(body)
+    assert standard['message'] == header['message']
+    assert [result['text'] for result in standard['result_list']] == ['A -x-> B0', 'A -x-> B1']
+
+    assert json.loads(b''.join(standard_stream({}, []))) == {'result_list': []}
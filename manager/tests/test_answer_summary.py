@@ -0,0 +1,21 @@
+#!/usr/bin/env python
+
+from manager.answer_summary import generate_summary, generate_summaries
+
+from benchmark_summary import list_summary, load_answers
+
+
+def test_summaries_match_list_walk():
+    answers = load_answers(83)
+    assert generate_summaries(answers) == [list_summary(a['nodes'], a['edges']) for a in answers]
+
+
+def test_summary_walks_both_directions():
+    nodes = [{'id': 'a', 'name': 'A'}, {'id': 'b', 'name': 'B'}, {'id': 'c', 'name': 'C'}]
+    edges = [
+        {'source_id': 'a', 'target_id': 'b', 'type': 'x'},
+        {'source_id': 'a', 'target_id': 'b', 'type': 'literature_co-occurrence'},
+        {'source_id': 'c', 'target_id': 'b', 'type': 'y'},
+    ]
+    assert generate_summary(nodes, edges) == 'A -x-> B <-y- C'
+    assert generate_summary(nodes, edges) == list_summary(nodes, edges)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+import threading
+
+import pytest
+
+from manager.cache import TTLCache, LRUCache, SQLiteCache, TieredCache
+
+
+class Clock():
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_serves_stale_while_revalidating():
+    clock = Clock()
+    cache = TTLCache(ttl=10, stale=100, clock=clock)
+    loads = []
+    refreshed = threading.Event()
+
+    def loader():
+        loads.append(clock.now)
+        if len(loads) > 1:
+            refreshed.set()
+        return len(loads)
+
+    assert cache.get('a', loader) == 1
+    clock.now = 5
+    assert cache.get('a', loader) == 1
+    assert loads == [0]
+
+    # Stale: the old value comes back right away, a new one is loaded behind it
+    clock.now = 50
+    assert cache.get('a', loader) == 1
+    assert refreshed.wait(5)
+    assert cache.get('a', loader) == 2
+
+    # Expired: loaded before returning
+    clock.now = 500
+    assert cache.get('a', loader) == 3
+
+    cache.invalidate()
+    assert cache.get('a', loader) == 4
+
+
+def test_ttl_cache_keeps_stale_values_on_errors():
+    clock = Clock()
+    cache = TTLCache(ttl=10, clock=clock)
+    entry = cache.get_entry('a', lambda: ['x'])
+    assert entry.etag == cache.get_entry('a', lambda: ['y']).etag
+
+    def failing():
+        raise ValueError('upstream down')
+    clock.now = 20
+    assert cache.get('a', failing) == ['x']
+    with pytest.raises(ValueError):
+        cache.get('b', failing)
+
+
+def test_metadata_responses_are_cached(monkeypatch):
+    from manager.server import app
+    import manager.api.misc_api as misc_api
+    calls = []
+
+    def builder_metadata(name):
+        calls.append(name)
+        return ['chemical_substance', 'gene', 'NAME.DRUG']
+    monkeypatch.setattr(misc_api, 'builder_metadata', builder_metadata)
+    misc_api.metadata_cache.invalidate()
+
+    client = app.test_client()
+    response = client.get('/api/concepts/')
+    assert response.get_json() == ['chemical_substance', 'gene']
+    assert response.cache_control.max_age == misc_api.metadata_cache.ttl
+    etag, _ = response.get_etag()
+    assert client.get('/api/concepts/', headers={'If-None-Match': f'"{etag}"'}).status_code == 304
+    assert calls == ['concepts']
+
+
+def test_tiered_cache(tmp_path):
+    clock = Clock()
+    path = str(tmp_path / 'cache.sqlite')
+    cache = TieredCache(LRUCache(2), SQLiteCache(path, ttl=10, clock=clock))
+    for key in 'abc':
+        assert cache.get(key, lambda: [key]) == [key]
+    assert len(cache.memory) == 2 and cache.memory.get('a') is None
+
+    def failing():
+        raise ValueError('upstream down')
+    assert cache.get('a', failing) == ['a']
+    assert cache.get('a', failing) == ['a']
+    assert cache.stats() == {'memory_entries': 2, 'memory_hits': 1, 'disk_hits': 1, 'misses': 3}
+
+    # A new process sees what is on disk until it expires
+    other = TieredCache(LRUCache(2), SQLiteCache(path, ttl=10, clock=clock))
+    assert other.get_many(['b', 'c', 'd']) == {'b': ['b'], 'c': ['c']}
+    clock.now = 20
+    assert other.get_many(['a']) == {}
+    with pytest.raises(ValueError):
+        other.get('a', failing)
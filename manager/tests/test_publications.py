@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+import json
+import gzip
+
+from manager.publications import PublicationStore, import_summaries, normalize_pmid, _summaries
+from manager.pubmed import PubmedCache
+from manager.tests.test_pubmed import MemoryRedis
+
+
+def summary(pmid):
+    return {
+        'uid': str(pmid),
+        'title': f'Paper {pmid}',
+        'authors': [{'name': 'Doe J'}],
+        'fulljournalname': 'Journal',
+        'source': 'J',
+        'pubdate': '2018',
+        'elocationid': '',
+        'sortpubdate': 'ignored',
+    }
+
+
+def test_import_and_lookup(tmp_path):
+    esummary = tmp_path / 'esummary.json'
+    esummary.write_text(json.dumps({'result': {'uids': ['1', '2'], '1': summary(1), '2': summary(2)}}))
+    lines = tmp_path / 'more.jsonl.gz'
+    with gzip.open(lines, 'wt') as f:
+        f.write(json.dumps(summary(3)) + '\n')
+        f.write(json.dumps({'uid': '4', 'error': 'cannot get document summary'}) + '\n')
+        f.write(json.dumps({**summary(1), 'title': 'Corrected'}) + '\n')
+
+    path = str(tmp_path / 'pubmed.sqlite')
+    store = PublicationStore(path)
+    assert store.get_many(['1']) == {}
+    assert import_summaries(_summaries(str(esummary)), path) == 2
+    assert import_summaries(_summaries(str(lines)), path) == 2
+
+    assert store.get_many(['1', '3', '4', '5'], ('title', 'authors')) == {
+        '1': {'title': 'Corrected', 'authors': [{'name': 'Doe J'}]},
+        '3': {'title': 'Paper 3', 'authors': [{'name': 'Doe J'}]},
+    }
+    assert store.get_many(['2'])['2'] == {key: value for key, value in summary(2).items() if key != 'sortpubdate'}
+    assert [normalize_pmid(pmid) for pmid in (7, '7', 'PMID:7', 'pmid: 7', 'MESH:7', '')] == \
+        ['7', '7', '7', '7', None, None]
+
+
+def test_bulk_pubmed_uses_the_store(tmp_path, monkeypatch):
+    from manager.server import app
+    import manager.api.misc_api as misc_api
+    path = str(tmp_path / 'pubmed.sqlite')
+    import_summaries([summary(1), summary(2)], path)
+    monkeypatch.setattr(misc_api, 'publication_store', PublicationStore(path))
+    client = MemoryRedis()
+    fetched = []
+
+    def fetch(pmid):
+        fetched.append(pmid)
+        return summary(pmid)
+    monkeypatch.setattr(misc_api, 'pubmed_cache', PubmedCache(client=client, fetch=fetch))
+    app_client = app.test_client()
+
+    response = app_client.post('/api/pubmed/', json={'pmids': ['PMID:1', 2, '3'], 'fields': ['uid', 'title']})
+    assert response.status_code == 200
+    assert response.get_json()['publications'] == {
+        '1': {'uid': '1', 'title': 'Paper 1'},
+        '2': {'uid': '2', 'title': 'Paper 2'},
+        '3': {'uid': '3', 'title': 'Paper 3'},
+    }
+    assert fetched == ['3'] and client.mgets == 1
+    assert app_client.get('/api/pubmed/2').get_json()['fulljournalname'] == 'Journal'
+    assert fetched == ['3']
+    assert app_client.get('/api/pubmed/PMID:4').get_json()['uid'] == '4'
+    assert fetched == ['3', '4']
+    assert app_client.get('/api/pubmed/MESH:4').status_code == 400
+
+    assert app_client.post('/api/pubmed/', json={'pmids': ['MESH:1']}).status_code == 400
+    assert app_client.post('/api/pubmed/', json={'pmids': ['1'], 'fields': ['abstract']}).status_code == 400
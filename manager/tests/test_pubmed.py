@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+import json
+import threading
+
+import pytest
+
+from manager.pubmed import PubmedCache
+
+
+class MemoryRedis():
+    '''The part of redis.Redis used by PubmedCache, in memory.'''
+
+    def __init__(self):
+        self.values = {}
+        self.mgets = 0
+
+    def mget(self, keys):
+        self.mgets += 1
+        return [self.values.get(key) for key in keys]
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value.encode('utf-8')
+
+
+class Fetcher():
+    '''Stand-in for PubMed, answering once released.'''
+
+    def __init__(self):
+        self.calls = []
+        self.release = threading.Event()
+
+    def __call__(self, pmid):
+        self.calls.append(pmid)
+        assert self.release.wait(5)
+        if pmid == '404':
+            raise KeyError(pmid)
+        return {'uid': pmid, 'title': f'Paper {pmid}'}
+
+
+@pytest.fixture
+def pubmed(monkeypatch):
+    import manager.api.misc_api as misc_api
+    client = MemoryRedis()
+    fetcher = Fetcher()
+    cache = PubmedCache(client=client, fetch=fetcher)
+    monkeypatch.setattr(misc_api, 'pubmed_cache', cache)
+    return client, fetcher, cache
+
+
+def test_pubmed_misses_are_fetched_once(pubmed):
+    from manager.server import app
+    client, fetcher, cache = pubmed
+    app_client = app.test_client()
+
+    response = app_client.get('/api/pubmed/1?async=true')
+    assert response.status_code == 202
+    assert response.headers['Location'] == '/api/pubmed/1?async=true'
+    assert app_client.get('/api/pubmed/1', headers={'Prefer': 'respond-async'}).status_code == 202
+    assert fetcher.calls == ['1']
+
+    fetcher.release.set()
+    response = app_client.get('/api/pubmed/1')
+    assert response.status_code == 200
+    assert response.get_json() == {'uid': '1', 'title': 'Paper 1'}
+    assert json.loads(client.values['robokop_pubmed_cache_1']) == {'uid': '1', 'title': 'Paper 1'}
+    assert app_client.get('/api/pubmed/1?async=true').status_code == 200
+    assert fetcher.calls == ['1']
+
+    # Failures are reported once, then fetched again
+    assert app_client.get('/api/pubmed/404').status_code == 404
+    assert app_client.get('/api/pubmed/404').status_code == 404
+    assert fetcher.calls == ['1', '404', '404']
+
+
+def test_pubmed_bulk(pubmed):
+    from manager.server import app
+    client, fetcher, cache = pubmed
+    client.set('robokop_pubmed_cache_1', json.dumps({'uid': '1'}))
+    app_client = app.test_client()
+
+    response = app_client.post('/api/pubmed/?async=true', json={'pmids': ['1', 2, '2']})
+    assert response.status_code == 202
+    assert response.get_json() == {'publications': {'1': {'uid': '1'}}, 'pending': ['2'], 'errors': {}}
+    assert client.mgets == 1
+
+    fetcher.release.set()
+    response = app_client.post('/api/pubmed/', json={'pmids': ['1', '2', '404']})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert sorted(body['publications']) == ['1', '2'] and list(body['errors']) == ['404']
+    assert fetcher.calls == ['2', '404']
+    assert app_client.post('/api/pubmed/', json={'pmids': '1'}).status_code == 400
+
+
+def test_pubmed_fetches_done_at_once():
+    client = MemoryRedis()
+
+    def fetch(pmid):
+        return {'uid': pmid}
+    cache = PubmedCache(client=client, fetch=fetch)
+    for _ in range(2):
+        found, pending = cache.lookup(['1'])
+        if pending:
+            assert pending['1'].result(timeout=5) == {'uid': '1'}
+    assert cache.lookup(['1']) == ({'1': {'uid': '1'}}, {})
+    assert cache._pending == {}
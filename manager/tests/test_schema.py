@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+import json
+import datetime
+
+import pytest
+from sqlalchemy import event
+
+pytest.importorskip('graphene')
+from graphql_relay import from_global_id, to_global_id
+
+
+@pytest.fixture
+def schema(database):
+    import manager.api.schema
+    return manager.api.schema
+
+
+def test_query_cost(tables):
+    from manager.api.schema import query_cost, default_page_size
+    query = '''{
+        questions(first: 10) { edges { node {
+            naturalQuestion
+            answersets(first: 5) { answers(first: 20) { id } }
+        } } }
+    }'''
+    # questions, edges and nodes: 10 each, answersets: 50, answers: 1000
+    assert query_cost(query) == 1080
+
+    query = '''
+    query Answers($count: Int) { answers(first: $count) { edges { node { ...answer } } } }
+    fragment answer on Answer { id score }
+    '''
+    assert query_cost(query, {'count': 7}) == 21
+    assert query_cost(query) == 3 * default_page_size
+    assert query_cost('{ node(id: "x") { ... on Question { answersets { id } } } }') == 1 + default_page_size
+
+
+def add_questions(count, answersets, answers):
+    from manager.tables import Answerset
+    from manager.setup_db import session_scope
+    from manager.tables_accessors import add_question, add_answerset, get_qgraph_id_by_question_id
+    for i in range(count):
+        qid = add_question({'natural_question': f'q{i}', 'question_graph': {'nodes': [], 'edges': []}}, qid=f'q{i}')
+        for j in range(answersets):
+            aid = add_answerset(
+                [{'score': k, 'name': f'q{i}a{j}-{k}'} for k in range(answers)],
+                mid=f'q{i}a{j}', qgraph_id=get_qgraph_id_by_question_id(qid))
+            with session_scope() as session:
+                session.query(Answerset).filter(Answerset.id == aid)\
+                    .update({Answerset.timestamp: datetime.datetime(2020, 1, j + 1)})
+
+
+def test_nested_pages_are_limited_in_sql(schema, database, monkeypatch):
+    monkeypatch.setattr(schema, 'default_page_size', 2)
+    add_questions(3, answersets=3, answers=4)
+    statements = []
+
+    @event.listens_for(database, 'before_cursor_execute')
+    def count(connection, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append(statement)
+
+    result = schema.execute('''{
+        questions(first: 3) { edges { node {
+            naturalQuestion
+            questionGraph
+            answersets { id answers(first: 2, offset: 1) { score body } }
+        } } }
+    }''')
+    assert 'errors' not in result
+    questions = [edge['node'] for edge in result['data']['questions']['edges']]
+    assert sorted(question['naturalQuestion'] for question in questions) == ['q0', 'q1', 'q2']
+    question = next(question for question in questions if question['naturalQuestion'] == 'q1')
+    assert json.loads(question['questionGraph']) == {'nodes': [], 'edges': []}
+    # Newest two answersets, second and third best answers of each
+    assert [from_global_id(answerset['id']) for answerset in question['answersets']] == [
+        ('Answerset', 'q1a2'), ('Answerset', 'q1a1')]
+    assert [
+        [json.loads(answer['body'])['name'] for answer in answerset['answers']]
+        for answerset in question['answersets']
+    ] == [['q1a2-2', 'q1a2-1'], ['q1a1-2', 'q1a1-1']]
+    # Count and page of questions, then one query per level
+    assert len(statements) == 4
+    assert 'row_number() OVER' in statements[-1]
+
+
+def test_connection_pages(schema):
+    add_questions(1, answersets=1, answers=5)
+    query = '''query Answers($after: String) {
+        answers(first: 2, after: $after) { pageInfo { hasNextPage endCursor } edges { node { score } } }
+    }'''
+    scores = []
+    after = None
+    while True:
+        answers = schema.execute(query, {'after': after})['data']['answers']
+        scores.extend(edge['node']['score'] for edge in answers['edges'])
+        if not answers['pageInfo']['hasNextPage']:
+            break
+        after = answers['pageInfo']['endCursor']
+    assert scores == [0, 1, 2, 3, 4]
+
+    answers = schema.execute('{ answers(last: 2) { edges { node { score } } } }')['data']['answers']
+    assert [edge['node']['score'] for edge in answers['edges']] == [3, 4]
+
+
+def test_costly_queries_are_refused(schema, monkeypatch):
+    monkeypatch.setattr(schema, 'max_query_cost', 100)
+    result = schema.execute('{ answers(first: 101) { edges { node { id } } } }')
+    assert result == {'errors': [{'message': 'Query cost 303 exceeds the limit of 100.'}]}
+
+
+def test_nodes(schema):
+    add_questions(1, answersets=1, answers=1)
+    query = '{ node(id: "%s") { ... on Question { naturalQuestion } ... on Answerset { answers { score } } } }'
+    assert schema.execute(query % to_global_id('Question', 'q0'))['data'] == {'node': {'naturalQuestion': 'q0'}}
+    assert schema.execute(query % to_global_id('Answerset', 'q0a0'))['data'] == {'node': {'answers': [{'score': 0}]}}
+    assert schema.execute(query % to_global_id('Question', 'none'))['data'] == {'node': None}
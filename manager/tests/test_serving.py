@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import socket
+import subprocess
+import threading
+from importlib.util import find_spec
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+import requests
+
+root = os.path.join(os.path.dirname(__file__), '..', '..')
+
+
+class SlowUpstream(BaseHTTPRequestHandler):
+    '''Ranker stand-in answering every Omnicorp lookup after delay seconds.'''
+    delay = 0.5
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        body = b'["PMID:1"]'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class UpstreamServer(ThreadingHTTPServer):
+    request_queue_size = 256
+    daemon_threads = True
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_upstream():
+    server = UpstreamServer(('127.0.0.1', 0), SlowUpstream)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_manager(worker_class, upstream_port, home, workers=1):
+    '''The manager under gunicorn with the production settings, and its port.'''
+    port = free_port()
+    os.makedirs(os.path.join(home, 'logs'), exist_ok=True)
+    env = {
+        **os.environ,
+        'ROBOKOP_HOME': home,
+        'MANAGER_PORT': str(port),
+        'MANAGER_WORKER_CLASS': worker_class,
+        'MANAGER_WORKERS': str(workers),
+        'RANKER_HOST': '127.0.0.1',
+        'RANKER_PORT': str(upstream_port),
+        'PYTHONPATH': root,
+    }
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'python:manager.gunicorn_conf', 'manager.wsgi:app'],
+        cwd=root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f'http://127.0.0.1:{port}/api/omnicorp/cache/', timeout=1)
+            return process, port
+        except requests.exceptions.RequestException:
+            if process.poll() is not None:
+                break
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'gunicorn with {worker_class} workers did not start')
+
+
+def load(port, count):
+    '''Seconds count concurrent Omnicorp lookups of distinct pairs take.'''
+    def lookup(i):
+        r = requests.get(f'http://127.0.0.1:{port}/api/omnicorp/A:{i}/B:{time.monotonic_ns()}', timeout=60)
+        r.raise_for_status()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=count) as pool:
+        list(pool.map(lookup, range(count)))
+    return time.perf_counter() - start
+
+
+def test_eventlet_worker_serves_proxy_requests_concurrently(tmp_path):
+    # Importing the eventlet worker would monkey patch the test process
+    if find_spec('eventlet') is None or find_spec('gunicorn.workers.geventlet') is None:
+        pytest.skip('gunicorn has no eventlet worker')
+    upstream = start_upstream()
+    process, port = start_manager('eventlet', upstream.server_address[1], str(tmp_path))
+    try:
+        count = 40
+        seconds = load(port, count)
+        # One blocking worker would take count * delay = 20 s
+        assert seconds < count * SlowUpstream.delay / 4
+    finally:
+        process.terminate()
+        process.wait(10)
+        upstream.shutdown()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine
+
+from manager.setup_db import engine_settings, init_app, pool_settings, pool_metrics, session_scope
+
+
+@pytest.mark.parametrize('uri', ['sqlite://', 'sqlite:///robokop.sqlite', 'postgresql://robokop@localhost/robokop'])
+def test_pool_settings_fit_the_dialect(uri, monkeypatch):
+    import manager.setup_db as setup_db
+    settings = engine_settings(uri)
+    if uri != 'sqlite://':
+        assert settings == pool_settings
+        return
+    assert settings == {'pool_recycle': pool_settings['pool_recycle'], 'pool_pre_ping': pool_settings['pool_pre_ping']}
+    engine = create_engine(uri, **settings)
+    monkeypatch.setattr(setup_db, 'engine', engine)
+    # No QueuePool state to report
+    assert set(pool_metrics.snapshot()) == {'connects', 'checkouts', 'wait_seconds_total', 'wait_seconds_max'}
+    engine.dispose()
+
+
+@pytest.fixture
+def app(database):
+    from manager.tables import Question
+    from manager.tables_accessors import add_question, get_question_by_id
+    app = Flask(__name__)
+    init_app(app)
+    sessions = []
+
+    @app.route('/questions/<qid>/', methods=['POST'])
+    def post_question(qid):
+        add_question({'natural_question': qid, 'question_graph': {}}, qid=qid)
+        # A miss in the same request does not undo the question
+        try:
+            get_question_by_id('none')
+        except KeyError:
+            pass
+        for _ in range(2):
+            with session_scope() as session:
+                sessions.append(session)
+        return qid
+
+    @app.route('/questions/<qid>/fail/', methods=['POST'])
+    def post_question_and_fail(qid):
+        add_question({'natural_question': qid, 'question_graph': {}}, qid=qid)
+        return 'Not today', 400
+
+    @app.route('/questions/<qid>/undo/', methods=['POST'])
+    def post_question_and_undo(qid):
+        add_question({'natural_question': qid, 'question_graph': {}}, qid=f'{qid}-kept')
+        try:
+            with session_scope() as session:
+                session.add(Question({'natural_question': qid, 'question_graph': {}}, id=qid))
+                session.flush()
+                raise RuntimeError('undo')
+        except RuntimeError:
+            pass
+        return qid
+
+    app.sessions = sessions
+    return app
+
+
+def stored_question_ids():
+    from manager.tables import Question
+    with session_scope() as session:
+        return sorted(qid for qid, in session.query(Question.id))
+
+
+def test_request_session(app):
+    client = app.test_client()
+    assert client.post('/questions/q1/').status_code == 200
+    assert client.post('/questions/q2/fail/').status_code == 400
+    assert client.post('/questions/q3/undo/').status_code == 200
+    # Only the scope that raised is undone
+    assert stored_question_ids() == ['q1', 'q3-kept']
+    # Scopes of one request share its session
+    assert len(app.sessions) == 2 and app.sessions[0] is app.sessions[1]
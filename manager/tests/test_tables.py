@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+import time
+
+import pytest
+from sqlalchemy import Column, ForeignKey, Integer, String, inspect
+from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy.types import JSON
+
+
+@pytest.fixture
+def models(tables):
+    '''A minimal FromDictMixin model with a constructed list attribute, on a base of its own.'''
+    Base = declarative_base()
+
+    class Part(Base):
+        __tablename__ = 'part'
+        id = Column(Integer, primary_key=True)
+        thing_id = Column(Integer, ForeignKey('thing.id'))
+        name = Column(String)
+
+        def __init__(self, name):
+            super().__init__(name=name)
+
+    class Thing(Base, tables.FromDictMixin):
+        __tablename__ = 'thing'
+        id = Column(Integer, primary_key=True)
+        name = Column(String)
+        etc = Column(JSON)
+        parts = relationship(Part)
+
+        constructors = {'parts': Part}
+
+        def __init__(self, *args, **kwargs):
+            kwargs = self.preprocess_args(*args, **kwargs)
+            super().__init__(**kwargs)
+
+    # Single table inheritance, with a column of its own
+    class Widget(Thing):
+        kind = Column(String)
+
+    return Thing, Part, Widget
+
+
+def test_column_names_per_class(models):
+    Thing, Part, Widget = models
+    assert Thing.column_names() == {'id', 'name', 'etc', 'parts'}
+    assert Thing.column_names() is Thing.column_names()
+    assert Widget.column_names() == {'id', 'name', 'etc', 'parts', 'kind'}
+    assert Thing.column_names() == {'id', 'name', 'etc', 'parts'}
+
+
+def test_preprocess_args_splits_extra_keys(models):
+    Thing, Part, Widget = models
+    part = Part('b')
+    kwargs = Thing({}).preprocess_args({'name': 'x', 'parts': ['a', part]}, id=1, color='blue')
+    assert kwargs['id'] == 1 and kwargs['name'] == 'x'
+    assert [type(p) for p in kwargs['parts']] == [Part, Part]
+    assert kwargs['parts'][0].name == 'a' and kwargs['parts'][1] is part
+    assert kwargs['etc'] == {'color': 'blue'}
+
+    kwargs = Thing({}).preprocess_args({'name': 'x'}, id=1)
+    assert kwargs == {'name': 'x', 'id': 1, 'etc': {}}
+
+
+def test_preprocess_args_benchmark(models, tables, monkeypatch):
+    '''Column names are looked up once per class, not once per object.'''
+    Thing, Part, Widget = models
+    count = 5000
+    calls = []
+
+    def counting_inspect(*args):
+        calls.append(args)
+        return inspect(*args)
+    monkeypatch.setattr(tables, 'inspect', counting_inspect)
+
+    start = time.perf_counter()
+    for i in range(count):
+        Thing({'name': f'thing {i}', 'parts': [f'part {i}'], 'color': 'blue'})
+    seconds = time.perf_counter() - start
+    print(f'{count} things in {seconds:.2f} s')
+    assert len(calls) <= 1
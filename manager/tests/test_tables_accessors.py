@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+import io
+import json
+import datetime
+from contextlib import contextmanager
+
+import pytest
+
+
+def make_answer(i):
+    answer = {'node_bindings': {'n0': 'MONDO:1', 'n1': [f'HGNC:{i}', f'NCBIGene:{i}']}, 'edge_bindings': {}}
+    if i % 3:
+        answer['score'] = i / 10
+    return answer
+
+
+def add_qgraph():
+    from manager.setup_db import session_scope
+    from manager.tables import QGraph
+    with session_scope() as session:
+        qgraph = QGraph({'nodes': [], 'edges': []})
+        session.add(qgraph)
+        session.flush()
+        return qgraph.id
+
+
+def stored_answers(aid):
+    '''(id, score, body, bindings) of the answers of aid, by id.'''
+    from manager.setup_db import session_scope
+    from manager.tables import Answer
+    with session_scope() as session:
+        return [
+            (answer.id, answer.score, answer.body, sorted((b.qnode_id, b.curie) for b in answer.bindings))
+            for answer in session.query(Answer).filter(Answer.answerset_id == aid).order_by(Answer.id)
+        ]
+
+
+@pytest.mark.parametrize('bulk', [False, True])
+def test_add_answerset_writes_scores_and_bindings(database, monkeypatch, bulk):
+    import manager.tables_accessors
+    from manager.tables_accessors import add_answerset
+    monkeypatch.setattr(manager.tables_accessors, 'answer_insert_batch_size', 3)
+    qgraph_id = add_qgraph()
+
+    answers = [make_answer(i) for i in range(7)]
+    aid = add_answerset(iter(answers) if bulk else answers, bulk=bulk, qgraph_id=qgraph_id)
+
+    stored = stored_answers(aid)
+    # Ids follow the order of the answers, and each binding row names its own answer
+    assert [body for _, _, body, _ in stored] == answers
+    assert [score for _, score, _, _ in stored] == [answer.get('score') for answer in answers]
+    for i, (_, _, _, bindings) in enumerate(stored):
+        assert bindings == [('n0', 'MONDO:1'), ('n1', f'HGNC:{i}'), ('n1', f'NCBIGene:{i}')]
+
+
+class CopyCursor():
+    '''The part of a psycopg or psycopg2 cursor used by _copy_answers, recording COPY data.'''
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.next_id = 41
+        self.copied = {}
+        self.closed = False
+        if driver == 'psycopg2':
+            self.copy_expert = lambda statement, data: self._copied(statement, data.read())
+
+    def execute(self, statement, params):
+        self.result = [(self.next_id + i,) for i in range(params[1])]
+        self.next_id += params[1]
+
+    def fetchall(self):
+        return self.result
+
+    def _copied(self, statement, text):
+        table = statement.split()[1]
+        self.copied.setdefault(table, []).extend(line.split('\t') for line in text.splitlines())
+
+    @contextmanager
+    def copy(self, statement):
+        assert self.driver == 'psycopg'
+        data = io.StringIO()
+        yield data
+        self._copied(statement, data.getvalue())
+
+    def close(self):
+        self.closed = True
+
+
+class CopyConnection():
+    def __init__(self, driver):
+        self.dialect = type('Dialect', (), {'name': 'postgresql', 'driver': driver})
+        self.copy_cursor = CopyCursor(driver)
+        # The DBAPI connection too
+        self.connection = self
+
+    def cursor(self):
+        return self.copy_cursor
+
+
+@pytest.mark.parametrize('driver', ['psycopg', 'psycopg2'])
+def test_copy_answers_names_ids(database, monkeypatch, driver):
+    import manager.tables_accessors
+    from manager.tables_accessors import insert_answers
+    monkeypatch.setattr(manager.tables_accessors, 'answer_insert_batch_size', 2)
+    connection = CopyConnection(driver)
+
+    insert_answers(connection, (make_answer(i) for i in range(3)), 'a1', 7)
+
+    copied = connection.copy_cursor.copied
+    answers = copied['public.answer']
+    assert [row[:4] for row in answers] == [
+        ['41', 'a1', '7', ''], ['42', 'a1', '7', '0.1'], ['43', 'a1', '7', '0.2']]
+    assert [json.loads(row[4]) for row in answers] == [make_answer(i) for i in range(3)]
+    assert copied['public.answer_binding'] == [
+        [str(41 + i), qnode_id, curie]
+        for i in range(3)
+        for qnode_id, curie in [('n0', 'MONDO:1'), ('n1', f'HGNC:{i}'), ('n1', f'NCBIGene:{i}')]
+    ]
+    assert connection.copy_cursor.closed
+
+
+def pages(aid, **kwargs):
+    '''All pages of get_answer_page, following the key of each.'''
+    from manager.tables_accessors import get_answer_page
+    result = []
+    after = None
+    while True:
+        page, after = get_answer_page(aid, after=after, **kwargs)
+        result.append(page)
+        if after is None:
+            return result
+
+
+def test_answer_pages(database):
+    from manager.tables_accessors import add_answerset, get_answer_page
+    qgraph_id = add_qgraph()
+    # Ties and missing scores across page boundaries
+    scores = [0.5, None, 0.9, 0.5, 0.5, None, 0.1, 0.9]
+    answers = [{'score': score, 'node_bindings': {'n0': f'MONDO:{i}'}} for i, score in enumerate(scores)]
+    aid = add_answerset(answers, qgraph_id=qgraph_id)
+    add_answerset([{'score': 1.0}], qgraph_id=qgraph_id)
+
+    by_id = pages(aid, limit=3)
+    assert [len(page) for page in by_id] == [3, 3, 2]
+    assert [answer for page in by_id for answer in page] == answers
+
+    by_score = [answer['node_bindings']['n0'] for page in pages(aid, limit=2, order='score') for answer in page]
+    assert by_score == [f'MONDO:{i}' for i in [2, 7, 0, 3, 4, 6, 1, 5]]
+
+    page, after = get_answer_page(aid, limit=3, order='score', fields=['node_bindings.n0', 'score'])
+    assert page == [
+        {'node_bindings.n0': 'MONDO:2', 'score': 0.9},
+        {'node_bindings.n0': 'MONDO:7', 'score': 0.9},
+        {'node_bindings.n0': 'MONDO:0', 'score': 0.5},
+    ]
+    ids = [answer_id for answer_id, _, _, _ in stored_answers(aid)]
+    assert after == (0.5, ids[0])
+
+    assert get_answer_page('none') == ([], None)
+
+
+def test_top_answers_and_answers_by_curie(database):
+    from manager.tables_accessors import add_answerset, get_top_answers, get_answers_by_curie
+    qgraph_id = add_qgraph()
+    answers = [make_answer(i) for i in range(7)]
+    aid = add_answerset(answers, qgraph_id=qgraph_id)
+    add_answerset([make_answer(9)], qgraph_id=qgraph_id)
+
+    # Answers without a score are left out
+    assert get_top_answers(aid, k=3) == [answers[5], answers[4], answers[2]]
+    assert get_top_answers(aid, k=10) == [answers[i] for i in (5, 4, 2, 1)]
+
+    # Scored answers first, then the others by id
+    assert get_answers_by_curie(aid, 'MONDO:1') == [answers[i] for i in (5, 4, 2, 1, 0, 3, 6)]
+    assert get_answers_by_curie(aid, 'MONDO:1', limit=2) == [answers[5], answers[4]]
+    assert get_answers_by_curie(aid, 'HGNC:3') == [answers[3]]
+    assert get_answers_by_curie(aid, 'HGNC:3', qnode_id='n0') == []
+    assert get_answers_by_curie(aid, 'HGNC:9') == []
+
+
+def test_upgrade_answer_tables(database):
+    '''Databases created before answer scores and bindings are brought up to date.'''
+    from sqlalchemy import text
+    from manager.tables_accessors import add_answerset, get_top_answers, get_answers_by_curie, upgrade_answer_tables
+    qgraph_id = add_qgraph()
+    answers = [make_answer(i) for i in range(5)]
+    aid = add_answerset(answers, qgraph_id=qgraph_id)
+    with database.begin() as connection:
+        connection.execute(text('DROP TABLE public.answer_binding'))
+        connection.execute(text('ALTER TABLE public.answer DROP COLUMN score'))
+
+    upgrade_answer_tables()
+    upgrade_answer_tables()
+
+    assert get_top_answers(aid) == [answers[i] for i in (4, 2, 1)]
+    assert get_answers_by_curie(aid, 'HGNC:3') == [answers[3]]
+    assert [bindings for _, _, _, bindings in stored_answers(aid)] == [
+        [('n0', 'MONDO:1'), ('n1', f'HGNC:{i}'), ('n1', f'NCBIGene:{i}')] for i in range(5)]
+
+
+def test_question_with_answersets(database):
+    from manager.setup_db import session_scope
+    from manager.tables import Answerset
+    from manager.tables_accessors import add_question, add_answerset, get_qgraph_id_by_question_id, \
+        get_question_with_answersets
+    qgraph = {'nodes': [{'id': 'n0', 'curie': 'MONDO:1'}], 'edges': []}
+    qid = add_question({'natural_question': 'What?', 'question_graph': qgraph, 'color': 'blue'})
+    other = add_question({'natural_question': 'Who?', 'question_graph': qgraph})
+    qgraph_id = get_qgraph_id_by_question_id(qid)
+    older = add_answerset([make_answer(i) for i in range(3)], qgraph_id=qgraph_id)
+    newer = add_answerset([], qgraph_id=qgraph_id)
+    add_answerset([make_answer(0)], qgraph_id=get_qgraph_id_by_question_id(other))
+    with session_scope() as session:
+        session.query(Answerset).filter(Answerset.id == older)\
+            .update({Answerset.timestamp: datetime.datetime(2020, 1, 1)})
+
+    question = get_question_with_answersets(qid)
+    assert question['id'] == qid and question['natural_question'] == 'What?'
+    assert question['question_graph'] == qgraph and question['owner_email'] is None
+    assert [(a['id'], a['answer_count']) for a in question['answersets']] == [(newer, 0), (older, 3)]
+    assert question['answersets'][1]['timestamp'] == datetime.datetime(2020, 1, 1)
+
+    question = get_question_with_answersets(other)
+    assert [a['answer_count'] for a in question['answersets']] == [1]
+
+    qid = add_question({'natural_question': 'Why?', 'question_graph': qgraph})
+    assert get_question_with_answersets(qid)['answersets'] == []
+    with pytest.raises(KeyError):
+        get_question_with_answersets('none')
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+import io
+import os
+import gzip
+import json
+import shutil
+import sqlite3
+
+import pytest
+
+import manager.uploads
+from manager.uploads import save_message, message_info, message_path, open_index, view_storage_dir
+from manager.upload_index import is_current, index_path
+
+answerset_path = os.path.join(os.path.dirname(__file__), '..', '..', 'answerset.json')
+
+
+@pytest.fixture
+def message():
+    with open(answerset_path) as answerset_file:
+        return json.load(answerset_file)
+
+
+def check_index(index, message):
+    assert index.question_graph() == message['question_graph']
+    assert index.answer_count() == len(message['answers'])
+
+    answers, total = index.answers(sort='NONE')
+    assert answers == message['answers']
+    assert total == len(message['answers'])
+
+    answers, total = index.answers(offset=10, limit=3, max_results=12)
+    ranked = sorted(message['answers'], key=lambda a: a['score'], reverse=True)
+    assert answers == ranked[10:12]
+    assert total == 12
+
+    nodes = message['knowledge_graph']['nodes']
+    edges = message['knowledge_graph']['edges']
+    assert index.nodes([n['id'] for n in nodes]) == nodes
+    assert index.edges([e['id'] for e in edges[::-1]]) == edges
+    assert index.nodes([nodes[5]['id'], 'MISSING:1']) == [nodes[5]]
+
+
+def test_index_of_new_upload(monkeypatch, message):
+    monkeypatch.setattr(manager.uploads, 'index_block_size', 997)
+    # Distinct content, so this is not deduplicated against other uploads
+    message['description'] = 'small index blocks'
+    data = json.dumps(message, indent=2).encode()
+    uid = save_message(io.BytesIO(data))
+
+    # Restarting the deflate stream keeps it a single valid gzip member
+    info = message_info(uid)
+    with open(message_path(info, 'gzip'), 'rb') as gzip_file:
+        assert gzip.decompress(gzip_file.read()) == data
+
+    with open_index(uid) as index:
+        assert len(index._offsets) == len(data) // 997 + 1
+        check_index(index, message)
+
+
+def test_reindexing_keeps_checkpoints(monkeypatch, message):
+    monkeypatch.setattr(manager.uploads, 'index_block_size', 997)
+    message['description'] = 'index of an older layout'
+    data = json.dumps(message).encode()
+    uid = save_message(io.BytesIO(data))
+    path = index_path(message_info(uid)['path'])
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA user_version = 1')
+    connection.close()
+
+    with open_index(uid) as index:
+        assert len(index._offsets) == len(data) // 997 + 1
+        check_index(index, message)
+    assert is_current(path)
+
+
+@pytest.mark.parametrize('compressed', [False, True])
+def test_index_of_old_upload(message, compressed):
+    uid = '22222222-2222-2222-2222-22222222222' + str(int(compressed))
+    path = os.path.join(view_storage_dir, f'{uid}.json')
+    if compressed:
+        with open(answerset_path, 'rb') as answerset_file, gzip.open(f'{path}.gz', 'wb') as gzip_file:
+            shutil.copyfileobj(answerset_file, gzip_file)
+        with open(os.path.join(view_storage_dir, f'{uid}.meta'), 'w') as meta_file:
+            json.dump({'sha256': '0', 'size': 0, 'encodings': {'gzip': 0}, 'timestamp': '2019-01-01T00:00:00'}, meta_file)
+    else:
+        shutil.copy(answerset_path, path)
+
+    with open_index(uid) as index:
+        check_index(index, message)
+    assert os.path.exists(os.path.join(view_storage_dir, f'{uid}.index'))
+
+
+def test_max_connectivity():
+    # n0 is pinned by curie, so its hub A:1 never counts
+    message = {
+        'question_graph': {
+            'nodes': [{'id': 'n0', 'curie': 'A:1'}, {'id': 'n1'}],
+            'edges': [{'id': 'e0', 'source_id': 'n0', 'target_id': 'n1'}],
+        },
+        'knowledge_graph': {
+            'nodes': [{'id': f'A:{i}'} for i in range(1, 6)],
+            'edges': [
+                {'id': 'a', 'source_id': 'A:1', 'target_id': 'A:2'},
+                {'id': 'b', 'source_id': 'A:1', 'target_id': 'A:3'},
+                {'id': 'c', 'source_id': 'A:1', 'target_id': 'A:4'},
+                {'id': 'd', 'source_id': 'A:4', 'target_id': 'A:1'},
+                {'id': 'e', 'source_id': 'A:2', 'target_id': 'A:3'},
+                {'id': 'f', 'source_id': 'A:2', 'target_id': 'A:5'},
+            ],
+        },
+        'answers': [
+            {'node_bindings': {'n0': 'A:1', 'n1': 'A:2'}, 'edge_bindings': {'e0': 'a'}, 'score': 3},
+            {'node_bindings': {'n0': 'A:1', 'n1': ['A:3', 'A:4']}, 'edge_bindings': {'e0': ['b', 'c']}, 'score': 2},
+            {'node_bindings': {'n0': 'A:1', 'n1': 'A:4'}, 'edge_bindings': {'e0': 'c'}, 'score': 1},
+        ],
+    }
+    uid = save_message(io.BytesIO(json.dumps(message).encode()))
+    with open_index(uid) as index:
+        # Degrees: A:1 3, A:2 3, A:3 2, A:4 1
+        assert index.answers(max_connectivity=None) == (message['answers'], 3)
+        assert index.answers(max_connectivity=2) == (message['answers'][1:], 2)
+        assert index.answers(max_connectivity=1) == (message['answers'][2:], 1)
+        assert index.answers(max_connectivity=0) == ([], 0)
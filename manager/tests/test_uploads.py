@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+
+import io
+import csv
+import gzip
+import os
+import json
+
+import pytest
+
+from manager.uploads import MessageScanner, MessageError, UploadTooLarge, save_message, view_storage_dir, \
+    message_path, message_info, open_message, stored_encodings, delete_message, collect_garbage
+
+answerset_path = os.path.join(os.path.dirname(__file__), '..', '..', 'answerset.json')
+
+
+def scan(data, chunk_size):
+    scanner = MessageScanner()
+    for i in range(0, len(data), chunk_size):
+        scanner.feed(data[i:i + chunk_size])
+    scanner.close()
+    return scanner
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 4096])
+def test_scanner_accepts_answerset(chunk_size):
+    with open(answerset_path, 'rb') as answerset_file:
+        data = answerset_file.read()
+    scanner = scan(data, chunk_size)
+    assert scanner.keys == {'question_graph': '{', 'knowledge_graph': '{', 'answers': '['}
+
+
+def test_scanner_handles_escapes_and_nesting():
+    message = {
+        'question_graph': {'nodes': [{'id': 'n0', 'name': 'a "quoted" {name}\\'}], 'edges': []},
+        'knowledge_graph': {'nodes': [{'id': 'x]', 'deep': [[{'a': '}'}]]}], 'edges': []},
+        'answers': [{'score': 1.5e-3}],
+        'answers\u00e9': None,
+    }
+    scanner = scan(json.dumps(message, indent=1).encode(), 3)
+    assert scanner.keys['answers'] == '['
+    assert scanner.keys['answers\u00e9'] == 'scalar'
+
+
+@pytest.mark.parametrize('body', [
+    b'[]',
+    b'{"question_graph": {}, "knowledge_graph": {}}',
+    b'{"question_graph": {}, "knowledge_graph": {}, "answers": {}}',
+    b'{"question_graph": {}, "knowledge_graph": {"nodes": {}}, "answers": []}',
+    b'{"question_graph": {}, "knowledge_graph": {}, "answers": [1]}',
+    b'{"question_graph": {}, "knowledge_graph": {}, "answers": [',
+    b'{"question_graph": {}, "knowledge_graph": {}, "answers": []} {}',
+    b'{"question_graph": {}, "knowledge_graph": {}, "answers": ]}',
+    b'{"question_graph": {}, "knowledge_graph": {}, "answers": [{"a": tru}]}',
+])
+def test_scanner_rejects_bad_messages(body):
+    with pytest.raises(MessageError):
+        scan(body, 5)
+
+
+def test_scanner_reports_malformed_values_at_once():
+    scanner = MessageScanner()
+    with pytest.raises(MessageError, match='Invalid JSON at byte 21'):
+        scanner.feed(b'{"answers": [{"a": 1 x}, ' + b' ' * 1000)
+
+
+def test_save_message_streams_to_storage():
+    with open(answerset_path, 'rb') as answerset_file:
+        data = answerset_file.read()
+    uid = save_message(io.BytesIO(data))
+    with open_message(uid) as stored:
+        assert stored.read() == data
+    info = message_info(uid)
+    assert info['size'] == len(data)
+    assert set(info['encodings']) == set(stored_encodings())
+    assert info['encodings']['gzip'] < len(data) / 5
+    assert not os.path.exists(message_path(info))
+
+
+def test_save_message_leaves_nothing_behind_on_failure():
+    before = set(os.listdir(view_storage_dir)) | set(os.listdir(os.path.join(view_storage_dir, 'tmp')))
+    with pytest.raises(UploadTooLarge):
+        save_message(io.BytesIO(b'{"answers": [' + b' ' * 100 + b']}'), max_size=50)
+    with pytest.raises(MessageError):
+        save_message(io.BytesIO(b'{"answers": []}'))
+    after = set(os.listdir(view_storage_dir)) | set(os.listdir(os.path.join(view_storage_dir, 'tmp')))
+    assert before == after
+
+
+def test_view_post():
+    from manager.server import app
+    client = app.test_client()
+    with open(answerset_path, 'rb') as answerset_file:
+        response = client.post('/api/simple/view/', data=answerset_file, content_type='application/json')
+    assert response.status_code == 200
+    assert os.path.exists(message_path(message_info(response.get_json()), 'gzip'))
+
+    response = client.post('/api/simple/view/', data=b'{"answers": 3}', content_type='application/json')
+    assert response.status_code == 400
+
+
+def test_view_get():
+    from manager.server import app
+    client = app.test_client()
+    with open(answerset_path, 'rb') as answerset_file:
+        data = answerset_file.read()
+    uid = client.post('/api/simple/view/', data=data, content_type='application/json').get_json()
+
+    response = client.get(f'/api/simple/view/{uid}', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == data
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'Accept-Encoding' in response.headers['Vary']
+    etag = response.headers['ETag']
+    assert 'Last-Modified' in response.headers
+
+    response = client.get(f'/api/simple/view/{uid}', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert response.status_code == 304
+
+    response = client.get(f'/api/simple/view/{uid}', headers={'Accept-Encoding': 'gzip', 'Range': 'bytes=0-9'})
+    assert response.status_code == 206
+    assert len(response.data) == 10
+
+    response = client.get(f'/api/simple/view/{uid}')
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == data
+    assert response.headers['ETag'] != etag
+
+    if 'br' in stored_encodings():
+        response = client.get(f'/api/simple/view/{uid}', headers={'Accept-Encoding': 'gzip, deflate, br'})
+        assert response.headers['Content-Encoding'] == 'br'
+
+    assert client.get('/api/simple/view/not-an-upload').status_code == 404
+    assert client.get('/api/simple/view/00000000-0000-0000-0000-000000000000').status_code == 404
+
+    assert client.delete(f'/api/simple/view/{uid}').status_code == 204
+    assert client.get(f'/api/simple/view/{uid}').status_code == 404
+
+
+def test_duplicate_uploads_share_a_blob(monkeypatch):
+    import manager.uploads as uploads
+    copies = []
+    encode_copy = uploads._encode_copy
+
+    def counted_encode_copy(gzip_path, encoding):
+        copies.append(encoding)
+        return encode_copy(gzip_path, encoding)
+    monkeypatch.setattr(uploads, '_encode_copy', counted_encode_copy)
+
+    message = {'question_graph': {}, 'knowledge_graph': {'nodes': [], 'edges': []}, 'answers': [{'score': 1}]}
+    uid1 = save_message(io.BytesIO(json.dumps(message).encode()))
+    uid2 = save_message(io.BytesIO(json.dumps(message, indent=4).encode()))
+    # Only the first upload is compressed into the other encodings
+    assert sorted(copies) == sorted(set(stored_encodings()) - {'gzip'})
+    info1 = message_info(uid1)
+    info2 = message_info(uid2)
+    assert uid1 != uid2
+    assert info1['path'] == info2['path']
+
+    delete_message(uid1)
+    with pytest.raises(KeyError):
+        message_info(uid1)
+    assert os.path.exists(message_path(info2, 'gzip'))
+    delete_message(uid2)
+    assert not os.path.exists(message_path(info2, 'gzip'))
+    with pytest.raises(KeyError):
+        delete_message(uid2)
+
+
+def test_collect_garbage_removes_orphans():
+    orphan = os.path.join(view_storage_dir, 'blobs', '0' * 64 + '.json.gz')
+    with open(orphan, 'wb'):
+        pass
+    collect_garbage()
+    assert os.path.exists(orphan)
+    collect_garbage(min_age=-1)
+    assert not os.path.exists(orphan)
+
+
+def test_view_answers_page():
+    from manager.server import app
+    client = app.test_client()
+    with open(answerset_path, 'rb') as answerset_file:
+        data = answerset_file.read()
+    message = json.loads(data)
+    uid = client.post('/api/simple/view/', data=data, content_type='application/json').get_json()
+
+    response = client.get(f'/api/simple/view/{uid}/answers/?offset=2&limit=5&max_results=20')
+    assert response.status_code == 200
+    assert response.headers['X-Total-Count'] == '20'
+    page = response.get_json()
+    scores = sorted((a['score'] for a in message['answers']), reverse=True)
+    assert [a['score'] for a in page['answers']] == scores[2:7]
+    assert page['question_graph'] == message['question_graph']
+
+    node_ids = {n['id'] for n in page['knowledge_graph']['nodes']}
+    edge_ids = {e['id'] for e in page['knowledge_graph']['edges']}
+    for answer in page['answers']:
+        for value in answer['node_bindings'].values():
+            assert set(value if isinstance(value, list) else [value]) <= node_ids
+        for value in answer['edge_bindings'].values():
+            assert set(value if isinstance(value, list) else [value]) <= edge_ids
+    assert len(node_ids) < len(message['knowledge_graph']['nodes'])
+
+    response = client.get(f'/api/simple/view/{uid}/answers/?max_results=none&sort=none')
+    assert response.get_json()['answers'] == message['answers']
+    assert client.get(f'/api/simple/view/{uid}/answers/?limit=-1').status_code == 400
+
+
+def test_view_answers_output_formats():
+    from manager.server import app
+    client = app.test_client()
+    with open(answerset_path, 'rb') as answerset_file:
+        data = answerset_file.read()
+    message = json.loads(data)
+    uid = client.post('/api/simple/view/', data=data, content_type='application/json').get_json()
+    url = f'/api/simple/view/{uid}/answers/?max_results=none&sort=none&output_format='
+
+    full = client.get(url + 'message').get_json()
+    assert full['answers'] == message['answers']
+    assert full['knowledge_graph'] == message['knowledge_graph']
+    assert client.get(url + 'answers').get_json() == message['answers']
+
+    nodes = {n['id']: n for n in message['knowledge_graph']['nodes']}
+    dense = client.get(url + 'dense&limit=3').get_json()
+    assert len(dense) == 3
+    for answer, original in zip(dense, message['answers']):
+        for qid, value in original['node_bindings'].items():
+            ids = value if isinstance(value, list) else [value]
+            bound = answer['node_bindings'][qid]
+            assert [n['id'] for n in (bound if isinstance(bound, list) else [bound])] == ids
+
+    response = client.get(url + 'csv')
+    assert response.mimetype == 'text/csv'
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    qnode_ids = [n['id'] for n in message['question_graph']['nodes']]
+    assert rows[0] == ['score'] + [f'{q}{s}' for q in qnode_ids for s in ('', '_name')]
+    assert len(rows) == len(message['answers']) + 1
+    value = message['answers'][0]['node_bindings'][qnode_ids[0]]
+    ids = value if isinstance(value, list) else [value]
+    assert rows[1][1:3] == ['|'.join(ids), '|'.join(nodes[i].get('name') or '' for i in ids)]
+
+    assert client.get(url + 'xml').status_code == 400
+    assert client.get(url + 'answers&max_connectivity=many').status_code == 400
+    hubless = client.get(url + 'answers&max_connectivity=1')
+    assert len(hubless.get_json()) == int(hubless.headers['X-Total-Count']) < len(message['answers'])
+
+
+def test_view_answers_whole_message_is_sent_as_stored(monkeypatch):
+    from manager.server import app
+    import manager.api.simple_api as simple_api
+    client = app.test_client()
+    message = {
+        'question_graph': {'nodes': [{'id': 'n0'}], 'edges': []},
+        'knowledge_graph': {'nodes': [{'name': 'no id'}, {'id': 'a'}, {'id': 'a'}], 'edges': []},
+        'answers': [{'node_bindings': {'n0': 'a'}, 'edge_bindings': {}, 'score': 1}],
+        'extra': [1, 2],
+    }
+    data = json.dumps(message).encode()
+    uid = client.post('/api/simple/view/', data=data, content_type='application/json').get_json()
+    url = f'/api/simple/view/{uid}/answers/?max_results=none&sort=none'
+    assert client.get(url).data == data
+
+    closed = []
+    open_index = simple_api.open_index
+
+    def tracked_open_index(uid):
+        index = open_index(uid)
+        close = index.close
+        index.close = lambda: closed.append(True) or close()
+        return index
+    monkeypatch.setattr(simple_api, 'open_index', tracked_open_index)
+    # The server closes the body without reading it
+    response = client.head(url + '&limit=1')
+    assert response.status_code == 200
+    response.close()
+    assert closed
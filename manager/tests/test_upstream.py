@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+from manager.upstream import CircuitBreaker
+
+
+class Clock():
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_circuit_breaker():
+    clock = Clock()
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10, clock=clock)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.failure()
+    breaker.success()
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+    # One trial call after reset_timeout, failing opens the breaker again
+    clock.now = 10
+    assert breaker.state == 'half-open'
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.failure()
+    assert not breaker.allow()
+
+    clock.now = 20
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == 'closed'
+    assert breaker.allow() and breaker.allow()
+
+
+def test_search_returns_partial_results_at_the_deadline(monkeypatch):
+    import time
+    from manager.server import app
+    import manager.api.misc_api as misc_api
+
+    def lookup_bioname(term, bioname):
+        if bioname == 'slow':
+            time.sleep(2)
+        return 200, [{'id': 'MONDO:1', 'label': bioname}, {'id': bioname, 'label': term}]
+    monkeypatch.setattr(misc_api, 'lookup_bioname', lookup_bioname)
+    monkeypatch.setattr(misc_api, 'search_deadline', 0.5)
+    monkeypatch.setitem(misc_api.concept_map, 'disease', ['a', 'slow', 'b'])
+
+    start = time.perf_counter()
+    response = app.test_client().get('/api/search/ebola/disease/')
+    assert time.perf_counter() - start < 1.5
+    assert response.get_json() == [
+        {'id': 'MONDO:1', 'label': 'b'},
+        {'id': 'a', 'label': 'ebola'},
+        {'id': 'b', 'label': 'ebola'},
+    ]
+
+
+def test_omnicorp_batch(monkeypatch):
+    import requests
+    from manager.server import app
+    import manager.api.misc_api as misc_api
+
+    def fetch_omnicorp_publications(id1, id2=None):
+        if id2 == 'BAD:1':
+            raise requests.exceptions.HTTPError('500 Server Error')
+        return [f'PMID:{id1}{id2}']
+    monkeypatch.setattr(misc_api, 'fetch_omnicorp_publications', fetch_omnicorp_publications)
+    misc_api.omnicorp_cache.clear()
+    client = app.test_client()
+
+    response = client.post('/api/omnicorp/', json={'curies': ['A:1', 'B:1', 'A:1', 'C:1']})
+    assert response.get_json() == [
+        {'pair': ['A:1', 'B:1'], 'publications': ['PMID:A:1B:1']},
+        {'pair': ['A:1', 'C:1'], 'publications': ['PMID:A:1C:1']},
+        {'pair': ['B:1', 'C:1'], 'publications': ['PMID:B:1C:1']},
+    ]
+    response = client.post('/api/omnicorp/', json={'pairs': [['A:1', 'BAD:1'], ['A:1', 'B:1']]})
+    bad, good = response.get_json()
+    assert bad['publications'] is None and 'error' in bad
+    assert good['publications'] == ['PMID:A:1B:1']
+    assert client.post('/api/omnicorp/', json={'pairs': [['A:1']]}).status_code == 400
+
+
+def test_omnicorp_lookups_are_cached(monkeypatch):
+    from manager.server import app
+    from manager.cache import LRUCache, SQLiteCache, TieredCache
+    import manager.api.misc_api as misc_api
+    calls = []
+
+    def fetch_omnicorp_publications(id1, id2=None):
+        calls.append((id1, id2))
+        return ['PMID:1']
+    monkeypatch.setattr(misc_api, 'fetch_omnicorp_publications', fetch_omnicorp_publications)
+    misc_api.omnicorp_cache.clear()
+    client = app.test_client()
+
+    assert client.get('/api/omnicorp/A:1/B:1').get_json() == ['PMID:1']
+    assert client.get('/api/omnicorp/B:1/A:1').get_json() == ['PMID:1']
+    assert client.get('/api/omnicorp/A:1').get_json() == ['PMID:1']
+    response = client.post('/api/omnicorp/', json={'pairs': [['B:1', 'A:1'], ['A:1', 'C:1'], ['C:1', 'A:1']]})
+    assert [result['publications'] for result in response.get_json()] == [['PMID:1']] * 3
+    assert calls == [('A:1', 'B:1'), ('A:1', None), ('A:1', 'C:1')]
+    assert client.get('/api/omnicorp/cache/').get_json() == {
+        'memory_entries': 3, 'memory_hits': 2, 'disk_hits': 0, 'misses': 3}
+
+    # Another worker finds the lookups in the shared file
+    other = TieredCache(LRUCache(10), SQLiteCache(misc_api.omnicorp_cache.disk.path))
+    assert other.get_many(['A:1|B:1', 'A:1|C:1', 'B:1|C:1']) == {'A:1|B:1': ['PMID:1'], 'A:1|C:1': ['PMID:1']}
+    assert other.stats()['disk_hits'] == 2
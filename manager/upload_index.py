@@ -0,0 +1,361 @@
+'''
+Sidecar indexes for random access into stored messages
+'''
+
+import os
+import json
+import zlib
+import gzip
+import bisect
+import sqlite3
+import logging
+from array import array
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Stored gzip streams are restarted every index_block_size uncompressed
+# bytes, so reading any value means inflating at most a block or two
+index_block_size = int(os.environ.get('VIEW_INDEX_BLOCK_SIZE', 256 * 1024))
+
+# Number of inflated blocks each open index keeps around
+block_cache_size = 16
+
+# Rows buffered before they are written to the index
+insert_batch_size = 10000
+
+# SQLite limits the number of parameters of a statement
+_max_parameters = 500
+
+# Bumped when the layout of indexes changes; older indexes are rebuilt
+index_version = 2
+
+
+def index_path(path):
+    '''Path of the index of the message stored at path (ending in .json).'''
+    return f'{os.path.splitext(path)[0]}.index'
+
+
+def is_current(path):
+    '''Whether the index at path exists and has the current layout.'''
+    if not os.path.exists(path):
+        return False
+    connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        version, = connection.execute('PRAGMA user_version').fetchone()
+    finally:
+        connection.close()
+    return version >= index_version
+
+
+def read_checkpoints(path):
+    '''The gzip checkpoints recorded in the index at path, of any layout, or [] if there is none.'''
+    if not os.path.exists(path):
+        return []
+    connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        return connection.execute('SELECT offset, compressed_offset FROM checkpoint ORDER BY offset').fetchall()
+    except sqlite3.DatabaseError:
+        return []
+    finally:
+        connection.close()
+
+
+def _ids(values):
+    return values if isinstance(values, list) else [values]
+
+
+class IndexWriter():
+    '''
+    Build the index of a message while it is being scanned.
+
+    Pass on_value to MessageScanner. The index records the byte offsets of
+    the question graph, every answer (with its score) and every knowledge
+    graph node and edge (by id), plus the restart points of the gzip copy
+    of the message, in a SQLite database at path.
+
+    It also records the degree of each node (its number of distinct
+    neighbours in the knowledge graph) and the connectivity of each answer
+    (the largest degree of the nodes it binds, leaving out nodes bound to
+    question nodes with a curie, which every answer shares).
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.executescript('''
+            PRAGMA journal_mode=OFF;
+            PRAGMA synchronous=OFF;
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value);
+            CREATE TABLE checkpoint (offset INTEGER PRIMARY KEY, compressed_offset INTEGER NOT NULL);
+            CREATE TABLE answer (idx INTEGER PRIMARY KEY, start INTEGER NOT NULL, end INTEGER NOT NULL, score REAL,
+                                 connectivity INTEGER);
+            CREATE TABLE node (id TEXT PRIMARY KEY, start INTEGER NOT NULL, end INTEGER NOT NULL,
+                               degree INTEGER NOT NULL DEFAULT 0);
+            CREATE TABLE edge (id TEXT PRIMARY KEY, start INTEGER NOT NULL, end INTEGER NOT NULL);
+        ''')
+        self._rows = {
+            'answer': [],
+            'node': [],
+            'edge': [],
+        }
+        self._answers = 0
+        # Node ids are numbered as they are seen, so that edges and answer
+        # bindings can be kept as compact arrays until degrees are computed
+        self._node_codes = {}
+        self._sources = array('q')
+        self._targets = array('q')
+        self._question_node_codes = {}
+        self._pinned = set()
+        self._binding_answers = array('q')
+        self._binding_question_nodes = array('q')
+        self._binding_nodes = array('q')
+
+    def _code(self, node_id):
+        return self._node_codes.setdefault(str(node_id), len(self._node_codes))
+
+    def on_value(self, path, start, end, value):
+        '''MessageScanner callback.'''
+        if path == ('question_graph',):
+            self._connection.executemany(
+                'INSERT INTO meta (key, value) VALUES (?, ?)',
+                [('question_graph_start', start), ('question_graph_end', end)])
+            self._pinned = {str(qnode.get('id')) for qnode in value.get('nodes', []) if qnode.get('curie')}
+            return
+        if path[0] == 'answers':
+            score = value.get('score')
+            self._rows['answer'].append((self._answers, start, end, score if isinstance(score, (int, float)) else None))
+            for qid, node_ids in value.get('node_bindings', {}).items():
+                qcode = self._question_node_codes.setdefault(str(qid), len(self._question_node_codes))
+                for node_id in _ids(node_ids):
+                    self._binding_answers.append(self._answers)
+                    self._binding_question_nodes.append(qcode)
+                    self._binding_nodes.append(self._code(node_id))
+            self._answers += 1
+            table = 'answer'
+        else:
+            table = 'node' if path[1] == 'nodes' else 'edge'
+            if table == 'edge' and 'source_id' in value and 'target_id' in value:
+                self._sources.append(self._code(value['source_id']))
+                self._targets.append(self._code(value['target_id']))
+            if 'id' not in value:
+                return
+            self._rows[table].append((str(value['id']), start, end))
+        if len(self._rows[table]) >= insert_batch_size:
+            self._flush(table)
+
+    def add_checkpoints(self, checkpoints):
+        '''Record (offset, compressed_offset) pairs at which the gzip copy can be inflated from.'''
+        self._connection.executemany(
+            'INSERT OR REPLACE INTO checkpoint (offset, compressed_offset) VALUES (?, ?)', checkpoints)
+
+    def _flush(self, table):
+        rows = self._rows[table]
+        if table == 'answer':
+            self._connection.executemany('INSERT INTO answer (idx, start, end, score) VALUES (?, ?, ?, ?)', rows)
+        else:
+            # The first node or edge with a given id wins
+            self._connection.executemany(f'INSERT OR IGNORE INTO {table} (id, start, end) VALUES (?, ?, ?)', rows)
+        self._rows[table] = []
+
+    def _add_connectivity(self):
+        '''Compute node degrees and answer connectivity from the collected arrays.'''
+        count = len(self._node_codes)
+        sources = np.frombuffer(self._sources, dtype=np.int64)
+        targets = np.frombuffer(self._targets, dtype=np.int64)
+        # Parallel edges and both directions of an edge make one neighbour
+        pairs = np.unique(np.concatenate([sources * count + targets, targets * count + sources]))
+        degrees = np.bincount(pairs // count, minlength=count)
+        self._connection.executemany(
+            'UPDATE node SET degree = ? WHERE id = ?',
+            ((int(degrees[code]), node_id) for node_id, code in self._node_codes.items() if degrees[code]))
+
+        answers = np.frombuffer(self._binding_answers, dtype=np.int64)
+        question_nodes = np.frombuffer(self._binding_question_nodes, dtype=np.int64)
+        nodes = np.frombuffer(self._binding_nodes, dtype=np.int64)
+        pinned = [code for qid, code in self._question_node_codes.items() if qid in self._pinned]
+        free = ~np.isin(question_nodes, pinned)
+        connectivity = np.zeros(self._answers, dtype=np.int64)
+        np.maximum.at(connectivity, answers[free], degrees[nodes[free]])
+        self._connection.executemany(
+            'UPDATE answer SET connectivity = ? WHERE idx = ?',
+            ((int(value), idx) for idx, value in enumerate(connectivity)))
+
+    def close(self):
+        '''Write out buffered rows and finish the index.'''
+        for table in self._rows:
+            self._flush(table)
+        self._add_connectivity()
+        self._connection.execute('CREATE INDEX answer_score ON answer (score DESC, idx)')
+        self._connection.execute(f'PRAGMA user_version = {index_version}')
+        self._connection.commit()
+        self._connection.close()
+
+    def abort(self):
+        '''Discard the index.'''
+        self._connection.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class MessageIndex():
+    '''
+    Random access to a stored message through its index.
+
+    data_path is the stored message and encoding its Content-Encoding
+    (None or gzip). Gzip copies written with checkpoints are read block by
+    block; others fall back to seeking through the whole stream.
+    '''
+
+    def __init__(self, path, data_path, encoding=None):
+        self._connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+        self._encoding = encoding
+        self._data = open(data_path, 'rb')
+        self._gzip = None
+        self._offsets = []
+        self._compressed_offsets = []
+        if encoding == 'gzip':
+            for offset, compressed_offset in self._connection.execute(
+                    'SELECT offset, compressed_offset FROM checkpoint ORDER BY offset'):
+                self._offsets.append(offset)
+                self._compressed_offsets.append(compressed_offset)
+            if not self._offsets:
+                self._gzip = gzip.GzipFile(fileobj=self._data)
+        self._blocks = OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+        self._data.close()
+
+    def _block(self, number):
+        '''Inflate one block between two checkpoints.'''
+        if number in self._blocks:
+            self._blocks.move_to_end(number)
+            return self._blocks[number]
+        self._data.seek(self._compressed_offsets[number])
+        if number + 1 < len(self._compressed_offsets):
+            compressed = self._data.read(self._compressed_offsets[number + 1] - self._compressed_offsets[number])
+        else:
+            compressed = self._data.read()
+        block = zlib.decompressobj(-zlib.MAX_WBITS).decompress(compressed)
+        self._blocks[number] = block
+        if len(self._blocks) > block_cache_size:
+            self._blocks.popitem(last=False)
+        return block
+
+    def read(self, start, end):
+        '''Read bytes [start, end) of the uncompressed message.'''
+        if self._encoding != 'gzip':
+            self._data.seek(start)
+            return self._data.read(end - start)
+        if self._gzip is not None:
+            self._gzip.seek(start)
+            return self._gzip.read(end - start)
+        number = bisect.bisect_right(self._offsets, start) - 1
+        parts = []
+        position = start
+        while position < end:
+            block = self._block(number)
+            block_start = self._offsets[number]
+            parts.append(block[position - block_start:end - block_start])
+            position = block_start + len(block)
+            number += 1
+        return b''.join(parts)
+
+    def load(self, spans):
+        '''Yield the values stored at the given (start, end) byte spans.'''
+        for start, end in spans:
+            yield json.loads(self.read(start, end).decode('utf-8'))
+
+    def question_graph_span(self):
+        '''Byte span of the question graph.'''
+        meta = dict(self._connection.execute(
+            "SELECT key, value FROM meta WHERE key IN ('question_graph_start', 'question_graph_end')"))
+        return meta['question_graph_start'], meta['question_graph_end']
+
+    def question_graph(self):
+        '''The question graph of the message.'''
+        return next(self.load([self.question_graph_span()]))
+
+    def answer_count(self):
+        '''Number of answers in the message.'''
+        count, = self._connection.execute('SELECT COUNT(*) FROM answer').fetchone()
+        return count
+
+    def answer_total(self, max_results=None, max_connectivity=None):
+        '''Number of answers left after pruning to max_connectivity and cutting to max_results.'''
+        if max_connectivity is None:
+            total = self.answer_count()
+        else:
+            total, = self._connection.execute(
+                'SELECT COUNT(*) FROM answer WHERE connectivity <= ?', (max_connectivity,)).fetchone()
+        if max_results is not None:
+            total = min(total, max_results)
+        return total
+
+    def answer_spans(self, offset=0, limit=None, max_results=None, sort='SCORE', max_connectivity=None):
+        '''
+        Yield the byte spans of a page of answers.
+
+        Answers binding a node with more than max_connectivity neighbours
+        (other than nodes named in the question) are left out. The rest are
+        ordered by descending score (or kept in stored order for sort NONE)
+        and cut to max_results before the page [offset, offset+limit) is
+        taken. Rows are fetched as they are consumed, so whole answer sets
+        can be walked in constant memory. Reading is cheapest in stored
+        order, which for ranker output is also score order.
+        '''
+        count = max(self.answer_total(max_results, max_connectivity) - offset, 0)
+        if limit is not None:
+            count = min(count, limit)
+        order = 'score DESC, idx' if sort == 'SCORE' else 'idx'
+        where = '' if max_connectivity is None else 'WHERE connectivity <= :max_connectivity'
+        yield from self._connection.execute(
+            f'SELECT start, end FROM answer {where} ORDER BY {order} LIMIT :count OFFSET :offset',
+            {'count': count, 'offset': offset, 'max_connectivity': max_connectivity})
+
+    def answers(self, offset=0, limit=None, max_results=None, sort='SCORE', max_connectivity=None):
+        '''
+        Select a page of answers (see answer_spans).
+
+        Returns the page and the number of answers it was taken from.
+        '''
+        spans = self.answer_spans(offset, limit, max_results, sort, max_connectivity)
+        return list(self.load(spans)), self.answer_total(max_results, max_connectivity)
+
+    def _spans(self, table, ids=None):
+        if ids is None:
+            return self._connection.execute(f'SELECT start, end FROM {table} ORDER BY start')
+        ids = list(ids)
+        spans = []
+        for i in range(0, len(ids), _max_parameters):
+            batch = ids[i:i + _max_parameters]
+            spans.extend(self._connection.execute(
+                f'SELECT start, end FROM {table} WHERE id IN ({",".join("?" * len(batch))})', batch))
+        # Read in stored order
+        spans.sort()
+        return spans
+
+    def node_spans(self, ids=None):
+        '''Byte spans of the knowledge graph nodes with the given ids (or all), in stored order.'''
+        return self._spans('node', ids)
+
+    def edge_spans(self, ids=None):
+        '''Byte spans of the knowledge graph edges with the given ids (or all), in stored order.'''
+        return self._spans('edge', ids)
+
+    def nodes(self, ids):
+        '''Knowledge graph nodes with the given ids, in stored order.'''
+        return list(self.load(self.node_spans(ids)))
+
+    def edges(self, ids):
+        '''Knowledge graph edges with the given ids, in stored order.'''
+        return list(self.load(self.edge_spans(ids)))
@@ -0,0 +1,886 @@
+'''
+Storage of uploaded messages for the simple viewer
+'''
+
+import os
+import re
+import json
+import gzip
+import zlib
+import time
+import sqlite3
+import hashlib
+import logging
+import tempfile
+from contextlib import contextmanager
+from uuid import uuid4, UUID
+from datetime import datetime
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from manager.upload_index import IndexWriter, MessageIndex, index_path, index_block_size, is_current, \
+    read_checkpoints
+
+logger = logging.getLogger(__name__)
+
+view_storage_dir = f"{os.environ['ROBOKOP_HOME']}/uploads/"
+if not os.path.exists(view_storage_dir):
+    os.mkdir(view_storage_dir)
+
+# Partially written uploads live next to the finished ones so that
+# publishing them is a rename within one filesystem
+upload_tmp_dir = os.path.join(view_storage_dir, 'tmp')
+if not os.path.exists(upload_tmp_dir):
+    os.mkdir(upload_tmp_dir)
+
+# Uploads are stored once per distinct content in blob_dir, named by
+# content hash. The catalog maps upload ids to blobs and counts the
+# references to each blob.
+blob_dir = os.path.join(view_storage_dir, 'blobs')
+if not os.path.exists(blob_dir):
+    os.mkdir(blob_dir)
+catalog_path = os.path.join(view_storage_dir, 'catalog.sqlite')
+
+max_upload_size = int(os.environ.get('VIEW_MAX_UPLOAD_SIZE', 2 * 1024 ** 3))
+upload_chunk_size = int(os.environ.get('VIEW_UPLOAD_CHUNK_SIZE', 1024 ** 2))
+
+# Content-Encodings uploads are stored in, in order of preference when a
+# client accepts several. gzip is always written and is what the server
+# itself reads; the others are written when their module is installed.
+encoding_suffixes = {
+    'br': '.br',
+    'zstd': '.zst',
+    'gzip': '.gz',
+}
+compression_levels = {
+    'br': int(os.environ.get('VIEW_BROTLI_QUALITY', 6)),
+    'zstd': int(os.environ.get('VIEW_ZSTD_LEVEL', 10)),
+    'gzip': int(os.environ.get('VIEW_GZIP_LEVEL', 6)),
+}
+
+
+class MessageError(ValueError):
+    '''An uploaded message is not a well formed Message.'''
+    pass
+
+
+class UploadTooLarge(MessageError):
+    '''An uploaded message exceeds max_upload_size.'''
+    pass
+
+
+# Top-level keys every message must carry, with the JSON type of their value
+required_keys = {
+    'question_graph': '{',
+    'knowledge_graph': '{',
+    'answers': '[',
+}
+
+# Containers whose keys and elements are followed by the scanner.
+# Everything else is skipped over by bracket counting.
+tracked_paths = {
+    (),
+    ('knowledge_graph',),
+    ('knowledge_graph', 'nodes'),
+    ('knowledge_graph', 'edges'),
+    ('answers',),
+}
+
+# Expected JSON types of values at tracked paths, if they are present
+expected_types = {
+    ('question_graph',): '{',
+    ('knowledge_graph',): '{',
+    ('knowledge_graph', 'nodes'): '[',
+    ('knowledge_graph', 'edges'): '[',
+    ('answers',): '[',
+    ('knowledge_graph', 'nodes', None): '{',
+    ('knowledge_graph', 'edges', None): '{',
+    ('answers', None): '{',
+}
+
+# Values decoded as a whole and handed to the on_value callback of
+# MessageScanner. These make up the bulk of a message.
+decoded_paths = {
+    ('question_graph',),
+    ('knowledge_graph', 'nodes', None),
+    ('knowledge_graph', 'edges', None),
+    ('answers', None),
+}
+
+# Largest single decoded value (an answer, a node, ...) accepted, in bytes
+max_value_size = int(os.environ.get('VIEW_MAX_VALUE_SIZE', 64 * 1024 ** 2))
+
+json_types = {
+    '{': 'an object',
+    '[': 'an array',
+    '"': 'a string',
+}
+
+_non_space = re.compile(rb'[^ \t\r\n]')
+_string_special = re.compile(rb'["\\]')
+_deep_special = re.compile(rb'["{}\[\]]')
+_delimiter = re.compile(rb'[,}\]"{\[]')
+_non_ascii = re.compile(rb'[\x80-\xff]')
+_decoder = json.JSONDecoder()
+
+# Tails of a chunk cut in the middle of a number or a literal
+_partial_number = re.compile(r'[-+.eE0-9]*')
+_literals = ('true', 'false', 'null', 'NaN', 'Infinity', '-Infinity')
+
+
+def _incomplete(text, err):
+    '''Whether decoding text failed with err only because text ends too early.'''
+    if err.msg.startswith('Unterminated string'):
+        return True
+    tail = text[err.pos:].rstrip()
+    if not tail or _partial_number.fullmatch(tail):
+        return True
+    if any(literal.startswith(tail) for literal in _literals):
+        return True
+    # A \uXXXX escape cut short
+    return err.msg.startswith('Invalid \\uXXXX') and len(text) - err.pos <= 6
+
+
+class MessageScanner():
+    '''
+    Incremental checker for the top-level structure of a Message.
+
+    Bytes are fed in arbitrarily sized chunks. The containers in
+    tracked_paths are parsed key by key. Values in decoded_paths are
+    decoded whole by the json module once all of their bytes have arrived,
+    and the contents of all other values are skipped by counting brackets
+    outside of strings. Memory use is bounded by max_value_size and
+    independent of the size of the message.
+
+    If digest is given (a hashlib object) it is updated with a canonical
+    form of the message: whitespace outside of strings is dropped and
+    decoded values are re-encoded with sorted keys, so that uploads
+    differing only in formatting hash alike.
+
+    If on_value is given it is called as on_value(path, start, end, value)
+    for every value in decoded_paths, with the byte offsets of the value in
+    the message and the decoded value. Array elements have None as the
+    last item of path.
+    '''
+
+    def __init__(self, digest=None, on_value=None):
+        self.digest = digest
+        self.on_value = on_value
+        self.offset = 0  # offset of the current chunk in the message
+        self.keys = {}  # top-level key -> JSON type of its value
+        self._stack = []  # open tracked containers: [bracket, path]
+        self._expect = 'value'
+        self._deep = 0  # depth of open untracked containers
+        self._in_string = False
+        self._escape = False
+        self._key_parts = None  # bytes of the object key being read
+        self._key = None  # last object key read at the current level
+        self._chunk = b''
+        self._text = None  # the current chunk decoded as latin-1
+        self._pending = b''  # start of a decoded value waiting for more bytes
+        self._mark = 0  # end of the part of the current chunk already digested
+
+    def feed(self, chunk):
+        '''Consume the next chunk of the message.'''
+        if self._pending:
+            self.offset -= len(self._pending)
+            chunk = self._pending + chunk
+            self._pending = b''
+        self._chunk = chunk
+        self._text = None
+        self._mark = 0
+        pos = 0
+        end = len(chunk)
+        while pos < end:
+            in_string = self._in_string
+            if in_string:
+                pos = self._scan_string(chunk, pos)
+            elif self._deep:
+                pos = self._scan_deep(chunk, pos)
+            else:
+                pos = self._scan_tracked(chunk, pos)
+            if self._in_string != in_string:
+                self._digest_to(pos, in_string)
+        self._digest_to(end, self._in_string)
+        self.offset += end
+
+    def _digest_to(self, pos, in_string):
+        if self.digest is not None and pos > self._mark:
+            data = self._chunk[self._mark:pos]
+            self.digest.update(data if in_string else data.translate(None, b' \t\r\n'))
+        self._mark = pos
+
+    def close(self):
+        '''Check that the message is complete.'''
+        if self._pending:
+            try:
+                _decoder.raw_decode(self._pending.decode('latin-1'))
+            except ValueError as err:
+                raise MessageError(f'Invalid JSON at byte {self.offset - len(self._pending) + err.pos}: {err.msg}')
+        if self._expect != 'done':
+            raise MessageError('Message is truncated')
+        missing = [key for key in required_keys if key not in self.keys]
+        if missing:
+            raise MessageError(f'Message is missing {", ".join(missing)}')
+
+    def _scan_string(self, chunk, pos):
+        if self._escape:
+            self._escape = False
+            if self._key_parts is not None:
+                self._key_parts.append(chunk[pos:pos + 1])
+            return pos + 1
+        match = _string_special.search(chunk, pos)
+        if match is None:
+            if self._key_parts is not None:
+                self._key_parts.append(chunk[pos:])
+            return len(chunk)
+        idx = match.start()
+        if chunk[idx] == 0x5C:  # backslash, skip the escaped byte
+            if self._key_parts is not None:
+                self._key_parts.append(chunk[pos:idx + 1])
+            if idx + 1 < len(chunk):
+                if self._key_parts is not None:
+                    self._key_parts.append(chunk[idx + 1:idx + 2])
+                return idx + 2
+            self._escape = True
+            return idx + 1
+        self._in_string = False
+        if self._key_parts is not None:
+            self._key_parts.append(chunk[pos:idx])
+            raw = b'"' + b''.join(self._key_parts) + b'"'
+            self._key_parts = None
+            try:
+                self._key = json.loads(raw.decode('utf-8'))
+            except ValueError:
+                raise MessageError(f'Invalid object key at byte {self.offset + idx}')
+            self._expect = 'colon'
+        elif not self._deep:
+            self._value_end()
+        return idx + 1
+
+    def _scan_deep(self, chunk, pos):
+        match = _deep_special.search(chunk, pos)
+        if match is None:
+            return len(chunk)
+        idx = match.start()
+        char = chunk[idx:idx + 1]
+        if char == b'"':
+            self._in_string = True
+        elif char in b'{[':
+            self._deep += 1
+        else:
+            self._deep -= 1
+            if not self._deep:
+                self._value_end()
+        return idx + 1
+
+    def _scan_tracked(self, chunk, pos):
+        if self._expect == 'comma_or_end':
+            match = _delimiter.search(chunk, pos)
+        else:
+            match = _non_space.search(chunk, pos)
+        if match is None:
+            return len(chunk)
+        idx = match.start()
+        char = chunk[idx:idx + 1].decode('latin-1')
+        where = f'at byte {self.offset + idx}'
+        expect = self._expect
+
+        if expect == 'done':
+            raise MessageError(f'Unexpected data after the message {where}')
+        if expect == 'colon':
+            if char != ':':
+                raise MessageError(f'Expected ":" {where}')
+            self._expect = 'value'
+            return idx + 1
+        if expect in ('key', 'key_or_end'):
+            if char == '}' and expect == 'key_or_end':
+                self._close_container(char, idx)
+            elif char == '"':
+                self._in_string = True
+                self._key_parts = []
+            else:
+                raise MessageError(f'Expected an object key {where}')
+            return idx + 1
+        if expect == 'comma_or_end':
+            if char == ',':
+                self._expect = 'key' if self._stack[-1][0] == '{' else 'value'
+            elif char in '}]':
+                self._close_container(char, idx)
+            else:
+                raise MessageError(f'Expected "," {where}')
+            return idx + 1
+        if expect == 'value_or_end' and char == ']':
+            self._close_container(char, idx)
+            return idx + 1
+        return self._value_start(char, idx)
+
+    def _value_path(self):
+        if not self._stack:
+            return None
+        bracket, path = self._stack[-1]
+        if bracket == '{':
+            return path + (self._key,)
+        return path + (None,)
+
+    def _value_start(self, char, idx):
+        '''Handle the first byte of a value at idx in the current chunk and return where to continue.'''
+        if char in ',:]}':
+            raise MessageError(f'Expected a value at byte {self.offset + idx}')
+        path = self._value_path()
+        if path is None:
+            if char != '{':
+                raise MessageError('Message must be a JSON object')
+            path = ()
+        else:
+            value_type = char if char in json_types else 'scalar'
+            expected = expected_types.get(path)
+            if expected is not None and expected != value_type:
+                name = '.'.join(key or '[]' for key in path)
+                raise MessageError(f'{name} must be {json_types[expected]}')
+            if len(path) == 1:
+                self.keys[path[0]] = value_type
+        if path in decoded_paths:
+            return self._decode_value(path, idx)
+        if char == '"':
+            self._in_string = True
+        elif char in '{[':
+            if path in tracked_paths:
+                self._stack.append([char, path])
+                self._expect = 'key_or_end' if char == '{' else 'value_or_end'
+            else:
+                self._deep = 1
+        else:
+            # Scalars run until the next delimiter
+            self._expect = 'comma_or_end'
+        return idx + 1
+
+    def _decode_value(self, path, idx):
+        '''
+        Decode the value starting at idx in the current chunk in one go.
+
+        Decoding a latin-1 view of the bytes keeps string indexes equal to
+        byte offsets; values with non-ASCII bytes are decoded again as
+        UTF-8. If the value is not complete yet its bytes are kept and
+        decoding is retried once the next chunk arrives; other errors are
+        reported right away.
+        '''
+        chunk = self._chunk
+        if self._text is None:
+            self._text = chunk.decode('latin-1')
+        try:
+            value, end = _decoder.raw_decode(self._text, idx)
+        except json.JSONDecodeError as err:
+            if not _incomplete(self._text, err):
+                raise MessageError(f'Invalid JSON at byte {self.offset + err.pos}: {err.msg}')
+            if len(chunk) - idx > max_value_size:
+                raise MessageError(f'Value at byte {self.offset + idx} is larger than {max_value_size} bytes')
+            self._digest_to(idx, False)
+            self._pending = chunk[idx:]
+            self._mark = len(chunk)
+            return len(chunk)
+        data = chunk[idx:end]
+        if _non_ascii.search(data):
+            try:
+                value = json.loads(data.decode('utf-8'))
+            except ValueError:
+                raise MessageError(f'Invalid UTF-8 at byte {self.offset + idx}')
+        if self.digest is not None:
+            self._digest_to(idx, False)
+            self.digest.update(json.dumps(
+                value, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+            self._mark = end
+        if self.on_value is not None:
+            self.on_value(path, self.offset + idx, self.offset + end, value)
+        self._value_end()
+        return end
+
+    def _value_end(self):
+        self._expect = 'comma_or_end' if self._stack else 'done'
+
+    def _close_container(self, char, idx):
+        bracket, _ = self._stack.pop()
+        if (bracket == '{') != (char == '}'):
+            raise MessageError(f'Mismatched "{char}" at byte {self.offset + idx}')
+        self._value_end()
+
+
+class _BrotliCompressor():
+    '''brotli.Compressor with the zlib compressobj interface.'''
+
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+class _GzipCompressor():
+    '''
+    zlib gzip compressor that restarts the deflate stream every index_block_size bytes.
+
+    After each full flush the stream can be inflated without what came
+    before; checkpoints lists the (offset, compressed_offset) pairs where
+    this is possible.
+    '''
+
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self._pending = self._compressor.flush(zlib.Z_FULL_FLUSH)  # gzip header
+        self._size = 0
+        self._compressed_size = len(self._pending)
+        self._block_left = index_block_size
+        self.checkpoints = [(0, self._compressed_size)]
+
+    def compress(self, data):
+        parts = [self._pending]
+        self._pending = b''
+        data = memoryview(data)
+        while data:
+            piece = data[:self._block_left]
+            data = data[len(piece):]
+            self._emit(parts, self._compressor.compress(piece))
+            self._size += len(piece)
+            self._block_left -= len(piece)
+            if not self._block_left:
+                self._emit(parts, self._compressor.flush(zlib.Z_FULL_FLUSH))
+                self.checkpoints.append((self._size, self._compressed_size))
+                self._block_left = index_block_size
+        return b''.join(parts)
+
+    def _emit(self, parts, output):
+        parts.append(output)
+        self._compressed_size += len(output)
+
+    def flush(self):
+        return self._pending + self._compressor.flush()
+
+
+def _compressor(encoding):
+    level = compression_levels[encoding]
+    if encoding == 'gzip':
+        return _GzipCompressor(level)
+    if encoding == 'br':
+        return _BrotliCompressor(level)
+    return zstandard.ZstdCompressor(level=level).compressobj()
+
+
+def stored_encodings():
+    '''Content-Encodings new uploads are written in.'''
+    available = {
+        'br': brotli is not None,
+        'zstd': zstandard is not None,
+        'gzip': True,
+    }
+    return [encoding for encoding in encoding_suffixes if available[encoding]]
+
+
+@contextmanager
+def _catalog():
+    '''Open a transaction on the upload catalog.'''
+    connection = sqlite3.connect(catalog_path, timeout=60, isolation_level=None)
+    try:
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+    finally:
+        connection.close()
+
+
+def _init_catalog():
+    connection = sqlite3.connect(catalog_path, timeout=60)
+    with connection:
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('''CREATE TABLE IF NOT EXISTS blob (
+            hash TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            encodings TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            refcount INTEGER NOT NULL)''')
+        connection.execute('''CREATE TABLE IF NOT EXISTS upload (
+            id TEXT PRIMARY KEY,
+            blob TEXT NOT NULL REFERENCES blob(hash),
+            timestamp TEXT NOT NULL)''')
+    connection.close()
+
+_init_catalog()
+
+
+def _encoded_path(path, encoding):
+    suffix = encoding_suffixes[encoding] if encoding else ''
+    return f'{path}{suffix}'
+
+
+def message_path(info, encoding=None):
+    '''Path of a stored message, as described by message_info, in the given Content-Encoding.'''
+    return _encoded_path(info['path'], encoding)
+
+
+def _legacy_path(uid):
+    return os.path.join(view_storage_dir, f'{uid}.json')
+
+
+def _blob_path(content_hash):
+    return os.path.join(blob_dir, f'{content_hash}.json')
+
+
+def valid_upload_id(uid):
+    '''Check that uid has the form of an id handed out by save_message.'''
+    try:
+        return str(UUID(uid)) == uid
+    except ValueError:
+        return False
+
+
+def _legacy_info(uid):
+    '''Metadata of an upload stored under its own id, before uploads were deduplicated.'''
+    path = _legacy_path(uid)
+    meta_path = os.path.join(view_storage_dir, f'{uid}.meta')
+    try:
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+        meta.setdefault('encodings', {})
+        meta['path'] = path
+        return meta
+    except FileNotFoundError:
+        pass
+
+    if not os.path.exists(path):
+        raise KeyError('No such upload.')
+    content_hash = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as message_file:
+        for chunk in iter(lambda: message_file.read(upload_chunk_size), b''):
+            content_hash.update(chunk)
+            size += len(chunk)
+    meta = {
+        'sha256': content_hash.hexdigest(),
+        'size': size,
+        'encodings': {},
+        'timestamp': datetime.utcfromtimestamp(os.path.getmtime(path)).isoformat(),
+    }
+    fd, tmp_path = tempfile.mkstemp(suffix='.part', dir=upload_tmp_dir)
+    with os.fdopen(fd, 'w') as tmp_file:
+        json.dump(meta, tmp_file)
+    os.replace(tmp_path, meta_path)
+    meta['path'] = path
+    return meta
+
+
+def message_info(uid):
+    '''
+    Get the metadata of a stored message.
+
+    sha256 is the content hash of the message and size its uncompressed
+    length; encodings maps each stored Content-Encoding to its size and path
+    is where it is stored (see message_path). Raises KeyError for unknown
+    uploads.
+    '''
+    if not valid_upload_id(uid):
+        raise KeyError('No such upload.')
+    connection = sqlite3.connect(catalog_path, timeout=60)
+    try:
+        row = connection.execute(
+            '''SELECT blob.hash, blob.size, blob.encodings, upload.timestamp
+            FROM upload JOIN blob ON upload.blob = blob.hash
+            WHERE upload.id = ?''', (uid,)).fetchone()
+    finally:
+        connection.close()
+    if row is None:
+        return _legacy_info(uid)
+    content_hash, size, encodings, timestamp = row
+    return {
+        'sha256': content_hash,
+        'size': size,
+        'encodings': json.loads(encodings),
+        'timestamp': timestamp,
+        'path': _blob_path(content_hash),
+    }
+
+
+def open_message(uid):
+    '''Open a stored message for reading as uncompressed bytes.'''
+    info = message_info(uid)
+    if 'gzip' in info['encodings']:
+        return gzip.open(message_path(info, 'gzip'), 'rb')
+    return open(message_path(info), 'rb')
+
+
+def iter_message(uid):
+    '''Yield a stored message as uncompressed chunks.'''
+    with open_message(uid) as message_file:
+        for chunk in iter(lambda: message_file.read(upload_chunk_size), b''):
+            yield chunk
+
+
+def open_index(uid):
+    '''
+    Open the index of a stored message (see MessageIndex).
+
+    Indexes are written at upload time. Uploads stored without one, or
+    with one of an older layout, are indexed on first access.
+    '''
+    info = message_info(uid)
+    path = index_path(info['path'])
+    if not is_current(path):
+        logger.info(f'Indexing message {uid}')
+        fd, tmp_path = tempfile.mkstemp(suffix='.part', dir=upload_tmp_dir)
+        os.close(fd)
+        writer = IndexWriter(tmp_path)
+        try:
+            scanner = MessageScanner(on_value=writer.on_value)
+            for chunk in iter_message(uid):
+                scanner.feed(chunk)
+            scanner.close()
+            # The gzip copy is unchanged, so are the points it can be inflated from
+            writer.add_checkpoints(read_checkpoints(path))
+            writer.close()
+        except BaseException:
+            writer.abort()
+            raise
+        os.replace(tmp_path, path)
+    encoding = 'gzip' if 'gzip' in info['encodings'] else None
+    return MessageIndex(path, message_path(info, encoding), encoding)
+
+
+def _blob_files(content_hash):
+    path = _blob_path(content_hash)
+    return [_encoded_path(path, encoding) for encoding in encoding_suffixes] + [index_path(path)]
+
+
+def _remove_blob_files(content_hash):
+    for path in _blob_files(content_hash):
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def _publish(tmp_paths, tmp_index, meta):
+    '''
+    Record a finished upload under a new id and return it.
+
+    If a blob with the same content hash is already stored the upload only
+    adds a reference to it and the temporary files are dropped. Otherwise
+    they are renamed into blob_dir.
+    '''
+    content_hash = meta['sha256']
+    with _catalog() as catalog:
+        for _ in range(25):
+            uid = str(uuid4())
+            taken = catalog.execute('SELECT 1 FROM upload WHERE id = ?', (uid,)).fetchone()
+            if not taken and not os.path.exists(_legacy_path(uid)):
+                break
+        else:
+            raise RuntimeError('Could not find an unused upload id')
+
+        stored = catalog.execute(
+            'UPDATE blob SET refcount = refcount + 1 WHERE hash = ?', (content_hash,)).rowcount
+        if not stored:
+            for encoding, tmp_path in tmp_paths.items():
+                os.rename(tmp_path, _encoded_path(_blob_path(content_hash), encoding))
+            os.rename(tmp_index, index_path(_blob_path(content_hash)))
+            catalog.execute(
+                'INSERT INTO blob (hash, size, encodings, timestamp, refcount) VALUES (?, ?, ?, ?, 1)',
+                (content_hash, meta['size'], json.dumps(meta['encodings']), meta['timestamp']))
+        catalog.execute(
+            'INSERT INTO upload (id, blob, timestamp) VALUES (?, ?, ?)',
+            (uid, content_hash, meta['timestamp']))
+
+    if stored:
+        logger.info(f'Message {uid} is a duplicate of blob {content_hash}')
+        for tmp_path in list(tmp_paths.values()) + [tmp_index]:
+            os.unlink(tmp_path)
+    return uid
+
+
+def _blob_stored(content_hash):
+    connection = sqlite3.connect(catalog_path, timeout=60)
+    try:
+        return connection.execute('SELECT 1 FROM blob WHERE hash = ?', (content_hash,)).fetchone() is not None
+    finally:
+        connection.close()
+
+
+def _encode_copy(gzip_path, encoding):
+    '''Write a temporary copy of the gzipped file at gzip_path in another encoding, and return its path.'''
+    fd, path = tempfile.mkstemp(suffix='.part', dir=upload_tmp_dir)
+    try:
+        compressor = _compressor(encoding)
+        with os.fdopen(fd, 'wb') as tmp_file, gzip.open(gzip_path, 'rb') as source:
+            while True:
+                chunk = source.read(upload_chunk_size)
+                if not chunk:
+                    break
+                tmp_file.write(compressor.compress(chunk))
+            tmp_file.write(compressor.flush())
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+
+def save_message(stream, content_length=None, max_size=None):
+    '''
+    Stream a message into view_storage_dir and return its upload id.
+
+    The body is read in upload_chunk_size pieces while its structure is
+    checked and its content hash computed, and gzipped into a temporary
+    file. Its index (see IndexWriter) is built on the way. Copies in the
+    other stored encodings are only compressed from the gzipped file once
+    the content hash is known not to be stored yet, so a duplicate upload
+    costs one gzip pass and its index, which are then dropped. At the end
+    the upload is published (see _publish), so neither a partial nor an
+    invalid upload is ever visible and memory use is constant.
+    '''
+    if max_size is None:
+        max_size = max_upload_size
+    if content_length is not None and content_length > max_size:
+        raise UploadTooLarge(f'Message is larger than {max_size} bytes')
+
+    content_hash = hashlib.sha256()
+    size = 0
+    tmp_paths = {}
+    tmp_file = None
+    fd, tmp_index = tempfile.mkstemp(suffix='.part', dir=upload_tmp_dir)
+    os.close(fd)
+    writer = IndexWriter(tmp_index)
+    scanner = MessageScanner(digest=content_hash, on_value=writer.on_value)
+    try:
+        fd, tmp_paths['gzip'] = tempfile.mkstemp(suffix='.part', dir=upload_tmp_dir)
+        tmp_file = os.fdopen(fd, 'wb')
+        compressor = _compressor('gzip')
+        while True:
+            chunk = stream.read(upload_chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_size:
+                raise UploadTooLarge(f'Message is larger than {max_size} bytes')
+            scanner.feed(chunk)
+            tmp_file.write(compressor.compress(chunk))
+        scanner.close()
+        writer.add_checkpoints(compressor.checkpoints)
+        writer.close()
+        tmp_file.write(compressor.flush())
+        tmp_file.flush()
+        os.fsync(tmp_file.fileno())
+        tmp_file.close()
+
+        digest = content_hash.hexdigest()
+        if not _blob_stored(digest):
+            for encoding in stored_encodings():
+                if encoding != 'gzip':
+                    tmp_paths[encoding] = _encode_copy(tmp_paths['gzip'], encoding)
+        meta = {
+            'sha256': digest,
+            'size': size,
+            'encodings': {
+                encoding: os.path.getsize(tmp_paths[encoding])
+                for encoding in encoding_suffixes if encoding in tmp_paths
+            },
+            'timestamp': datetime.utcnow().isoformat(),
+        }
+        uid = _publish(tmp_paths, tmp_index, meta)
+    except BaseException:
+        if tmp_file is not None:
+            tmp_file.close()
+        writer.abort()
+        for tmp_path in tmp_paths.values():
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        raise
+
+    logger.info(f'Saved message {uid} ({size} bytes, {meta["encodings"]["gzip"]} gzipped)')
+    return uid
+
+
+def delete_message(uid):
+    '''
+    Remove an upload.
+
+    The blob it refers to is deleted together with its last reference.
+    Raises KeyError for unknown uploads.
+    '''
+    if not valid_upload_id(uid):
+        raise KeyError('No such upload.')
+    with _catalog() as catalog:
+        row = catalog.execute('SELECT blob FROM upload WHERE id = ?', (uid,)).fetchone()
+        if row is not None:
+            content_hash, = row
+            catalog.execute('DELETE FROM upload WHERE id = ?', (uid,))
+            catalog.execute('UPDATE blob SET refcount = refcount - 1 WHERE hash = ?', (content_hash,))
+            deleted = catalog.execute(
+                'DELETE FROM blob WHERE hash = ? AND refcount <= 0', (content_hash,)).rowcount
+            if deleted:
+                _remove_blob_files(content_hash)
+            return
+
+    # Uploads stored under their own id
+    removed = False
+    path = _legacy_path(uid)
+    for path in [path, os.path.join(view_storage_dir, f'{uid}.meta'), index_path(path)] + \
+            [_encoded_path(path, encoding) for encoding in encoding_suffixes]:
+        if os.path.exists(path):
+            os.unlink(path)
+            removed = True
+    if not removed:
+        raise KeyError('No such upload.')
+
+
+def collect_garbage(min_age=3600):
+    '''
+    Delete stored data no upload refers to any more.
+
+    This removes blobs whose reference count dropped to zero, files in
+    blob_dir without a catalog entry and temporary files left behind by
+    interrupted uploads. Files younger than min_age seconds are kept, as
+    they may belong to an upload in progress. Returns the number of files
+    removed.
+    '''
+    cutoff = time.time() - min_age
+    removed = 0
+    with _catalog() as catalog:
+        orphans = [content_hash for content_hash, in catalog.execute(
+            'SELECT hash FROM blob WHERE refcount <= 0')]
+        catalog.execute('DELETE FROM blob WHERE refcount <= 0')
+        for content_hash in orphans:
+            _remove_blob_files(content_hash)
+        removed += len(orphans)
+
+        known = {content_hash for content_hash, in catalog.execute('SELECT hash FROM blob')}
+        for name in os.listdir(blob_dir):
+            path = os.path.join(blob_dir, name)
+            if name.split('.')[0] not in known and os.path.getmtime(path) < cutoff:
+                os.unlink(path)
+                removed += 1
+
+    for name in os.listdir(upload_tmp_dir):
+        path = os.path.join(upload_tmp_dir, name)
+        if os.path.getmtime(path) < cutoff:
+            os.unlink(path)
+            removed += 1
+
+    logger.info(f'Garbage collection removed {removed} files')
+    return removed
+
+
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1:] != ['collect-garbage']:
+        sys.exit(f'usage: {sys.argv[0]} collect-garbage')
+    print(f'Removed {collect_garbage()} files')
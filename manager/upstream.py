@@ -0,0 +1,141 @@
+'''
+Shared HTTP client for upstream services (builder, ranker, bionames, ...)
+'''
+
+import os
+import time
+import logging
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for a connection and for each read from it
+connect_timeout = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 3.05))
+read_timeout = float(os.environ.get('UPSTREAM_READ_TIMEOUT', 30))
+
+# Kept-alive connections per upstream host
+pool_size = int(os.environ.get('UPSTREAM_POOL_SIZE', 20))
+
+# Retries of idempotent requests on connection errors and 502/503/504,
+# waiting backoff * 2**n seconds between them
+max_retries = int(os.environ.get('UPSTREAM_RETRIES', 2))
+retry_backoff = float(os.environ.get('UPSTREAM_RETRY_BACKOFF', 0.2))
+
+# A host failing failure_threshold requests in a row is not called for
+# reset_timeout seconds
+failure_threshold = int(os.environ.get('UPSTREAM_FAILURE_THRESHOLD', 5))
+reset_timeout = float(os.environ.get('UPSTREAM_RESET_TIMEOUT', 30))
+
+
+class UpstreamUnavailable(requests.exceptions.ConnectionError):
+    '''Raised instead of calling a host whose circuit breaker is open.'''
+
+
+class CircuitBreaker():
+    '''
+    Failure counter of one upstream host.
+
+    After failure_threshold failures in a row the breaker opens and calls
+    are refused for reset_timeout seconds. Then one trial call is let
+    through: success closes the breaker, failure opens it again.
+    '''
+
+    def __init__(self, failure_threshold, reset_timeout, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened = None
+        self._trial = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened is None:
+                return 'closed'
+            if self._clock() - self._opened < self.reset_timeout:
+                return 'open'
+            return 'half-open'
+
+    def allow(self):
+        '''Whether a call may be made now.'''
+        with self._lock:
+            if self._opened is None:
+                return True
+            if self._clock() - self._opened < self.reset_timeout or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                self._opened = self._clock()
+            self._trial = False
+
+
+class UpstreamClient():
+    '''
+    requests.Session with pooled keep-alive connections, timeouts, retries
+    of GETs and a circuit breaker per host.
+    '''
+
+    def __init__(self):
+        self.session = requests.Session()
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=retry_backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, url):
+        '''The circuit breaker of the host of url.'''
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(failure_threshold, reset_timeout)
+            return self._breakers[host]
+
+    def request(self, method, url, **kwargs):
+        breaker = self.breaker(url)
+        if not breaker.allow():
+            raise UpstreamUnavailable(f'{urlsplit(url).netloc} is failing, not calling it for now')
+        kwargs.setdefault('timeout', (connect_timeout, read_timeout))
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            breaker.failure()
+            raise
+        if response.status_code >= 500:
+            breaker.failure()
+        else:
+            breaker.success()
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+
+upstream = UpstreamClient()
@@ -18,11 +18,13 @@ class AppConfig {
     // Other URLs that are primarily used for API calls
     this.apis = {
       viewData: id => this.url(`api/simple/view/${id}`),
+      pubmed: this.url('api/pubmed/'),
     };
 
     this.url = this.url.bind(this);
 
     this.viewData = this.viewData.bind(this);
+    this.getPubmedPublications = this.getPubmedPublications.bind(this);
 
     this.colors = {
       bluegray: '#f5f7fa',
@@ -42,6 +44,31 @@ class AppConfig {
     );
   }
 
+  // Publications of many PMIDs, requested in batches of at most 500.
+  // successFun is called with the publications and the errors by PMID as
+  // batches come in.
+  // Those still being fetched from PubMed are requested again a second later.
+  getPubmedPublications(pmids, successFun, failureFun, fields = null) {
+    const batchSize = 500;
+    for (let i = 0; i < pmids.length; i += batchSize) {
+      const data = { pmids: pmids.slice(i, i + batchSize) };
+      if (fields) {
+        data.fields = fields;
+      }
+      this.postRequest(
+        this.apis.pubmed,
+        data,
+        (result) => {
+          successFun(result.publications, result.errors);
+          if (result.pending.length) {
+            setTimeout(() => this.getPubmedPublications(result.pending, successFun, failureFun, fields), 1000);
+          }
+        },
+        failureFun,
+      );
+    }
+  }
+
   open(url) {
     window.open(url, '_blank'); // This will not open a new tab in all browsers, but will try
   }
@@ -82,7 +109,7 @@ class AppConfig {
       console.log(err);
     },
   ) {
-    this.comms.post(addr, data).then((result) => {
+    this.comms.post(addr, data, { cancelToken: this.cancelToken.token }).then((result) => {
       successFunction(result.data);
     }).catch((err) => {
       failureFunction(err);
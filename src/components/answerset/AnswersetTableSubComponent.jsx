@@ -99,14 +99,13 @@ class AnswersetTableSubComponent extends React.Component {
     const ansId = rowData.id;
     this.props.store.updateActiveAnswerId(ansId);
     let graph = this.props.store.activeAnswerGraph;
-    // returns the array of calls to make, and an array of node pairs
-    const { calls, nodes } = this.makeNodePairs(graph.node_list, graph.edge_list);
-    // async calls for omnicorp publications
-    this.fetchGraphSupport(calls)
+    // returns an array of node pairs
+    const nodes = this.makeNodePairs(graph.node_list, graph.edge_list);
+    // one batch call for the omnicorp publications of all pairs
+    this.fetchGraphSupport(nodes)
       .then((result) => {
-        const pubs = [];
-        // put all the publications into one array
-        result.forEach(graphTest => pubs.push(graphTest.data));
+        // publications of each pair, in order; pairs that failed have none
+        const pubs = result.data.map(pairResult => pairResult.publications || []);
         // adds support edges to graph object
         graph = this.addSupportEdges(graph, pubs, nodes);
         // this signifies that the graph is updated and to display the SubGraphViewer
@@ -118,18 +117,13 @@ class AnswersetTableSubComponent extends React.Component {
   }
 
   makeNodePairs(nodes, edges) {
-    const axiosArray = [];
     const nodePairs = [];
-    // const addrFun = (id1, id2) => `${config.protocol}://${config.host}:${config.port}/api/omnicorp/${id1}/${id2}`;
     for (let i = 0; i < nodes.length; i += 1) {
       if (!(('isSet' in nodes[i]) && nodes[i].isSet)) {
         for (let m = i + 1; m < nodes.length; m += 1) {
           if (!(('isSet' in nodes[m]) && nodes[m].isSet)) {
             // Both i and m are not from a set.
 
-            // builds the api call address and pushes it into an array for the promises
-            // const addr = addrFun(nodes[i].id, nodes[m].id);
-            // axiosArray.push(axios.get(addr));
             // putting the node pairs as an array into an array for when we make the edges
             nodePairs.push([nodes[i].id, nodes[m].id]);
           }
@@ -143,15 +137,12 @@ class AnswersetTableSubComponent extends React.Component {
         const existingPair = nodePairs.find(p => ((p[0] === e.source_id) && (p[1] === e.target_id)) || ((p[1] === e.source_id) && (p[0] === e.target_id)));
         if (!existingPair) {
           // We need to add this pair
-          // const addr = addrFun(e.source_id, e.target_id);
-          // axiosArray.push(axios.get(addr));
           nodePairs.push([e.source_id, e.target_id]);
         }
       }
     });
 
-    const results = { calls: axiosArray, nodes: nodePairs };
-    return results;
+    return nodePairs;
   }
 
   addSupportEdges(graph, edgePubs, nodes) {
@@ -190,9 +181,13 @@ class AnswersetTableSubComponent extends React.Component {
     return updatedGraph;
   }
 
-  fetchGraphSupport(axiosCalls) {
-    // async call all of the axios calls for edge publications
-    return Promise.all(axiosCalls);
+  fetchGraphSupport(nodePairs) {
+    // async call for the edge publications of all node pairs at once
+    if (!nodePairs.length) {
+      return Promise.resolve({ data: [] });
+    }
+    const addr = `${config.protocol}://${config.host}:${config.port}/api/omnicorp/`;
+    return axios.post(addr, { pairs: nodePairs });
   }
 
   modalClose() {
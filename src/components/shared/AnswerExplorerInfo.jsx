@@ -465,28 +465,41 @@ class AnswerExplorerInfo extends React.Component {
       return { ...defaultInfo, ...paperInfo };
     };
 
-    const getPubmedInformation = (pmid) => {
+    const pmids = publications.map((pmid) => {
       let pmidStr = pmid.toString();
       if ((typeof pmidStr === 'string' || pmidStr instanceof String) && (pmidStr.indexOf(':') !== -1)) {
         // pmidStr has a colon, and therefore probably a curie, remove it.
         pmidStr = pmidStr.substr(pmidStr.indexOf(':') + 1);
       }
+      return pmidStr;
+    });
 
-      return new Promise((resolve, reject) => {
-        this.appConfig.getPubmedPublications(
-          pmidStr,
-          (pub) => {
-            resolve(getInfo(pub));
-          },
-          (err) => {
-            console.log(err);
-            reject(defaultInfo);
-          },
-        );
-      });
-    };
+    // All publications in a few batch requests; failed ones get defaultInfo
+    const getPubmedInformation = () => new Promise((resolve) => {
+      const pubs = {};
+      const remaining = new Set(pmids);
+      const finish = () => resolve(pmids.map(pmid => (pubs[pmid] ? getInfo(pubs[pmid]) : defaultInfo)));
+      if (!remaining.size) {
+        finish();
+        return;
+      }
+      this.appConfig.getPubmedPublications(
+        pmids,
+        (found, errors) => {
+          Object.keys(found).forEach((pmid) => { pubs[pmid] = found[pmid]; remaining.delete(pmid); });
+          Object.keys(errors).forEach((pmid) => { remaining.delete(pmid); });
+          if (!remaining.size) {
+            finish();
+          }
+        },
+        (err) => {
+          console.log(err);
+          finish();
+        },
+      );
+    });
 
-    Promise.all(publications.map(pmid => new Promise(resolve => resolve(getPubmedInformation(pmid))))).then((data) => {
+    getPubmedInformation().then((data) => {
       // Transform the data into a json blob and give it a url
       // const json = JSON.stringify(data);
       // const blob = new Blob([json], { type: 'application/json' });
@@ -34,41 +34,63 @@ class PubmedList extends React.Component {
 
     this.noRowsRenderer = this.noRowsRenderer.bind(this);
     this.rowRenderer = this.rowRenderer.bind(this);
+    this.fetchPublications = this.fetchPublications.bind(this);
+  }
+
+  componentDidMount() {
+    this.fetchPublications();
+  }
+
+  componentDidUpdate(prevProps) {
+    if (prevProps.publications !== this.props.publications) {
+      this.fetchPublications();
+    }
   }
 
   componentWillUnmount() {
     this.appConfig.cancelToken.cancel('Pubmed request canceled');
   }
 
-  rowRenderer({
-    index,
-    key,
-    style,
-    isScrolling,
-  }) {
+  pmid(index) {
     let pmid = this.props.publications[index].toString();
     if ((typeof pmid === 'string' || pmid instanceof String) && (pmid.indexOf(':') !== -1)) {
       // pmidStr has a colon, and therefore probably a curie, remove it.
       pmid = pmid.substr(pmid.indexOf(':') + 1);
     }
-    let publication = 'Loading...';
-    if (this.state.pubs[index]) {
-      publication = <PubmedEntry pub={this.state.pubs[index]} />;
-    } else if (!isScrolling) {
-      this.appConfig.getPubmedPublications(
-        pmid,
-        (pub) => {
-          const { pubs } = this.state;
-          pubs[index] = pub;
-          this.list.forceUpdateGrid();
-          this.setState({ pubs });
-        },
-        (err) => {
-          if (err.message !== 'Pubmed request canceled') {
-            console.log('error', err);
+    return pmid;
+  }
+
+  fetchPublications() {
+    // The whole list is requested at once rather than a row at a time
+    const pmids = this.props.publications.map((pub, index) => this.pmid(index));
+    this.setState({ pubs: {} });
+    this.appConfig.getPubmedPublications(
+      pmids,
+      (found) => {
+        this.setState(state => ({ pubs: { ...state.pubs, ...found } }), () => {
+          if (this.list) {
+            this.list.forceUpdateGrid();
           }
-        },
-      );
+        });
+      },
+      (err) => {
+        if (err.message !== 'Pubmed request canceled') {
+          console.log('error', err);
+        }
+      },
+      ['uid', 'title', 'authors', 'fulljournalname', 'source', 'pubdate', 'elocationid'],
+    );
+  }
+
+  rowRenderer({
+    index,
+    key,
+    style,
+  }) {
+    const pub = this.state.pubs[this.pmid(index)];
+    let publication = 'Loading...';
+    if (pub) {
+      publication = <PubmedEntry pub={pub} />;
     }
     return (
       <div